@@ -0,0 +1,67 @@
+"""
+Compares free and schema-constrained decoding for both agents: parse-failure rate
+and end-to-end latency per note.
+
+    python benchmarks/bench_constrained.py --model google/medgemma-4b-it --notes 20
+    python benchmarks/bench_constrained.py --tiny    # offline smoke run on the test model
+"""
+import os
+import sys
+import argparse
+import statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.agents.agent2 import PlanAnalyzer
+from bench_prefix_cache import sample_patient
+
+
+def run(agent_cls, pipe, constrained, notes):
+    agent = agent_cls(pipe, constrained=constrained)
+    failures, latencies = 0, []
+    for i in range(notes):
+        # One item per call so the wall time is the end-to-end latency of that note
+        if agent_cls is SoapNoteGenerator:
+            _, stats = agent.generate_batch([sample_patient(i)], use_cache=False)
+        else:
+            plan = {"medications": ["Omeprazole 20mg once daily"], "lab_tests": ["CBC"], "follow_up": "2 weeks"}
+            _, stats = agent.analyze_batch([{"assessment": f"Note {i}"}], [plan], use_cache=False)
+        item = stats["items"][0]
+        failures += not item["parsed"]
+        latencies.append(item["wall_time"])
+    return failures / notes, statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark schema-constrained JSON decoding.")
+    parser.add_argument("--model", default="google/medgemma-4b-it")
+    parser.add_argument("--notes", type=int, default=10)
+    parser.add_argument("--tiny", action="store_true", help="Use the tiny random test model instead of --model.")
+    args = parser.parse_args()
+
+    if args.tiny:
+        sys.path.insert(0, os.path.join(HERE, "..", "tests"))
+        from tiny_model import TinyChatPipe
+        pipe = TinyChatPipe()
+    else:
+        import torch
+        from transformers import pipeline
+        pipe = pipeline(
+            "image-text-to-text",
+            model=args.model,
+            torch_dtype=torch.bfloat16,
+            device="cuda" if torch.cuda.is_available() else "cpu",
+        )
+
+    for agent_cls in (SoapNoteGenerator, PlanAnalyzer):
+        for constrained in (False, True):
+            failure_rate, latency = run(agent_cls, pipe, constrained, args.notes)
+            mode = "constrained" if constrained else "free"
+            print(f"{agent_cls.__name__:18s} {mode:11s} parse failures {failure_rate * 100:5.1f}%  "
+                  f"mean latency {latency:.2f}s/note")
+
+
+if __name__ == "__main__":
+    main()
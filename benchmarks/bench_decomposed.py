@@ -0,0 +1,67 @@
+"""
+Compares Agent 2 as one long reply against the decomposed mode (short per-section
+prompts in one batch, SOAP note assembled locally): latency, generated tokens and
+parse failures per note.
+
+    python benchmarks/bench_decomposed.py --model google/medgemma-4b-it --notes 10
+    python benchmarks/bench_decomposed.py --tiny    # offline smoke run on the test model
+"""
+import os
+import sys
+import argparse
+import statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from medflow.agents.agent2 import PlanAnalyzer
+
+PLAN = {"medications": ["Omeprazole 20mg once daily"], "lab_tests": ["H. pylori test", "CBC"], "follow_up": "2 weeks"}
+
+
+def sample_note(i):
+    return {
+        "subjective": {"chief_complaint": "Burning epigastric pain", "history_of_present_illness": f"{i + 2} weeks"},
+        "objective": {"vital_signs": {"blood_pressure": "120/80", "heart_rate": "78"}},
+        "assessment": "Suspected gastritis",
+    }
+
+
+def run(pipe, decomposed, constrained, notes):
+    agent = PlanAnalyzer(pipe, constrained=constrained, decomposed=decomposed)
+    failures, latencies, tokens = 0, [], []
+    for i in range(notes):
+        # One note per call so the wall time is the end-to-end latency of that note
+        _, stats = agent.analyze_batch([sample_note(i)], [PLAN], use_cache=False)
+        item = stats["items"][0]
+        failures += not item["parsed"]
+        latencies.append(item["wall_time"])
+        tokens.append(item["output_tokens"] or 0)
+    return failures / notes, statistics.mean(latencies), statistics.mean(tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the decomposed Agent 2 mode.")
+    parser.add_argument("--model", default="google/medgemma-4b-it")
+    parser.add_argument("--notes", type=int, default=5)
+    parser.add_argument("--constrained", action="store_true", help="Use schema-constrained decoding in both modes.")
+    parser.add_argument("--tiny", action="store_true", help="Use the tiny random test model instead of --model.")
+    args = parser.parse_args()
+
+    if args.tiny:
+        sys.path.insert(0, os.path.join(HERE, "..", "tests"))
+        from tiny_model import TinyChatPipe
+        pipe = TinyChatPipe()
+    else:
+        from medflow.model import load_pipeline
+        pipe = load_pipeline(args.model)
+
+    for decomposed in (False, True):
+        failure_rate, latency, tokens = run(pipe, decomposed, args.constrained, args.notes)
+        mode = "decomposed" if decomposed else "one reply"
+        print(f"{mode:10s} parse failures {failure_rate * 100:5.1f}%  mean latency {latency:.2f}s/note  "
+              f"{tokens:.0f} generated tokens/note")
+
+
+if __name__ == "__main__":
+    main()
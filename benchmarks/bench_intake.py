@@ -0,0 +1,70 @@
+"""
+Compares Agent 1 generating the whole S/O/A note against the pre-structured mode,
+where vitals, lists and missing fields are filled deterministically and the model
+only writes the narrative: prompt tokens, generated tokens and latency per note.
+
+    python benchmarks/bench_intake.py --model google/medgemma-4b-it --notes 10
+    python benchmarks/bench_intake.py --tiny --constrained    # offline smoke run on the test model
+"""
+import os
+import sys
+import argparse
+import statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from bench_prefix_cache import sample_patient
+
+
+def run(pipe, prestructured, constrained, notes):
+    agent = SoapNoteGenerator(pipe, constrained=constrained, prestructured=prestructured)
+    prompt_tokens, output_tokens, latencies, failures = [], [], [], 0
+    for i in range(notes):
+        # One note per call so the wall time is the end-to-end latency of that note
+        _, stats = agent.generate_batch([sample_patient(i)], use_cache=False)
+        item = stats["items"][0]
+        prompt_tokens.append(item["prompt_tokens"] or 0)
+        output_tokens.append(item["output_tokens"] or 0)
+        latencies.append(item["wall_time"])
+        failures += not item["parsed"]
+    return {
+        "prompt_tokens": statistics.mean(prompt_tokens),
+        "output_tokens": statistics.mean(output_tokens),
+        "latency": statistics.mean(latencies),
+        "failure_rate": failures / notes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pre-structured intake for Agent 1.")
+    parser.add_argument("--model", default="google/medgemma-4b-it")
+    parser.add_argument("--notes", type=int, default=5)
+    parser.add_argument("--constrained", action="store_true", help="Use schema-constrained decoding in both modes.")
+    parser.add_argument("--tiny", action="store_true", help="Use the tiny random test model instead of --model.")
+    args = parser.parse_args()
+
+    if args.tiny:
+        sys.path.insert(0, os.path.join(HERE, "..", "tests"))
+        from tiny_model import TinyChatPipe
+        pipe = TinyChatPipe()
+    else:
+        from medflow.model import load_pipeline
+        pipe = load_pipeline(args.model)
+
+    full = run(pipe, False, args.constrained, args.notes)
+    narrative = run(pipe, True, args.constrained, args.notes)
+    for mode, result in (("full note", full), ("narrative", narrative)):
+        print(f"{mode:10s} prompt {result['prompt_tokens']:6.0f} tokens  output {result['output_tokens']:5.0f} tokens  "
+              f"latency {result['latency']:.2f}s/note  parse failures {result['failure_rate'] * 100:5.1f}%")
+
+    def reduction(key):
+        return (1 - narrative[key] / full[key]) * 100 if full[key] else 0.0
+
+    print(f"Reduction: prompt {reduction('prompt_tokens'):.0f}%, output {reduction('output_tokens'):.0f}%, "
+          f"latency {reduction('latency'):.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Fuzzes the salvaging parser (medflow.utils.json_repair) with damaged copies of agent
+replies and reports how much of each reply a strict parse and the salvaging parse
+recover, then times the parser on growing inputs to check that it stays linear.
+
+The default corpus, benchmarks/data/synthetic_outputs.jsonl, holds a few hand-written
+replies in the shape the agents produce. Pass --corpus with a file recorded by
+`--record` (see medflow.serving.replay) to fuzz real model output instead.
+
+Damage applied to each reply:
+  truncate   cut off at a random point, as at max_new_tokens
+  comma      trailing commas before closing brackets
+  python     True/False/None instead of true/false/null
+  quotes     single-quoted strings
+  newline    raw newlines inside strings
+  random     a few random characters deleted or inserted
+
+    python benchmarks/bench_json_repair.py
+    python benchmarks/bench_json_repair.py --samples 200 --sizes 100 1000 10000 100000
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from medflow.utils.json_stream import extract_json_object
+from medflow.utils.json_repair import salvage_object
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "synthetic_outputs.jsonl")
+
+
+def truncate(text, rng):
+    return text[:rng.randrange(1, len(text))]
+
+
+def trailing_commas(text, rng):
+    return re.sub(r"(\S)(\s*[}\]])", r"\1,\2", text)
+
+
+def python_literals(text, rng):
+    return re.sub(r"\btrue\b|\bfalse\b|\bnull\b",
+                  lambda m: {"true": "True", "false": "False", "null": "None"}[m.group(0)], text)
+
+
+def single_quotes(text, rng):
+    return re.sub(r'"((?:[^"\\\']|\\.)*)"', r"'\1'", text)
+
+
+def raw_newlines(text, rng):
+    return re.sub(r'(": "[^"\\]*?) ', r"\1\n", text, count=3)
+
+
+def random_edits(text, rng):
+    chars = list(text)
+    for _ in range(3):
+        i = rng.randrange(len(chars))
+        if rng.random() < 0.5:
+            del chars[i]
+        else:
+            chars.insert(i, rng.choice('{}[],:"\' x'))
+    return "".join(chars)
+
+
+DAMAGE = {
+    "truncate": truncate,
+    "comma": trailing_commas,
+    "python": python_literals,
+    "quotes": single_quotes,
+    "newline": raw_newlines,
+    "random": random_edits,
+}
+
+
+# Damage that keeps every value intact, so recovered values must equal the reference
+LOSSLESS = {"truncate", "comma", "python", "quotes"}
+
+
+def strict_parse(text):
+    try:
+        value = json.loads(extract_json_object(text))
+    except json.JSONDecodeError:
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+def load_corpus(path):
+    replies = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line) if line.strip() else {}
+            # Recorded corpora also hold system prompt lines
+            if "text" not in record:
+                continue
+            text = record["text"]
+            reference = strict_parse(text)
+            if reference:
+                replies.append((text, reference))
+    return replies
+
+
+def recovered(data, reference, key, exact):
+    return key in data and (not exact or data[key] == reference[key])
+
+
+def fuzz(replies, samples, rng):
+    """
+    Per damage kind: fraction of reference keys recovered (with their exact value for
+    lossless damage) and, for lossless damage, kept keys whose value is wrong.
+    """
+    totals = defaultdict(lambda: {"keys": 0, "strict": 0, "salvaged": 0, "wrong": 0})
+    for _ in range(samples):
+        text, reference = rng.choice(replies)
+        for kind, damage in DAMAGE.items():
+            damaged = damage(text, rng)
+            strict = strict_parse(damaged)
+            salvaged = salvage_object(damaged, expected=list(reference))
+            exact = kind in LOSSLESS
+            stats = totals[kind]
+            stats["keys"] += len(reference)
+            stats["strict"] += sum(recovered(strict, reference, key, exact) for key in reference)
+            stats["salvaged"] += sum(recovered(salvaged.data, reference, key, exact) for key in reference)
+            if exact:
+                stats["wrong"] += sum(key in salvaged.data and salvaged.data[key] != value
+                                      for key, value in reference.items())
+    return totals
+
+
+def large_reply(members):
+    body = ",\n".join(f'  "field_{i}": {{"text": "value {i}, with \\"quotes\\"", "score": {i % 100}, '
+                      f'"items": [1, 2, 3], "flag": True}}' for i in range(members))
+    # Python literals force the repair path, and the reply is cut off mid-member
+    text = "{\n" + body + ",\n}"
+    return text[:-len(text) // (members * 4)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz and time the salvaging JSON parser.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSONL file with a 'text' field per reply, e.g. a recorded corpus.")
+    parser.add_argument("--samples", type=int, default=100, help="Damaged copies per damage kind.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000],
+                        help="Members of the synthetic replies used for timing.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    replies = load_corpus(args.corpus)
+    print(f"Fuzzing {len(replies)} replies, {args.samples} samples per damage kind")
+    for kind, stats in fuzz(replies, args.samples, rng).items():
+        wrong = stats["wrong"] if kind in LOSSLESS else "-"
+        print(f"  {kind:9s} keys recovered: strict {stats['strict'] / stats['keys'] * 100:5.1f}%  "
+              f"salvaged {stats['salvaged'] / stats['keys'] * 100:5.1f}%  wrong values {wrong}")
+
+    print("Timing (linear time means constant microseconds per KB):")
+    for members in args.sizes:
+        text = large_reply(members)
+        t0 = time.perf_counter()
+        salvaged = salvage_object(text)
+        elapsed = time.perf_counter() - t0
+        print(f"  {members:7d} members  {len(text) / 1e6:7.2f} MB  {elapsed:7.3f}s  "
+              f"{elapsed * 1e6 / (len(text) / 1024):6.1f} us/KB  recovered {len(salvaged.data)} members")
+
+
+if __name__ == "__main__":
+    main()
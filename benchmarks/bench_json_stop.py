@@ -0,0 +1,69 @@
+"""
+Reports how many generated tokens per call the JSON stopping criterion saves on a
+corpus of agent outputs.
+
+Every token after the top-level object closes (closing fences, explanations,
+disclaimers) is generated for nothing; with the criterion generation ends on the
+closing brace. Token counts use the model tokenizer when --tokenizer is given and a
+word/punctuation approximation otherwise.
+
+The default corpus, benchmarks/data/synthetic_outputs.jsonl, is a few hand-written
+replies: it shows what the script reports, not what the model saves. Measure with a
+corpus recorded from the model by `--record` (see medflow.serving.replay).
+
+    python benchmarks/bench_json_stop.py --corpus calls.jsonl --tokenizer google/medgemma-4b-it
+"""
+import os
+import re
+import sys
+import json
+import argparse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from medflow.utils.json_stream import JSONObjectScanner
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "synthetic_outputs.jsonl")
+
+
+def approx_tokens(text):
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure tokens saved by stopping at the JSON object close.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSONL file with a 'text' field per reply, e.g. a recorded corpus.")
+    parser.add_argument("--tokenizer", help="Hugging Face tokenizer to count tokens with.")
+    args = parser.parse_args()
+
+    count = approx_tokens
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+        count = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+    totals = defaultdict(lambda: {"calls": 0, "generated": 0, "saved": 0})
+    with open(args.corpus) as f:
+        for line in f:
+            record = json.loads(line) if line.strip() else {}
+            # Recorded corpora also hold system prompt lines
+            if "text" not in record:
+                continue
+            scanner = JSONObjectScanner()
+            scanner.feed(record["text"])
+            kept = record["text"][:scanner.end] if scanner.done else record["text"]
+
+            generated = count(record["text"])
+            stats = totals[record.get("agent", "all calls")]
+            stats["calls"] += 1
+            stats["generated"] += generated
+            stats["saved"] += generated - count(kept)
+
+    for agent, stats in sorted(totals.items()):
+        print(f"{agent}: {stats['calls']} calls, {stats['saved'] / stats['calls']:.1f} tokens saved per call "
+              f"({stats['saved'] / stats['generated'] * 100:.1f}% of generated tokens)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Offline load generator. Drives the app's step 1 and step 2 (medflow.app_pro.run_step1
+and run_step2) or the agents' batch methods at increasing concurrency, and reports
+p50/p95/p99 latency and throughput per level.
+
+Generation is served by a ReplayPipe over a corpus recorded from the real model
+(medflow.serving.replay), so neither the model nor HF_TOKEN is needed. Record one with
+`--record PATH` on `medflow batch` or `medflow serve`, or with this script and --model.
+
+Modes:
+  step1   run_step1, streamed to the end
+  step2   run_step2 on a note from step 1, including the PDF
+  flow    step 1 then step 2, as one request
+  batch   generate_batch then analyze_batch on --batch-size cases, as one request
+
+    python benchmarks/bench_load.py --replay calls.jsonl --mode flow --concurrency 1 4 16 --requests 64
+    python benchmarks/bench_load.py --replay calls.jsonl --mode batch --batch-size 8 --time-scale 0.5
+    python benchmarks/bench_load.py --model google/medgemma-4b-it --record calls.jsonl --requests 20
+    python benchmarks/bench_load.py --tiny --constrained --record calls.jsonl --requests 2 --concurrency 1   # offline smoke run
+"""
+import io
+import os
+import sys
+import math
+import time
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+sys.path.insert(0, os.path.join(HERE, "..", "tests"))
+
+from medflow import app_pro
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.agents.agent2 import PlanAnalyzer
+from medflow.serving.replay import RecordingPipe, ReplayPipe
+from medflow.serving.scheduler import MicroBatchScheduler
+from medflow.utils.metrics import METRICS
+from bench_prefix_cache import sample_patient
+
+PLAN = {"medications": ["Amlodipine 5mg daily"], "lab_tests": ["Lipid panel", "ECG"], "follow_up": "2 weeks"}
+ETHNICITY = "South Asian"
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile, `q` in [0, 100]."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def step1_inputs(i):
+    p = sample_patient(i)
+    return (f"Patient {i}", f"P-{i:05d}", p["age"], p["gender"], ", ".join(p["symptoms"]), p["duration"],
+            p["severity"], ", ".join(p["medical_history"]), ", ".join(p["medications"]),
+            p["vitals"]["blood_pressure"], p["vitals"]["heart_rate"], None)
+
+
+def last(generator):
+    item = None
+    for item in generator:
+        pass
+    return item
+
+
+def run_step1(i):
+    output, encounter_id = last(app_pro.run_step1(*step1_inputs(i), fresh=True))
+    if "error" in output:
+        raise RuntimeError(output["error"])
+    return encounter_id
+
+
+def run_step2(encounter_id):
+    output, pdf = last(app_pro.run_step2(encounter_id, ", ".join(PLAN["medications"]), ", ".join(PLAN["lab_tests"]),
+                                         PLAN["follow_up"], ETHNICITY, fresh=True))
+    if "error" in output:
+        raise RuntimeError(output["error"])
+    # The PDF is part of the measured work, but not worth keeping
+    if pdf and os.path.exists(pdf):
+        os.remove(pdf)
+
+
+def make_request(mode, batch_size, encounter_id):
+    if mode == "step1":
+        return run_step1
+    if mode == "step2":
+        return lambda i: run_step2(encounter_id)
+    if mode == "flow":
+        return lambda i: run_step2(run_step1(i))
+
+    def batch(i):
+        patients = [sample_patient(i * batch_size + n) for n in range(batch_size)]
+        notes, _ = app_pro.generator.generate_batch(patients, batch_size=batch_size, use_cache=False)
+        app_pro.analyzer.analyze_batch(notes, [PLAN] * batch_size, [ETHNICITY] * batch_size,
+                                       batch_size=batch_size, use_cache=False)
+    return batch
+
+
+def run_level(request, concurrency, requests):
+    """Runs `requests` requests, `concurrency` at a time. Returns (latencies, errors, elapsed)."""
+    def timed(i):
+        t0 = time.perf_counter()
+        try:
+            request(i)
+        except Exception:
+            return None
+        return time.perf_counter() - t0
+
+    METRICS.reset()
+    t0 = time.perf_counter()
+    # The app and the agents print per request; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - t0
+    latencies = [r for r in results if r is not None]
+    return latencies, len(results) - len(latencies), elapsed
+
+
+def mean_time_to_first_field(mode):
+    """Mean of the app's first_field stage over the last level, or None (batch mode)."""
+    step = "step2" if mode == "step2" else "step1"
+    series = METRICS.snapshot()["histograms"].get("medflow_stage_seconds", {})
+    histogram = series.get((("stage", "first_field"), ("step", step)))
+    return histogram["sum"] / histogram["count"] if histogram else None
+
+
+def load_pipe(args):
+    if args.tiny:
+        from tiny_model import TinyChatPipe
+        pipe = TinyChatPipe()
+    elif args.model:
+        from medflow.model import load_pipeline
+        pipe = load_pipeline(args.model)
+    else:
+        pipe = ReplayPipe(args.replay, time_scale=args.time_scale, capacity=args.capacity)
+    return RecordingPipe(pipe, args.record) if args.record else pipe
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load generator for the app and batch paths.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--replay", help="Replay corpus recorded with --record.")
+    source.add_argument("--model", help="Load this model instead of replaying (e.g. to record a corpus).")
+    source.add_argument("--tiny", action="store_true", help="Use the tiny offline test model.")
+    parser.add_argument("--record", default=None, help="Also record every model call to this corpus.")
+    parser.add_argument("--mode", choices=["step1", "step2", "flow", "batch"], default="flow")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Levels to run.")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level.")
+    parser.add_argument("--batch-size", type=int, default=8, help="Cases per request in batch mode.")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Replay delay multiplier; 0 for no delay.")
+    parser.add_argument("--capacity", type=int, default=1, help="Replayed calls served at once (model workers).")
+    parser.add_argument("--constrained", action="store_true", help="Schema-constrained decoding in both agents.")
+    parser.add_argument("--prestructure-intake", action="store_true")
+    parser.add_argument("--decompose-analysis", action="store_true")
+    args = parser.parse_args()
+
+    pipe = load_pipe(args)
+    # Time to the first streamed field is read back from the app's metrics
+    METRICS.enable()
+    # Same wiring as app_pro.get_agents, over the chosen pipe
+    scheduled = pipe if args.mode == "batch" else MicroBatchScheduler(
+        pipe, max_batch_size=8, max_wait_ms=50, dispatchers=args.capacity)
+    app_pro.generator = SoapNoteGenerator(scheduled, constrained=args.constrained,
+                                          prestructured=args.prestructure_intake)
+    app_pro.analyzer = PlanAnalyzer(scheduled, constrained=args.constrained, decomposed=args.decompose_analysis)
+    app_pro._agents_loaded = True
+
+    encounter_id = None
+    if args.mode == "step2":
+        with contextlib.redirect_stdout(io.StringIO()):
+            encounter_id = run_step1(0)
+    request = make_request(args.mode, args.batch_size, encounter_id)
+
+    unit = "cases" if args.mode == "batch" else "req"
+    print(f"Mode {args.mode}, {args.requests} requests per level")
+    print(f"{'concurrency':>11} {'errors':>6} {unit + '/s':>9} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8}"
+          f" {'ttff avg':>8}")  # time to the first streamed field
+    for concurrency in args.concurrency:
+        latencies, errors, elapsed = run_level(request, concurrency, args.requests)
+        done = len(latencies) * (args.batch_size if args.mode == "batch" else 1)
+        cells = [percentile(latencies, q) for q in (50, 95, 99)] + [mean_time_to_first_field(args.mode)]
+        print(f"{concurrency:11d} {errors:6d} {done / elapsed:9.2f} "
+              + " ".join(f"{c:8.3f}" if c is not None else f"{'-':>8}" for c in cells))
+    if isinstance(pipe, ReplayPipe):
+        print(f"Replayed {pipe.exact} exact and {pipe.fallbacks} same-prompt replies")
+    if isinstance(scheduled, MicroBatchScheduler):
+        scheduled.shutdown()
+
+
+if __name__ == "__main__":
+    main()
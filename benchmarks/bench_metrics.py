@@ -0,0 +1,83 @@
+"""
+Measures what the pipeline metrics (medflow.utils.metrics) cost: each recording call
+with metrics off and on, the per-token cost of the prefill/decode streamer on the
+tiny test model, and rendering the /metrics page.
+
+    python benchmarks/bench_metrics.py
+    python benchmarks/bench_metrics.py --calls 200000 --generations 20
+"""
+import os
+import sys
+import time
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+sys.path.insert(0, os.path.join(HERE, "..", "tests"))
+
+from medflow.utils.metrics import Metrics, timed_generate_kwargs, record_agent_call
+
+STATS = {"prompt_tokens": 900, "output_tokens": 300, "wall_time": 4.2, "parsed": True}
+
+
+def per_call(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def record_calls(metrics, calls):
+    def stage():
+        with metrics.stage("json_parse", agent="agent1"):
+            pass
+
+    return {
+        "inc": per_call(lambda: metrics.inc("medflow_agent_calls_total", agent="agent1", mode="full"), calls),
+        "stage": per_call(stage, calls),
+        "agent call": per_call(lambda: record_agent_call(metrics, "agent1", "full", STATS), calls),
+    }
+
+
+def generation(enabled, generations, max_new_tokens):
+    from tiny_model import TinyChatPipe
+
+    metrics = Metrics(enabled=enabled)
+    pipe = TinyChatPipe()
+    messages = [{"role": "user", "content": "Patient with a cough for two weeks."}]
+    pipe(messages, max_new_tokens=max_new_tokens)
+    start = time.perf_counter()
+    for _ in range(generations):
+        pipe(messages, max_new_tokens=max_new_tokens,
+             generate_kwargs=dict(timed_generate_kwargs(metrics, {}) or {}, min_new_tokens=max_new_tokens))
+    return (time.perf_counter() - start) / generations / max_new_tokens * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the overhead of the pipeline metrics.")
+    parser.add_argument("--calls", type=int, default=100000, help="Repetitions per recording call.")
+    parser.add_argument("--generations", type=int, default=10, help="Tiny-model generations per setting.")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    off, on = record_calls(Metrics(), args.calls), record_calls(Metrics(enabled=True), args.calls)
+    print("Recording call      off (ns)    on (ns)")
+    for name in off:
+        print(f"  {name:16s} {off[name]:9.0f} {on[name]:10.0f}")
+
+    plain = generation(False, args.generations, args.max_new_tokens)
+    timed = generation(True, args.generations, args.max_new_tokens)
+    print(f"Tiny-model decode: {plain:.1f} us/token without the streamer, {timed:.1f} us/token with it "
+          f"({(timed - plain) / plain * 100:+.1f}%)")
+
+    metrics = Metrics(enabled=True)
+    for agent in ("agent1", "agent2"):
+        for stage in ("prompt_build", "template", "prefill", "decode", "generate", "json_parse"):
+            metrics.observe("medflow_stage_seconds", 0.1, stage=stage, agent=agent)
+        record_agent_call(metrics, agent, "full", STATS)
+    render = per_call(metrics.render, 1000) / 1e3
+    print(f"Rendering /metrics ({len(metrics.render().splitlines())} lines): {render:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
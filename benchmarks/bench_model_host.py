@@ -0,0 +1,73 @@
+"""
+Compares N model workers that fork after a single load against N workers that each
+load their own copy: time until all workers are ready, and RSS/PSS per worker after
+one warm-up request each.
+
+    python benchmarks/bench_model_host.py --workers 4 --model google/medgemma-4b-it
+    python benchmarks/bench_model_host.py --workers 4 --tiny    # offline run on the test model
+"""
+import os
+import sys
+import argparse
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from medflow.model import load_pipeline
+from medflow.serving.model_host import ModelHost
+
+def load_model():
+    # Module-level, and configured through the environment, so spawned workers can use it
+    model = os.environ["MEDFLOW_BENCH_MODEL"]
+    if model == "tiny":
+        sys.path.insert(0, os.path.join(HERE, "..", "tests"))
+        from tiny_model import TinyChatPipe
+        return TinyChatPipe()
+    return load_pipeline(model)
+
+
+def warm_up(host):
+    # One concurrent request per worker, so each has run a forward pass
+    messages = [{"role": "user", "content": [{"type": "text", "text": "Patient reports a mild cough."}]}]
+    threads = [threading.Thread(target=host, kwargs={"text": messages, "max_new_tokens": 8})
+               for _ in range(host.num_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def mib(value):
+    return f"{value / 2 ** 20:8.1f}" if value is not None else "     n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fork-after-load model workers.")
+    parser.add_argument("--model", default="google/medgemma-4b-it")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--tiny", action="store_true", help="Use the tiny random test model instead of --model.")
+    args = parser.parse_args()
+    os.environ["MEDFLOW_BENCH_MODEL"] = "tiny" if args.tiny else args.model
+
+    for start_method in ("fork", "spawn"):
+        host = ModelHost(load_model, workers=args.workers, start_method=start_method).start()
+        try:
+            warm_up(host)
+            report = host.memory_report()
+        finally:
+            host.shutdown()
+
+        print(f"\n{start_method}: ready in {host.ready_seconds:.1f}s"
+              + (f" (load {host.load_seconds:.1f}s)" if host.load_seconds is not None else ""))
+        print(f"  {'process':10s} {'RSS MiB':>8s} {'PSS MiB':>8s}")
+        rows = [("host", report["host"])] + [(f"worker {i}", w) for i, w in enumerate(report["workers"])]
+        for name, usage in rows:
+            print(f"  {name:10s} {mib(usage['rss'])} {mib(usage['pss'])}")
+        pss = [usage["pss"] for _, usage in rows]
+        if None not in pss:
+            print(f"  {'total PSS':10s} {'':8s} {mib(sum(pss))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Measures PDF rendering throughput (PDFs/sec) for one worker against a process pool,
+over synthetic SOAP notes.
+
+    python benchmarks/bench_pdf.py --notes 2000 --workers 4
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from medflow.utils.pdf_generator import render_many
+
+
+def synthetic_note(i, out_dir):
+    soap = {
+        "subjective": {
+            "chief_complaint": f"Epigastric pain for {i % 14 + 1} days",
+            "history_of_present_illness": "Burning pain after meals, worse when lying down. " * 3,
+            "past_medical_history": "Hypertension",
+            "medications": "Amlodipine 5mg",
+            "allergies": "None known",
+        },
+        "objective": {
+            "vital_signs": {"blood_pressure": "128/82", "heart_rate": 70 + i % 20, "temperature": "36.8 C"},
+            "physical_exam": "Mild epigastric tenderness, no guarding.",
+        },
+        "assessment": "Likely gastroesophageal reflux disease.",
+        "plan": {"medications": ["Omeprazole 20mg once daily"], "lab_tests": ["CBC"], "follow_up": "2 weeks"},
+    }
+    analysis = {
+        "medicine_alignment": "Aligned with first-line therapy.",
+        "lab_test_recommendations": ["H. pylori breath test"],
+        "lifestyle_recommendations": {"diet": "Avoid late meals", "exercise": "Walk 30 minutes daily"},
+        "additional_notes": "Review if symptoms persist beyond 4 weeks.",
+        "safety_notice": "Seek care urgently for black stools or vomiting blood." if i % 5 == 0 else "",
+    }
+    return {
+        "soap_data": soap,
+        "agent2_output": analysis,
+        "filename": os.path.join(out_dir, f"note_{i}.pdf"),
+        "patient_name": f"Patient {i}",
+        "patient_id": f"P-{i:05d}",
+    }
+
+
+def timed(notes, workers):
+    t0 = time.perf_counter()
+    render_many(notes, workers=workers)
+    return len(notes) / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk SOAP PDF rendering.")
+    parser.add_argument("--notes", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        notes = [synthetic_note(i, out_dir) for i in range(args.notes)]
+        single = timed(notes, 1)
+        print(f"1 worker:  {single:7.1f} PDFs/s")
+        if args.workers > 1:
+            pooled = timed(notes, args.workers)
+            print(f"{args.workers} workers: {pooled:7.1f} PDFs/s ({pooled / single:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures the startup cost of each `medflow` subcommand: a fresh interpreter builds the
+CLI parser, parses the arguments and imports the modules the subcommand's handler
+imports, stopping before any real work (model loading, rendering). Also lists which
+heavy packages that pulled in.
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, "..", "src")
+
+HEAVY = ("torch", "transformers", "gradio", "PIL", "reportlab", "requests", "huggingface_hub")
+
+# Subcommand -> (example arguments, modules its handler imports)
+COMMANDS = {
+    "run": (["run"], ["medflow.main"]),
+    "batch": (["batch", "cases.jsonl"], ["medflow.batch", "medflow.model"]),
+    "pdf": (["pdf", "agent2_output.json"], ["medflow.utils.pdf_generator"]),
+    "graph": (["graph"], ["medflow.utils.visualization"]),
+    "serve": (["serve"], ["medflow.app_pro"]),
+}
+
+PROBE = """
+import sys, json, time, importlib
+t0 = time.perf_counter()
+from medflow.cli import build_parser
+build_parser().parse_args(json.loads(sys.argv[1]))
+for module in json.loads(sys.argv[2]):
+    importlib.import_module(module)
+elapsed = time.perf_counter() - t0
+print(json.dumps({"seconds": elapsed, "heavy": [m for m in json.loads(sys.argv[3]) if m in sys.modules]}))
+"""
+
+REFERENCE = """
+import sys, json, time, importlib
+t0 = time.perf_counter()
+for module in json.loads(sys.argv[1]):
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        pass
+print(json.dumps({"seconds": time.perf_counter() - t0, "heavy": [m for m in json.loads(sys.argv[1]) if m in sys.modules]}))
+"""
+
+
+def probe(script, *args):
+    env = dict(os.environ, PYTHONPATH=SRC)
+    out = subprocess.run([sys.executable, "-c", script, *args], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark medflow CLI startup time per subcommand.")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per subcommand; the median is shown.")
+    args = parser.parse_args()
+
+    for name, (argv, modules) in COMMANDS.items():
+        runs = [probe(PROBE, json.dumps(argv), json.dumps(modules), json.dumps(HEAVY)) for _ in range(args.repeat)]
+        seconds = statistics.median(r["seconds"] for r in runs)
+        print(f"{name:6s} {seconds * 1000:8.1f} ms  loads: {', '.join(runs[0]['heavy']) or '-'}")
+
+    # What every entry point paid when the model stack was imported at module load
+    runs = [probe(REFERENCE, json.dumps(["torch", "transformers", "gradio"])) for _ in range(args.repeat)]
+    seconds = statistics.median(r["seconds"] for r in runs)
+    print(f"{'(torch + transformers + gradio)':6s} {seconds * 1000:8.1f} ms  loads: {', '.join(runs[0]['heavy'])}")
+
+
+if __name__ == "__main__":
+    main()
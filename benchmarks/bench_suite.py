@@ -0,0 +1,345 @@
+"""
+End-to-end benchmark suite with regression thresholds.
+
+Times the hot paths without the model: prompt building and reply parsing for both
+agents, normalize_soap, PDF rendering of small and very large notes, the JSON Crack
+HTML export of a large output, the hand-off of a note from step 1 to step 2, and the
+whole two-agent flow over a ReplayPipe serving hand-written sample replies
+(benchmarks/data/synthetic_outputs.jsonl) with a modelled prefill and per-token delay.
+
+Each case reports the median and fastest seconds per call over several rounds. The
+fastest round is compared with the baseline file, as it is the least disturbed by
+other load on the machine. A case over its threshold percentage is measured again,
+up to --retries times, keeping its fastest round over all attempts; the run fails
+(exit status 1) only when a case stays slower than its baseline by more than its
+threshold. Cases that take microseconds per call vary the most between runs and
+have wider thresholds.
+
+Timings only compare on the machine they were recorded on: the committed baseline
+is an example, so re-record it there with --update before gating on the exit status.
+
+    python benchmarks/bench_suite.py                      # compare with benchmarks/data/baseline.json
+    python benchmarks/bench_suite.py --update             # record a new baseline on this machine
+    python benchmarks/bench_suite.py --cases pdf --threshold 10 --output results.json
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tempfile
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.agents.agent2 import PlanAnalyzer
+from medflow.serving.protocol import chat_output, is_batch
+from medflow.serving.replay import RecordingPipe, ReplayPipe
+from medflow.utils.generation import messages_text
+from medflow.utils.encounter_store import EncounterStore
+from medflow.utils.json_repair import salvage_object
+from medflow.utils.normalization import normalize_soap
+from medflow.utils.pdf_generator import generate_soap_pdf
+from medflow.utils.visualization import save_visualization_html
+from bench_pdf import synthetic_note
+from bench_prefix_cache import sample_patient
+
+DEFAULT_BASELINE = os.path.join(HERE, "data", "baseline.json")
+SAMPLES = os.path.join(HERE, "data", "synthetic_outputs.jsonl")
+# Percent slowdown tolerated unless a case sets its own
+DEFAULT_THRESHOLD = 25
+# Modelled latency of the replayed sample calls
+PREFILL_S = 0.002
+TOKEN_S = 0.00002
+
+PLAN = {"medications": ["Omeprazole 20mg once daily"], "lab_tests": ["H. pylori test", "CBC"], "follow_up": "2 weeks"}
+
+
+def sample_replies():
+    replies = {"agent1": [], "agent2": []}
+    with open(SAMPLES) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                replies[record["agent"]].append(record["text"])
+    return replies
+
+
+class SamplePipe:
+    """Returns the sample replies, cycling per agent, without delay."""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self._next = {agent: 0 for agent in replies}
+
+    def _reply(self, messages):
+        agent = "agent2" if "Agent 2" in messages_text(messages[:1]) else "agent1"
+        n = self._next[agent]
+        self._next[agent] = n + 1
+        return self.replies[agent][n % len(self.replies[agent])]
+
+    def __call__(self, text, max_new_tokens: int = 256, **kwargs):
+        conversations = text if is_batch(text) else [text]
+        outputs = [chat_output(messages, self._reply(messages)) for messages in conversations]
+        return outputs if is_batch(text) else outputs[0]
+
+
+def sample_corpus(path):
+    """
+    Writes a replay corpus of both agents' calls over the sample replies, with
+    PREFILL_S and TOKEN_S as their timings.
+    """
+    replies = sample_replies()
+    pipe = RecordingPipe(SamplePipe(replies), path)
+    agent1, agent2 = SoapNoteGenerator(pipe), PlanAnalyzer(pipe)
+    notes = [agent1.generate(sample_patient(i), use_cache=False) for i in range(len(replies["agent1"]))]
+    for note in notes[:len(replies["agent2"])]:
+        agent2.analyze(note, PLAN, "South Asian", use_cache=False)
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    for line in lines:
+        if "key" in line:
+            line.update(prefill_s=PREFILL_S, token_s=TOKEN_S)
+    with open(path, "w") as f:
+        f.write("".join(json.dumps(line) + "\n" for line in lines))
+
+
+def large_note(items: int = 400):
+    """A note far beyond a real visit: long free text and hundreds of list entries."""
+    note = synthetic_note(0, "")
+    soap, analysis = note["soap_data"], note["agent2_output"]
+    soap["subjective"]["history_of_present_illness"] = "Burning pain after meals, worse when lying down. " * items
+    soap["subjective"]["medications"] = [f"Medication {i} {i % 50 + 5}mg daily" for i in range(items)]
+    soap["plan"]["lab_tests"] = [f"Lab test {i}" for i in range(items)]
+    analysis["lab_test_recommendations"] = [f"Consider test {i} given the history" for i in range(items)]
+    analysis["additional_notes"] = "Review if symptoms persist beyond 4 weeks. " * items
+    return soap, analysis
+
+
+def large_output(members: int = 3000):
+    rng = random.Random(0)
+    return {
+        "soap_note": large_note(50)[0],
+        "test_validation": [
+            {"test": f"Test {i}", "relevance_score": rng.randrange(100), "rationale": "Screens for anemia. " * 5}
+            for i in range(members)
+        ],
+    }
+
+
+# name -> (setup returning a zero-argument callable, calls per round, threshold percent or None)
+CASES = {}
+
+
+def case(name, number=1, threshold=None):
+    def register(setup):
+        CASES[name] = (setup, number, threshold)
+        return setup
+    return register
+
+
+@case("agent1_prompt", number=200)
+def agent1_prompt():
+    agent = SoapNoteGenerator(SamplePipe(sample_replies()))
+    patients = [sample_patient(i) for i in range(20)]
+    return lambda: [agent._build_messages(p) for p in patients]
+
+
+@case("agent2_prompt", number=200)
+def agent2_prompt():
+    pipe = SamplePipe(sample_replies())
+    agent = PlanAnalyzer(pipe)
+    note, _ = SoapNoteGenerator(pipe)._parse(sample_replies()["agent1"][0])
+    return lambda: [agent._build_messages(note, PLAN, "South Asian") for _ in range(20)]
+
+
+@case("agent1_parse", number=500)
+def agent1_parse():
+    agent = SoapNoteGenerator(SamplePipe(sample_replies()))
+    replies = sample_replies()["agent1"]
+    return lambda: [agent._parse(text) for text in replies]
+
+
+@case("agent2_parse", number=500)
+def agent2_parse():
+    agent = PlanAnalyzer(SamplePipe(sample_replies()))
+    replies = sample_replies()["agent2"]
+    return lambda: [agent._parse(text) for text in replies]
+
+
+@case("salvage_truncated", number=200, threshold=60)
+def salvage_truncated():
+    replies = [text[:len(text) * 2 // 3] for texts in sample_replies().values() for text in texts]
+    return lambda: [salvage_object(text) for text in replies]
+
+
+@case("normalize_soap", number=20000, threshold=60)
+def normalize():
+    notes = [{"S": "subj", "O": {"vitals": "ok"}, "A": "assess"}, {"subjective": {"cc": "pain"}, "objective": "x"}]
+    return lambda: [normalize_soap(note) for note in notes]
+
+
+@case("pdf_small", number=5)
+def pdf_small():
+    note = synthetic_note(0, "")
+    return lambda: generate_soap_pdf(note["soap_data"], note["agent2_output"], filename=None,
+                                     patient_name=note["patient_name"], patient_id=note["patient_id"])
+
+
+@case("pdf_large", threshold=30)
+def pdf_large():
+    soap, analysis = large_note()
+    return lambda: generate_soap_pdf(soap, analysis, filename=None)
+
+
+@case("html_large", number=3, threshold=40)
+def html_large():
+    data = large_output()
+    # Removed once the callable is garbage collected
+    out_dir = tempfile.TemporaryDirectory()
+    return lambda: save_visualization_html(data, os.path.join(out_dir.name, "graph.html"))
+
+
+@case("draft_handoff", number=200, threshold=80)
+def draft_handoff():
+    """Step 1's large note handed to step 2 through the app's encounter store."""
+    store = EncounterStore()
+    note = large_note()[0]
+    return lambda: store.get(store.put({"soap_note": note, "images": None}))
+
+
+@case("two_agent_flow", number=3)
+def two_agent_flow():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "calls.jsonl")
+        sample_corpus(path)
+        pipe = ReplayPipe(path)
+    agent1, agent2 = SoapNoteGenerator(pipe), PlanAnalyzer(pipe)
+
+    def flow():
+        note = agent1.generate(sample_patient(0), use_cache=False)
+        output = agent2.analyze(note, PLAN, "South Asian", use_cache=False)
+        generate_soap_pdf(output.get("soap_note", note), output, filename=None)
+    return flow
+
+
+def measure(setup, number, rounds, timings=None):
+    """
+    Median and minimum seconds per call of `setup()`'s callable. Rounds from an
+    earlier attempt, passed as `timings`, count as well.
+    """
+    fn = setup()
+    timings = list(timings or [])
+    # PDF and HTML writers report every file
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            for _ in range(number):
+                fn()
+            timings.append((time.perf_counter() - t0) / number)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "rounds": len(timings), "number": number,
+            "timings": timings}
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    for unit, scale in (("s", 1), ("ms", 1e3)):
+        if seconds >= 1 / scale:
+            return f"{seconds * scale:.3f}{unit}"
+    return f"{seconds * 1e6:.3f}us"
+
+
+def machine():
+    return {"platform": platform.platform(), "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(), "python": platform.python_version()}
+
+
+def compare(results, baseline, threshold=None):
+    """Rows of (name, baseline fastest seconds, change in percent, limit in percent, regressed)."""
+    rows = []
+    for name, result in results.items():
+        limit = threshold if threshold is not None else CASES[name][2] or DEFAULT_THRESHOLD
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            rows.append((name, None, None, limit, False))
+            continue
+        change = (result["min_s"] - base["min_s"]) / base["min_s"] * 100
+        rows.append((name, base["min_s"], change, limit, change > limit))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite with regression thresholds.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare with or update.")
+    parser.add_argument("--update", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--output", default=None, help="Also write the results to this JSON file.")
+    parser.add_argument("--cases", default=None, help="Only run cases whose name contains this regex.")
+    parser.add_argument("--rounds", type=int, default=5, help="Timed rounds per case.")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="Times a case over its threshold is measured again before it counts as regressed.")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help=f"Percent slowdown that fails a case, for every case. Default: per case, "
+                             f"{DEFAULT_THRESHOLD} unless set")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.cases is None or re.search(args.cases, name)]
+    results = {}
+    for name in names:
+        setup, number, _ = CASES[name]
+        results[name] = measure(setup, number, args.rounds)
+    report = {"machine": machine(), "cases": results}
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.update:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != report["machine"]:
+            print("Warning: the baseline was recorded on a different machine; rerun with --update there "
+                  "before gating on this check.")
+        # A slow run is often one disturbed moment: only a slowdown that persists counts
+        for _ in range(args.retries):
+            slow = [row[0] for row in compare(results, baseline, args.threshold) if row[4]]
+            for name in slow:
+                setup, number, _ = CASES[name]
+                results[name] = measure(setup, number, args.rounds, results[name]["timings"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.update:
+        baseline = {"machine": report["machine"], "cases": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline["cases"] = json.load(f).get("cases", {})
+        baseline["cases"].update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+
+    print(f"{'case':20s} {'median':>11s} {'fastest':>11s} {'baseline':>11s} {'change':>8s} {'limit':>6s}")
+    regressed = []
+    for name, base, change, limit, failed in compare(results, baseline, args.threshold):
+        change_text = f"{change:+7.1f}%" if change is not None else "-"
+        print(f"{name:20s} {format_seconds(results[name]['median_s']):>11s} "
+              f"{format_seconds(results[name]['min_s']):>11s} {format_seconds(base):>11s} "
+              f"{change_text:>8s} {limit:5.0f}%" + ("  REGRESSED" if failed else ""))
+        if failed:
+            regressed.append(name)
+    if regressed:
+        print(f"{len(regressed)} case(s) regressed: {', '.join(regressed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compares generation throughput of one model worker using every core against N
+workers each pinned to its own slice of cores, under concurrent agent-sized requests.
+
+    python benchmarks/bench_worker_pool.py --workers 4 --requests 64 --model google/medgemma-4b-it
+    python benchmarks/bench_worker_pool.py --workers 4 --tiny    # offline run on the test model
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.serving.model_host import ModelHost
+from bench_model_host import load_model
+from bench_prefix_cache import sample_patient
+
+
+def run(host, requests, concurrency, max_new_tokens):
+    agent = SoapNoteGenerator(host)
+    conversations = [agent._build_messages(sample_patient(i)) for i in range(requests)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda messages: host(text=messages, max_new_tokens=max_new_tokens), conversations))
+    return requests / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark core-pinned model worker pools.")
+    parser.add_argument("--model", default="google/medgemma-4b-it")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=None, help="Client threads. Default: 2 per worker")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--tiny", action="store_true", help="Use the tiny random test model instead of --model.")
+    args = parser.parse_args()
+    os.environ["MEDFLOW_BENCH_MODEL"] = "tiny" if args.tiny else args.model
+    concurrency = args.concurrency or 2 * args.workers
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+    configs = [
+        (f"1 worker x {cores} threads", dict(workers=1, threads_per_worker=cores)),
+        (f"{args.workers} pinned workers", dict(workers=args.workers, pin_cores=True)),
+    ]
+    for name, options in configs:
+        host = ModelHost(load_model, **options).start()
+        try:
+            rate = run(host, args.requests, concurrency, args.max_new_tokens)
+        finally:
+            host.shutdown()
+        print(f"{name:28s} {rate:7.2f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,33 @@
 import json
-import re
+import time
 
-class SoapNoteGenerator:
-    def __init__(self, pipeline):
-        self.pipe = pipeline
+from medflow.utils.generation import (
+    extract_generated_text, run_pipe_batch, batch_item_stats, model_id, stream_pipe,
+    json_generation_kwargs, require_schema_decoding
+)
+from medflow.utils.json_stream import IncrementalJSONParser, extract_json_object
+from medflow.utils.json_repair import salvage_object
+from medflow.utils.schemas import SOAP_PARTIAL_SCHEMA, NARRATIVE_SCHEMA, NARRATIVE_IMAGING_SCHEMA, section_schema
+from medflow.utils.response_cache import make_cache_key, image_hash
+from medflow.utils.intake import prestructure
+from medflow.utils.prompt_builder import PromptBuilder, estimate_tokens
+from medflow.utils.token_log import TOKEN_LOG
+from medflow.utils.metrics import METRICS, record_agent_call
+from medflow.utils.token_budget import TokenBudget, count_items
 
-    def generate(self, patient_info: dict, images: list = None):
-        """
-        Generates Subjective, Objective, Assessment only from patient info and optional images.
-        Returns a dict with keys: subjective, objective, assessment, missing_information, safety_notice
-        """
-        
-        # Build MedGemma chat messages
-        messages = [
-            {
-                "role": "system",
-                "content": [{"type": "text", "text": 
-                             """You are Agent 1 in the MedFlow AI system.
+# Bump whenever SYSTEM_PROMPT or the user prompt changes so cached responses are not reused
+PROMPT_VERSION = "agent1-v2"
+# Ceiling of the adaptive budget (see medflow.utils.token_budget)
+MAX_NEW_TOKENS = 800
+# Tokens of patient data in the user prompt; lower-priority fields are truncated beyond it
+INPUT_BUDGET = 1024
+
+# Prompt sections of the patient data, from most to least important
+CORE_FIELDS = ("age", "gender", "symptoms", "duration", "severity", "vitals")
+HISTORY_FIELDS = ("medical_history", "medications", "allergies", "social_history", "family_history")
+
+# Constant system prefix shared by every call (see medflow.utils.prefix_cache)
+SYSTEM_PROMPT = """You are Agent 1 in the MedFlow AI system.
 
 Your role is to collect, validate, clean, and structure raw user input before it is passed to downstream agents.
 
@@ -39,62 +50,285 @@ Output:
 - Return only valid JSON
 - Include structured data, flags, and confidence score
 """
-                            }]
+
+# Pre-structured mode: vitals, lists and missing fields come from medflow.utils.intake,
+# and the model only writes the narrative fields
+PRESTRUCTURED_PROMPT_VERSION = "agent1-prestructured-v2"
+NARRATIVE_MAX_NEW_TOKENS = 400
+
+NARRATIVE_SYSTEM_PROMPT = """You are Agent 1 in the MedFlow AI system.
+
+The intake data has already been parsed and structured. Your role is to write the
+narrative parts of the Subjective, Objective and Assessment sections from it.
+
+Rules:
+- Use neutral clinical language and only the facts provided
+- Do not infer beyond the provided input
+- Do NOT include Plan, Diagnosis, or Medications
+- Return only valid JSON with exactly the keys requested
+"""
+
+NARRATIVE_FIELDS = {
+    "history_of_present_illness": "one or two sentences on the presenting complaint",
+    "review_of_systems": "the positives reported, by system",
+    "imaging_findings": "what the attached images show",
+    "assessment": "a brief clinical assessment",
+    "safety_notice": "precautions for the patient",
+}
+
+NARRATIVE_FALLBACK_NOTICE = "Unable to generate full SOAP note. Please verify patient data."
+
+# Top-level keys of a full-mode note
+NOTE_KEYS = ("subjective", "objective", "assessment", "missing_information", "safety_notice")
+
+
+class SoapNoteGenerator:
+    def __init__(self, pipeline, cache=None, constrained: bool = False, prestructured: bool = False,
+                 input_budget: int = INPUT_BUDGET, token_log=None, token_budget=None):
+        self.pipe = pipeline
+        # Optional medflow.utils.response_cache.ResponseCache
+        self.cache = cache
+        # Constrain decoding to SOAP_PARTIAL_SCHEMA so the reply is valid JSON by construction
+        self.constrained = constrained
+        if constrained:
+            require_schema_decoding()
+        # Fill the mechanical fields from the intake data and only generate the narrative
+        self.prestructured = prestructured
+        self.input_budget = input_budget
+        # medflow.utils.token_log.TokenLog receiving the token counts of every call
+        self.token_log = token_log or TOKEN_LOG
+        # Learns max_new_tokens from the output lengths seen so far, warmed up from the token log file
+        self.token_budget = token_budget or TokenBudget.from_log(self.token_log.path, "agent1")
+
+    @property
+    def max_new_tokens(self):
+        """Ceiling of the adaptive budget for the current mode."""
+        return NARRATIVE_MAX_NEW_TOKENS if self.prestructured else MAX_NEW_TOKENS
+
+    @property
+    def variant(self):
+        return PRESTRUCTURED_PROMPT_VERSION if self.prestructured else PROMPT_VERSION
+
+    @staticmethod
+    def _input_size(patient_info: dict, images: list = None):
+        # Replies grow with the symptoms, history and medications to describe
+        return count_items(patient_info.get("symptoms"), patient_info.get("medical_history"),
+                           patient_info.get("medications"), images)
+
+    def _budget(self, patient_info: dict, images: list = None):
+        return self.token_budget.budget(self.variant, self._input_size(patient_info, images), self.max_new_tokens)
+
+    def _retry_budget(self, text: str, max_new_tokens: int, parsed: bool):
+        """The larger budget to retry a truncated reply with, or None."""
+        retry = self.token_budget.retry_budget(estimate_tokens(self.pipe, text), max_new_tokens, parsed,
+                                               self.max_new_tokens)
+        if retry:
+            print(f"[agent1] reply truncated at {max_new_tokens} tokens, retrying with {retry}")
+        return retry
+
+    def _generation_kwargs(self, images: list = None, keys=None):
+        schema = None
+        if self.constrained:
+            schema = SOAP_PARTIAL_SCHEMA
+            if self.prestructured:
+                schema = NARRATIVE_IMAGING_SCHEMA if images else NARRATIVE_SCHEMA
+            if keys:
+                schema = section_schema(schema, keys)
+        return json_generation_kwargs(self.pipe, schema)
+
+    def _cache_key(self, patient_info: dict, images: list = None):
+        return make_cache_key(
+            agent="agent1",
+            prompt_version=self.variant,
+            model=model_id(self.pipe),
+            params={"max_new_tokens": self.max_new_tokens, "constrained": self.constrained,
+                    "input_budget": self.input_budget},
+            inputs=patient_info,
+            images=[image_hash(img) for img in images or []],
+        )
+
+    def _build_messages(self, patient_info: dict, images: list = None, keys=None):
+        """Chat messages for a note; `keys` limits the reply to those top-level keys."""
+        if self.prestructured:
+            return self._build_narrative_messages(prestructure(patient_info), images, keys)
+
+        builder = PromptBuilder(self.pipe, self.input_budget, agent="agent1")
+        builder.add(None, (
+            "Generate a structured SOAP note in JSON format containing ONLY "
+            "Subjective (S), Objective (O), and Assessment (A). "
+            "Do NOT include Plan, Diagnosis, or Medications. "
+            "Use neutral clinical language. "
+            "If any information is missing, list it under 'missing_information'. "
+            "Add a 'safety_notice' field with precautions."
+        ), priority=None)
+        if keys:
+            builder.add(None, f"Return a JSON object with only these keys: {', '.join(keys)}.", priority=None)
+        builder.add("Patient data", {k: patient_info[k] for k in CORE_FIELDS if k in patient_info}, priority=3)
+        builder.add("History", {k: patient_info[k] for k in HISTORY_FIELDS if k in patient_info}, priority=2)
+        builder.add("Other information", {
+            k: v for k, v in patient_info.items() if k not in CORE_FIELDS and k not in HISTORY_FIELDS
+        }, priority=1)
+
+        # Build MedGemma chat messages
+        messages = [
+            {
+                "role": "system",
+                "content": [{"type": "text", "text": SYSTEM_PROMPT}]
             },
             {
                 "role": "user",
-                "content": [{"type": "text", "text": (
-                    "Generate a structured SOAP note in JSON format containing ONLY "
-                    "Subjective (S), Objective (O), and Assessment (A). "
-                    "Do NOT include Plan, Diagnosis, or Medications. "
-                    "Use neutral clinical language. "
-                    "If any information is missing, list it under 'missing_information'. "
-                    "Add a 'safety_notice' field with precautions.\n\n"
-                    f"Patient data:\n{json.dumps(patient_info, indent=2)}"
-                )}]
+                "content": [{"type": "text", "text": builder.build()}]
             }
         ]
-        
+
         # Attach images if provided
         if images:
             for img in images:
                 messages[1]["content"].append({"type": "image", "image": img})
-        
-        # Generate output
-        output = self.pipe(text=messages, max_new_tokens=800)
-        assistant_text = output[-1]["generated_text"]
-
-        # Remove markdown ```json if present
-        # Handle cases where content is a list or string
-        content = assistant_text[-1]["content"]
-        if isinstance(content, list):
-             # It should be a string in standard simple generation, but let's be safe if it's a list
-             # The notebook accessed it as assistant_text[-1]["content"] which implies it's a string or list of dicts?
-             # Wait, notebook code: assistant_text[-1]["content"]
-             # output is list of dicts. assistant_text is likely the message dict.
-             # Actually `pipe` output structure depends on the pipeline type.
-             # The notebook code:
-             # output = pipe(text=messages, max_new_tokens=800)
-             # assistant_text = output[-1]["generated_text"]
-             # json_text = re.sub(r"```json|```", "", assistant_text[-1]["content"]).strip()
-             pass
-
-        # The notebook code assumes assistant_text is a list where the last item is the response?
-        # Let's check notebook code again.
-        # output = pipe(...) -> returns list of generated sequences (usually just 1 if not num_return_sequences > 1)
-        # Actually for 'image-text-to-text' or 'text-generation' with chat template?
-        # Notebook says: assistant_text = output[-1]["generated_text"]
-        # then assumes assistant_text is a list of messages? 
-        # "assistant_text[-1]["content"]"
-        # This implies output[-1]["generated_text"] returns the WHOLE conversation history including the new response?
-        # Yes, usually pipeline returns the fulll history if using chat templates.
-        
-        json_text = re.sub(r"```json|```", "", assistant_text[-1]["content"]).strip()
-        
-        # Parse JSON safely
+        return messages
+
+    @staticmethod
+    def _narrative_fields(images: list = None):
+        return [name for name in NARRATIVE_FIELDS if images or name != "imaging_findings"]
+
+    def _build_narrative_messages(self, intake: dict, images: list = None, fields=None):
+        fields = fields or self._narrative_fields(images)
+        keys = "\n".join(f"- {name}: {NARRATIVE_FIELDS[name]}" for name in fields)
+        builder = PromptBuilder(self.pipe, self.input_budget, agent="agent1")
+        builder.add("Patient data", intake["facts"], priority=1)
+        builder.add(None, f"Return a JSON object with these keys:\n{keys}", priority=None)
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": NARRATIVE_SYSTEM_PROMPT}]},
+            {"role": "user", "content": [{"type": "text", "text": builder.build()}]}
+        ]
+        for img in images or []:
+            messages[1]["content"].append({"type": "image", "image": img})
+        return messages
+
+    @staticmethod
+    def _merge_narrative(intake: dict, narrative: dict, partial: bool = False):
+        """
+        Fills the narrative fields into the pre-structured note. With `partial=True`
+        the note is yielded mid-stream, so the narrative keys not yet generated are left out.
+        """
+        subjective = dict(intake["subjective"])
+        objective = dict(intake["objective"], imaging=dict(intake["objective"]["imaging"]))
+        for name in ("history_of_present_illness", "review_of_systems"):
+            if narrative.get(name):
+                subjective[name] = narrative[name]
+        if narrative.get("imaging_findings"):
+            objective["imaging"]["chest_xray"] = narrative["imaging_findings"]
+        note = {
+            "subjective": subjective,
+            "objective": objective,
+            "assessment": narrative.get("assessment", ""),
+            "missing_information": list(intake["missing_information"]),
+            "safety_notice": narrative.get("safety_notice", ""),
+            "vitals": intake["vitals"],
+        }
+        if partial:
+            note = {k: v for k, v in note.items() if k not in ("assessment", "safety_notice") or k in narrative}
+        return note
+
+    def _record_usage(self, stats: dict, size: int, max_new_tokens: int, truncated: bool = False,
+                      regenerated: bool = False):
+        mode = "prestructured" if self.prestructured else "full"
+        if regenerated:
+            # Replies holding only some keys would skew the learned budget
+            mode += ":regenerate"
+        elif stats["parsed"]:
+            self.token_budget.observe(self.variant, size, stats["output_tokens"])
+        record_agent_call(METRICS, "agent1", mode, stats)
+        self.token_log.record(
+            "agent1", stats["prompt_tokens"], stats["output_tokens"], stats["wall_time"],
+            mode=mode, parsed=stats["parsed"], variant=None if regenerated else self.variant, size=size,
+            max_new_tokens=max_new_tokens, truncated=truncated,
+        )
+
+    def _salvage(self, assistant_text: str, images: list = None):
+        """
+        The fully produced fields of a reply that did not parse, as (fields, missing keys),
+        or None when nothing could be recovered (see medflow.utils.json_repair).
+        """
+        if self.prestructured:
+            expected = self._narrative_fields(images)
+            fields = salvage_object(assistant_text, expected).data
+        else:
+            expected = NOTE_KEYS
+            fields = self._standardize(salvage_object(assistant_text).data, partial=True)
+        fields = {key: value for key, value in fields.items() if key in expected}
+        if not fields:
+            return None
+        return fields, [key for key in expected if key not in fields]
+
+    def _complete(self, jobs: list, batch_size: int = None):
+        """
+        Generates only the missing keys of salvaged replies.
+
+        Args:
+            jobs: List of (patient_info, images, (fields, missing)) as returned by `_salvage`.
+
+        Returns a (note, parsed) per job; `parsed` is False when keys are still missing.
+        """
+        fields = [dict(salvaged[0]) for _, _, salvaged in jobs]
+        groups = {}
+        for n, (_, images, (_, missing)) in enumerate(jobs):
+            groups.setdefault((bool(images) and self.prestructured and self.constrained, tuple(missing)), []).append(n)
+        for (has_images, keys), indices in groups.items():
+            print(f"[agent1] salvaged {len(indices)} partial replies, regenerating {', '.join(keys)}")
+            conversations = [self._build_messages(jobs[n][0], jobs[n][1], keys=keys) for n in indices]
+            max_new_tokens = max(self._budget(jobs[n][0], jobs[n][1]) for n in indices)
+            results = run_pipe_batch(self.pipe, conversations, max_new_tokens=max_new_tokens,
+                                     batch_size=batch_size, **self._generation_kwargs(has_images, keys))
+            for n, messages, (output, wall_time) in zip(indices, conversations, results):
+                text = extract_generated_text(output)
+                salvaged = self._salvage(text, jobs[n][1])
+                for key, value in (salvaged[0] if salvaged else {}).items():
+                    fields[n].setdefault(key, value)
+                stats = batch_item_stats(self.pipe, messages, text, wall_time, all(key in fields[n] for key in keys))
+                self._record_usage(stats, self._input_size(jobs[n][0], jobs[n][1]), max_new_tokens, regenerated=True)
+
+        results = []
+        for (patient_info, images, (_, missing)), note_fields in zip(jobs, fields):
+            parsed = all(key in note_fields for key in missing)
+            if self.prestructured:
+                if not parsed:
+                    note_fields.setdefault("safety_notice", NARRATIVE_FALLBACK_NOTICE)
+                results.append((self._merge_narrative(prestructure(patient_info), note_fields), parsed))
+            else:
+                results.append((self._standardize(note_fields), parsed))
+        return results
+
+    def _parse_reply(self, assistant_text: str, patient_info: dict):
+        """`_parse` for the current mode. Returns (note, parsed)."""
+        if not self.prestructured:
+            return self._parse(assistant_text)
         try:
-            data = json.loads(json_text)
+            with METRICS.stage("json_parse", agent="agent1"):
+                narrative = json.loads(extract_json_object(assistant_text))
         except json.JSONDecodeError:
+            narrative = None
+        if not isinstance(narrative, dict):
+            # The deterministic fields are still good; only the narrative is lost
+            return self._merge_narrative(prestructure(patient_info), {"safety_notice": NARRATIVE_FALLBACK_NOTICE}), False
+        return self._merge_narrative(prestructure(patient_info), narrative), True
+
+    def _parse(self, assistant_text: str):
+        """
+        Parses the model reply into the standard S/O/A dict.
+        Returns (note, parsed) where `parsed` is False when the fallback note was used.
+        """
+        # Keep only the JSON object; fences and trailing chatter are dropped
+        json_text = extract_json_object(assistant_text)
+
+        # Parse JSON safely; valid JSON that is not an object (e.g. a refusal list) fails too
+        try:
+            with METRICS.stage("json_parse", agent="agent1"):
+                data = json.loads(json_text)
+        except json.JSONDecodeError:
+            data = None
+        parsed = isinstance(data, dict)
+        if not parsed:
             data = {
                 "subjective": "",
                 "objective": "",
@@ -102,12 +336,190 @@ Output:
                 "missing_information": ["Patient vitals or history may be incomplete."],
                 "safety_notice": "Unable to generate full SOAP note. Please verify patient data."
             }
-        
-        # Standardize keys
-        return {
+
+        return self._standardize(data), parsed
+
+    @staticmethod
+    def _standardize(data: dict, partial: bool = False):
+        """
+        Maps S/O/A or long-form keys onto the standard note keys.
+        With `partial=True` only the keys already present in `data` are returned.
+        """
+        note = {
             "subjective": data.get("S", data.get("subjective", "")),
             "objective": data.get("O", data.get("objective", "")),
             "assessment": data.get("A", data.get("assessment", "")),
             "missing_information": data.get("missing_information", []),
             "safety_notice": data.get("safety_notice", "")
         }
+        if partial:
+            aliases = {"subjective": "S", "objective": "O", "assessment": "A"}
+            note = {k: v for k, v in note.items() if k in data or aliases.get(k) in data}
+        return note
+
+    def generate(self, patient_info: dict, images: list = None, use_cache: bool = True):
+        """
+        Generates Subjective, Objective, Assessment only from patient info and optional images.
+        Returns a dict with keys: subjective, objective, assessment, missing_information, safety_notice
+
+        Set `use_cache=False` to bypass the response cache when a fresh sample is required.
+        """
+        key = None
+        if self.cache is not None and use_cache:
+            key = self._cache_key(patient_info, images)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        messages = self._build_messages(patient_info, images)
+        size = self._input_size(patient_info, images)
+        max_new_tokens = self._budget(patient_info, images)
+
+        # Generate output. With chat templates the pipeline returns the whole
+        # conversation, so the reply is the last message of `generated_text`.
+        # A reply that does not parse keeps its complete fields and only the missing ones
+        # are generated again; one cut off by a learned budget with nothing to salvage is
+        # generated once more at the ceiling.
+        while True:
+            t0 = time.perf_counter()
+            output = self.pipe(text=messages, max_new_tokens=max_new_tokens, **self._generation_kwargs(images))
+            text = extract_generated_text(output)
+            note, parsed = self._parse_reply(text, patient_info)
+            stats = batch_item_stats(self.pipe, messages, text, time.perf_counter() - t0, parsed)
+            salvaged = None if parsed else self._salvage(text, images)
+            retry = None if salvaged else self._retry_budget(text, max_new_tokens, parsed)
+            self._record_usage(stats, size, max_new_tokens, truncated=bool(retry))
+            if not retry:
+                break
+            max_new_tokens = retry
+        if salvaged:
+            note, parsed = self._complete([(patient_info, images, salvaged)])[0]
+        # Fallback notes are not cached so the next click retries the model
+        if key is not None and parsed:
+            self.cache.put(key, note)
+        return note
+
+    def generate_stream(self, patient_info: dict, images: list = None, use_cache: bool = True):
+        """
+        Streaming variant of `generate`.
+
+        Yields partial notes holding the sections completed so far (e.g. only `subjective`
+        at first), then the final note exactly as `generate` would return it. In
+        pre-structured mode the first partial note holds every deterministic field and
+        is yielded before generation starts.
+        """
+        key = None
+        if self.cache is not None and use_cache:
+            key = self._cache_key(patient_info, images)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        intake = prestructure(patient_info) if self.prestructured else None
+        if intake is not None:
+            yield self._merge_narrative(intake, {}, partial=True)
+
+        messages = self._build_messages(patient_info, images)
+        size = self._input_size(patient_info, images)
+        max_new_tokens = self._budget(patient_info, images)
+        while True:
+            parser = IncrementalJSONParser()
+            t0 = time.perf_counter()
+            for chunk in stream_pipe(self.pipe, messages, max_new_tokens=max_new_tokens,
+                                     **self._generation_kwargs(images)):
+                if parser.feed(chunk):
+                    if intake is not None:
+                        yield self._merge_narrative(intake, parser.fields, partial=True)
+                    else:
+                        yield self._standardize(parser.fields, partial=True)
+                if parser.done:
+                    break
+
+            note, parsed = self._parse_reply(parser.text, patient_info)
+            stats = batch_item_stats(self.pipe, messages, parser.text, time.perf_counter() - t0, parsed)
+            salvaged = None if parsed else self._salvage(parser.text, images)
+            retry = None if salvaged else self._retry_budget(parser.text, max_new_tokens, parsed)
+            self._record_usage(stats, size, max_new_tokens, truncated=bool(retry))
+            if not retry:
+                break
+            # The retry streams the sections again from the start
+            max_new_tokens = retry
+        if salvaged:
+            note, parsed = self._complete([(patient_info, images, salvaged)])[0]
+        if key is not None and parsed:
+            self.cache.put(key, note)
+        yield note
+
+    def generate_batch(self, patient_infos: list, images: list = None, batch_size: int = None,
+                       use_cache: bool = True):
+        """
+        Generates S/O/A notes for many patients, padding them into shared forward passes.
+
+        Args:
+            patient_infos: List of patient info dicts.
+            images: Optional list parallel to `patient_infos`; each entry is a list of images or None.
+            batch_size: Conversations per forward pass. Defaults to the whole list.
+
+        Returns (notes, stats). Each note is parsed on its own, so a bad reply only
+        falls back for that patient. `stats` holds the total wall time and per-item
+        prompt/output token counts, wall time and parse status. Items served from
+        the response cache are not sent to the model and are marked `cached`.
+        """
+        images = images or [None] * len(patient_infos)
+        if len(images) != len(patient_infos):
+            raise ValueError("images must be parallel to patient_infos")
+
+        t0 = time.perf_counter()
+        notes = [None] * len(patient_infos)
+        items = [None] * len(patient_infos)
+        keys = [None] * len(patient_infos)
+        pending = []
+        for i, (info, imgs) in enumerate(zip(patient_infos, images)):
+            if self.cache is not None and use_cache:
+                keys[i] = self._cache_key(info, imgs)
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    notes[i] = cached
+                    items[i] = {"cached": True, "parsed": True, "wall_time": 0.0}
+                    continue
+            pending.append(i)
+
+        # Constrained pre-structured notes use a different schema with and without images
+        groups = {}
+        for i in pending:
+            groups.setdefault(bool(images[i]) and self.prestructured and self.constrained, []).append(i)
+        for has_images, indices in groups.items():
+            # Rows stop once their JSON closes, so the batch gets the largest budget of its rows
+            max_new_tokens = max(self._budget(patient_infos[i], images[i]) for i in indices)
+            while indices:
+                conversations = [self._build_messages(patient_infos[i], images[i]) for i in indices]
+                results = run_pipe_batch(self.pipe, conversations, max_new_tokens=max_new_tokens,
+                                         batch_size=batch_size, **self._generation_kwargs(has_images))
+                truncated, retry, salvaged = [], None, {}
+                for i, messages, (output, wall_time) in zip(indices, conversations, results):
+                    text = extract_generated_text(output)
+                    notes[i], parsed = self._parse_reply(text, patient_infos[i])
+                    items[i] = batch_item_stats(self.pipe, messages, text, wall_time, parsed)
+                    if not parsed:
+                        salvaged[i] = self._salvage(text, images[i])
+                    row_retry = None if salvaged.get(i) else self._retry_budget(text, max_new_tokens, parsed)
+                    self._record_usage(items[i], self._input_size(patient_infos[i], images[i]), max_new_tokens,
+                                       truncated=bool(row_retry))
+                    if row_retry:
+                        truncated.append(i)
+                        retry = row_retry
+                    elif keys[i] is not None and parsed:
+                        self.cache.put(keys[i], notes[i])
+
+                # Partial replies keep their complete fields; only the missing ones are generated
+                partial = [i for i in salvaged if salvaged[i]]
+                completed = self._complete([(patient_infos[i], images[i], salvaged[i]) for i in partial], batch_size)
+                for i, (note, parsed) in zip(partial, completed):
+                    notes[i] = note
+                    items[i]["parsed"] = parsed
+                    if keys[i] is not None and parsed:
+                        self.cache.put(keys[i], note)
+                # Truncated rows with nothing to salvage are generated once more, together, at the ceiling
+                indices, max_new_tokens = truncated, retry
+        return notes, {"wall_time": time.perf_counter() - t0, "items": items}
@@ -1,18 +1,30 @@
 import json
-import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-class PlanAnalyzer:
-    def __init__(self, pipeline):
-        self.pipe = pipeline
+from medflow.utils.generation import (
+    extract_generated_text, run_pipe_batch, batch_item_stats, model_id, stream_pipe,
+    json_generation_kwargs, require_schema_decoding
+)
+from medflow.utils.json_stream import IncrementalJSONParser, extract_json_object
+from medflow.utils.json_repair import salvage_object
+from medflow.utils.schemas import PLAN_ANALYSIS_SCHEMA, section_schema
+from medflow.utils.response_cache import make_cache_key
+from medflow.utils.prompt_builder import PromptBuilder, estimate_tokens
+from medflow.utils.token_log import TOKEN_LOG
+from medflow.utils.metrics import METRICS, record_agent_call
+from medflow.utils.token_budget import TokenBudget, count_items
 
-    def analyze(self, soap_note: dict, doctor_plan: dict, ethnicity: str = "Not provided"):
-        messages = [
-            {
-                "role": "system",
-                "content": [{
-                    "type": "text",
-                    "text": (
-                        """You are Agent 2 in the MedFlow AI system.
+# Bump whenever SYSTEM_PROMPT or the user prompt changes so cached responses are not reused
+PROMPT_VERSION = "agent2-v2"
+# Ceiling of the adaptive budget (see medflow.utils.token_budget)
+MAX_NEW_TOKENS = 2000
+# Tokens of case data in the user prompt; lower-priority sections are truncated beyond it
+INPUT_BUDGET = 2048
+
+# Constant system prefix shared by every call (see medflow.utils.prefix_cache)
+SYSTEM_PROMPT = """You are Agent 2 in the MedFlow AI system.
 
 Your role:
 - Receive the SOAP note (S, O, A) generated by Agent 1.
@@ -37,41 +49,523 @@ Output format:
 - Clearly indicate missing or uncertain information
 
 """
-                    )
+
+# Decomposed mode: each review section is its own short prompt, and the SOAP note is
+# assembled from Agent 1's note and the doctor plan instead of being generated again.
+DECOMPOSED_PROMPT_VERSION = "agent2-decomposed-v2"
+
+DECOMPOSED_SYSTEM_PROMPT = """You are Agent 2 in the MedFlow AI system.
+
+Your role:
+- Review the Plan provided by the doctor against the SOAP note (S, O, A) generated by Agent 1.
+- Answer only the task you are given, briefly.
+- Maintain patient safety and clinical neutrality.
+- Do NOT diagnose or prescribe new medications or new tests.
+- Return valid JSON ONLY, with exactly the keys the task names.
+- Percentages should be numbers (0-100).
+
+"""
+
+Section = namedtuple("Section", ["name", "keys", "max_new_tokens", "task"])
+
+SECTIONS = (
+    Section("medication_review", ("medication_review",), 256,
+            'Evaluate whether the prescribed medicines align with the symptoms and assessment. '
+            'Return {"medication_review": {"alignment_score": number, "rationale": string}}.'),
+    Section("test_validation", ("test_validation",), 384,
+            'Evaluate whether each prescribed lab test is clinically relevant. '
+            'Return {"test_validation": [{"test": string, "relevance_score": number, "rationale": string}]}.'),
+    Section("lifestyle_recommendations", ("lifestyle_recommendations",), 384,
+            'Suggest lifestyle recommendations based on the patient context and prescription. '
+            'Return {"lifestyle_recommendations": {"food": string, "exercise": string, "clothing": string, '
+            '"music": string, "fragrance": string}}.'),
+    Section("notes", ("additional_notes", "safety_notice"), 256,
+            'Note missing or uncertain information and any safety caution. '
+            'Return {"additional_notes": string, "safety_notice": string}.'),
+)
+
+# Used for a section whose reply could not be parsed
+SECTION_FALLBACKS = {
+    "medication_review": {"alignment_score": None, "rationale": "Parsing failed"},
+    "test_validation": [],
+    "lifestyle_recommendations": {},
+    "additional_notes": "Part of the model output could not be parsed",
+    "safety_notice": "Consult a healthcare professional.",
+}
+
+
+def _total(counts):
+    # Token counts are None for pipes without a tokenizer
+    counts = list(counts)
+    return None if any(c is None for c in counts) else sum(counts)
+
+
+def _in_output_order(analysis):
+    # Ordered like the one-call analysis, whatever order the sections finished in
+    return {key: analysis[key] for key in ["soap_note"] + list(SECTION_FALLBACKS)}
+
+
+def assemble_soap_note(soap_note: dict, doctor_plan: dict) -> dict:
+    """The full SOAP note: Agent 1's S, O and A plus the doctor's plan."""
+    return {
+        "subjective": soap_note.get("subjective", {}),
+        "objective": soap_note.get("objective", {}),
+        "assessment": soap_note.get("assessment", "Missing"),
+        "plan": dict(doctor_plan),
+    }
+
+
+class PlanAnalyzer:
+    def __init__(self, pipeline, cache=None, constrained: bool = False, decomposed: bool = False,
+                 input_budget: int = INPUT_BUDGET, token_log=None, token_budget=None):
+        self.pipe = pipeline
+        # Optional medflow.utils.response_cache.ResponseCache
+        self.cache = cache
+        # Constrain decoding to PLAN_ANALYSIS_SCHEMA so the reply is valid JSON by construction
+        self.constrained = constrained
+        if constrained:
+            require_schema_decoding()
+        # Generate the review as independent short SECTIONS instead of one long reply
+        self.decomposed = decomposed
+        self.input_budget = input_budget
+        # medflow.utils.token_log.TokenLog receiving the token counts of every call
+        self.token_log = token_log or TOKEN_LOG
+        # Learns max_new_tokens from the output lengths seen so far, warmed up from the token log file
+        self.token_budget = token_budget or TokenBudget.from_log(self.token_log.path, "agent2")
+
+    def _generation_kwargs(self):
+        return json_generation_kwargs(self.pipe, PLAN_ANALYSIS_SCHEMA if self.constrained else None)
+
+    def _section_kwargs(self, section):
+        schema = section_schema(PLAN_ANALYSIS_SCHEMA, section.keys) if self.constrained else None
+        return json_generation_kwargs(self.pipe, schema)
+
+    def _cache_key(self, soap_note: dict, doctor_plan: dict, ethnicity: str):
+        return make_cache_key(
+            agent="agent2",
+            prompt_version=DECOMPOSED_PROMPT_VERSION if self.decomposed else PROMPT_VERSION,
+            model=model_id(self.pipe),
+            params={"max_new_tokens": MAX_NEW_TOKENS, "constrained": self.constrained,
+                    "input_budget": self.input_budget},
+            inputs={"soap_note": soap_note, "doctor_plan": doctor_plan, "ethnicity": ethnicity},
+        )
+
+    def _add_case(self, builder, soap_note: dict, doctor_plan: dict, ethnicity: str):
+        # Only the parts of Agent 1's note the review uses; the plan and assessment are kept longest
+        builder.add("Subjective", soap_note.get("subjective"), priority=3)
+        builder.add("Objective", soap_note.get("objective"), priority=2)
+        builder.add("Assessment", soap_note.get("assessment"), priority=4)
+        builder.add("Missing information", soap_note.get("missing_information"), priority=1)
+        builder.add("Doctor Plan", doctor_plan, priority=5)
+        builder.add("Patient Ethnicity", ethnicity, priority=2)
+
+    def _build_messages(self, soap_note: dict, doctor_plan: dict, ethnicity: str = "Not provided"):
+        builder = PromptBuilder(self.pipe, self.input_budget, agent="agent2")
+        builder.add(None, (
+            "Analyze the following clinical data.\n\n"
+            "Tasks:\n"
+            "1. Evaluate whether the prescribed medicines align with the symptoms and assessment.\n"
+            "2. Evaluate whether the prescribed lab tests are clinically relevant.\n"
+            "3. Provide confidence scores (0–100%) with brief rationales.\n"
+            "4. Suggest lifestyle, food, exercise, clothing, music, and fragrance recommendations.\n\n"
+            "Return ONLY a JSON object."
+        ), priority=None)
+        self._add_case(builder, soap_note, doctor_plan, ethnicity)
+        return [
+            {
+                "role": "system",
+                "content": [{
+                    "type": "text",
+                    "text": SYSTEM_PROMPT
                 }]
             },
             {
                 "role": "user",
                 "content": [{
                     "type": "text",
-                    "text": (
-                        "Analyze the following clinical data.\n\n"
-                        "Tasks:\n"
-                        "1. Evaluate whether the prescribed medicines align with the symptoms and assessment.\n"
-                        "2. Evaluate whether the prescribed lab tests are clinically relevant.\n"
-                        "3. Provide confidence scores (0–100%) with brief rationales.\n"
-                        "4. Suggest lifestyle, food, exercise, clothing, music, and fragrance recommendations.\n\n"
-                        "Return ONLY a JSON object.\n\n"
-                        f"SOAP Note:\n{json.dumps(soap_note, indent=2)}\n\n"
-                        f"Doctor Plan:\n{json.dumps(doctor_plan, indent=2)}\n\n"
-                        f"Patient Ethnicity: {ethnicity}"
-                    )
+                    "text": builder.build()
                 }]
             }
         ]
 
-        output = self.pipe(text=messages, max_new_tokens=2000)
-        assistant_text = output[-1]["generated_text"]
+    def _build_section_messages(self, soap_note: dict, doctor_plan: dict, ethnicity: str, section):
+        # The case data comes before the task, so all sections of a case share a prefix
+        builder = PromptBuilder(self.pipe, self.input_budget, agent="agent2")
+        self._add_case(builder, soap_note, doctor_plan, ethnicity)
+        builder.add("Task", section.task, priority=None)
+        return [
+            {"role": "system", "content": [{"type": "text", "text": DECOMPOSED_SYSTEM_PROMPT}]},
+            {"role": "user", "content": [{"type": "text", "text": builder.build()}]}
+        ]
+
+    @staticmethod
+    def _input_size(soap_note: dict, doctor_plan: dict):
+        # Each medication and lab test gets its own review entry
+        return count_items(doctor_plan.get("medications"), doctor_plan.get("lab_tests"),
+                           soap_note.get("missing_information"))
+
+    def _retry_budget(self, text: str, max_new_tokens: int, parsed: bool, ceiling: int):
+        """The larger budget to retry a truncated reply with, or None."""
+        retry = self.token_budget.retry_budget(estimate_tokens(self.pipe, text), max_new_tokens, parsed, ceiling)
+        if retry:
+            print(f"[agent2] reply truncated at {max_new_tokens} tokens, retrying with {retry}")
+        return retry
+
+    def _record_usage(self, stats: dict, variant: str, size: int, max_new_tokens: int, truncated: bool = False):
+        if stats["parsed"]:
+            self.token_budget.observe(variant, size, stats["output_tokens"])
+        mode = "full" if variant == PROMPT_VERSION else "section:" + variant.rsplit(":", 1)[-1]
+        record_agent_call(METRICS, "agent2", mode, stats)
+        self.token_log.record("agent2", stats["prompt_tokens"], stats["output_tokens"], stats["wall_time"],
+                              mode=mode, parsed=stats["parsed"], variant=variant, size=size,
+                              max_new_tokens=max_new_tokens, truncated=truncated)
+
+    def _salvage(self, assistant_text: str):
+        """
+        The fully produced keys of a full-mode reply that did not parse, or None when
+        nothing could be recovered (see medflow.utils.json_repair).
+        """
+        salvaged = salvage_object(assistant_text, ["soap_note"] + list(SECTION_FALLBACKS))
+        return salvaged if salvaged.data else None
 
-        json_text = re.sub(r"```json|```", "", assistant_text[-1]["content"]).strip()
+    def _complete(self, jobs: list, batch_size: int = None):
+        """
+        Fills in the keys missing from salvaged full-mode replies: the SOAP note is
+        assembled from Agent 1's note and the plan, and the review keys are generated
+        with the short SECTIONS prompts that cover them.
 
+        Args:
+            jobs: List of (salvaged, soap_note, doctor_plan, ethnicity).
+
+        Returns an (analysis, parsed) per job; `parsed` is False when a section failed again.
+        """
+        results, section_jobs, owners = [], [], []
+        for n, (salvaged, note, plan, eth) in enumerate(jobs):
+            analysis = dict(salvaged.data)
+            if "soap_note" not in analysis:
+                analysis["soap_note"] = assemble_soap_note(note, plan)
+            missing = set(salvaged.missing)
+            for section in SECTIONS:
+                if missing.intersection(section.keys):
+                    section_jobs.append((self._build_section_messages(note, plan, eth, section), section,
+                                         self._input_size(note, plan)))
+                    owners.append(n)
+            results.append([analysis, True])
+        if section_jobs:
+            print(f"[agent2] salvaged {len(jobs)} partial replies, regenerating "
+                  f"{', '.join(sorted({job[1].name for job in section_jobs}))}")
+
+        for i, text, _ in self._iter_sections(section_jobs, batch_size):
+            section = section_jobs[i][1]
+            values, parsed = self._parse_section(section, text)
+            result = results[owners[i]]
+            for key, value in values.items():
+                result[0].setdefault(key, value)
+            result[1] = result[1] and parsed
+        return [(_in_output_order(analysis), parsed) for analysis, parsed in results]
+
+    def _generate(self, soap_note: dict, doctor_plan: dict, ethnicity: str):
+        """
+        One full-mode reply. A reply that does not parse keeps its complete keys and only
+        the missing ones are generated again; one cut off by a learned budget with
+        nothing to salvage is retried once at the ceiling.
+        """
+        messages = self._build_messages(soap_note, doctor_plan, ethnicity)
+        size = self._input_size(soap_note, doctor_plan)
+        max_new_tokens = self.token_budget.budget(PROMPT_VERSION, size, MAX_NEW_TOKENS)
+        while True:
+            t0 = time.perf_counter()
+            output = self.pipe(text=messages, max_new_tokens=max_new_tokens, **self._generation_kwargs())
+            text = extract_generated_text(output)
+            analysis, parsed = self._parse(text)
+            stats = batch_item_stats(self.pipe, messages, text, time.perf_counter() - t0, parsed)
+            salvaged = None if parsed else self._salvage(text)
+            retry = None if salvaged else self._retry_budget(text, max_new_tokens, parsed, MAX_NEW_TOKENS)
+            self._record_usage(stats, PROMPT_VERSION, size, max_new_tokens, truncated=bool(retry))
+            if salvaged:
+                return self._complete([(salvaged, soap_note, doctor_plan, ethnicity)])[0]
+            if not retry:
+                return analysis, parsed
+            max_new_tokens = retry
+
+    def _parse_section(self, section, assistant_text: str):
+        """Returns (values, parsed) for the keys of one section, with fallbacks for missing keys."""
         try:
-            return json.loads(json_text)
+            with METRICS.stage("json_parse", agent="agent2"):
+                reply = json.loads(extract_json_object(assistant_text))
         except json.JSONDecodeError:
-            return {
-                "medicine_alignment": {"confidence_score": None, "rationale": "Parsing failed"},
-                "lab_test_analysis": [],
-                "lifestyle_recommendations": {},
-                "missing_information": ["Model output could not be parsed"],
-                "safety_notice": "Consult a healthcare professional."
+            reply = None
+        if not isinstance(reply, dict):
+            reply = {}
+        values = {key: reply.get(key, SECTION_FALLBACKS[key]) for key in section.keys}
+        return values, all(key in reply for key in section.keys)
+
+    def _iter_sections(self, jobs: list, batch_size: int = None):
+        """
+        Runs (messages, section, size) jobs and yields (job_index, text, wall_time) as they finish.
+
+        Jobs with the same generation settings share one batched call, whose budget is
+        the largest section budget since each row stops once its JSON object closes.
+        In constrained mode every section has its own schema, so the per-section calls
+        run concurrently instead (and merge into shared batches behind a scheduler).
+        Rows cut off by a learned budget are run once more at their section's ceiling.
+        """
+        groups = {}
+        for i, (_, section, _) in enumerate(jobs):
+            groups.setdefault(section.name if self.constrained else None, []).append(i)
+
+        def variant(section):
+            return f"{DECOMPOSED_PROMPT_VERSION}:{section.name}"
+
+        def run(indices):
+            finished = []
+            ceiling = max(jobs[i][1].max_new_tokens for i in indices)
+            max_new_tokens = max(self.token_budget.budget(variant(section), size, section.max_new_tokens)
+                                 for _, section, size in (jobs[i] for i in indices))
+            while indices:
+                results = run_pipe_batch(
+                    self.pipe, [jobs[i][0] for i in indices], max_new_tokens=max_new_tokens,
+                    batch_size=batch_size, **self._section_kwargs(jobs[indices[0]][1]),
+                )
+                truncated, retry = [], None
+                for i, (output, wall_time) in zip(indices, results):
+                    messages, section, size = jobs[i]
+                    text = extract_generated_text(output)
+                    parsed = self._parse_section(section, text)[1]
+                    row_retry = self._retry_budget(text, max_new_tokens, parsed, ceiling)
+                    self._record_usage(batch_item_stats(self.pipe, messages, text, wall_time, parsed),
+                                       variant(section), size, max_new_tokens, truncated=bool(row_retry))
+                    if row_retry:
+                        truncated.append(i)
+                        retry = row_retry
+                    else:
+                        finished.append((i, text, wall_time))
+                indices, max_new_tokens = truncated, retry
+            return finished
+
+        if not groups:
+            return
+        if len(groups) == 1:
+            yield from run(next(iter(groups.values())))
+            return
+        with ThreadPoolExecutor(len(groups)) as pool:
+            for future in as_completed([pool.submit(run, indices) for indices in groups.values()]):
+                yield from future.result()
+
+    def _analyze_decomposed(self, cases: list, batch_size: int = None):
+        """
+        Analyzes (soap_note, doctor_plan, ethnicity) cases section by section.
+        Returns a list of (analysis, parsed, stats) in case order.
+        """
+        jobs, owners = [], []
+        for case, (note, plan, eth) in enumerate(cases):
+            for section in SECTIONS:
+                jobs.append((self._build_section_messages(note, plan, eth, section), section,
+                             self._input_size(note, plan)))
+                owners.append(case)
+
+        results = [
+            [{"soap_note": assemble_soap_note(note, plan)}, True, []] for note, plan, _ in cases
+        ]
+        for i, text, wall_time in self._iter_sections(jobs, batch_size):
+            messages, section, _ = jobs[i]
+            result = results[owners[i]]
+            values, parsed = self._parse_section(section, text)
+            result[0].update(values)
+            result[1] = result[1] and parsed
+            result[2].append(batch_item_stats(self.pipe, messages, text, wall_time, parsed))
+
+        combined = []
+        for analysis, parsed, section_stats in results:
+            analysis = _in_output_order(analysis)
+            stats = {
+                "prompt_tokens": _total(s["prompt_tokens"] for s in section_stats),
+                "output_tokens": _total(s["output_tokens"] for s in section_stats),
+                "wall_time": max(s["wall_time"] for s in section_stats),
+                "parsed": parsed,
+                "cached": False,
+                "sections": len(section_stats),
             }
+            combined.append((analysis, parsed, stats))
+        return combined
+
+    def _parse(self, assistant_text: str):
+        """
+        Parses the model reply. Returns (analysis, parsed) where `parsed` is False
+        when the fallback analysis was used.
+        """
+        json_text = extract_json_object(assistant_text)
+
+        try:
+            with METRICS.stage("json_parse", agent="agent2"):
+                analysis = json.loads(json_text)
+        except json.JSONDecodeError:
+            analysis = None
+        # Valid JSON that is not an object (e.g. a refusal list) is a failure too
+        if isinstance(analysis, dict):
+            return analysis, True
+        return {
+            "medicine_alignment": {"confidence_score": None, "rationale": "Parsing failed"},
+            "lab_test_analysis": [],
+            "lifestyle_recommendations": {},
+            "missing_information": ["Model output could not be parsed"],
+            "safety_notice": "Consult a healthcare professional."
+        }, False
+
+    def analyze(self, soap_note: dict, doctor_plan: dict, ethnicity: str = "Not provided", use_cache: bool = True):
+        key = None
+        if self.cache is not None and use_cache:
+            key = self._cache_key(soap_note, doctor_plan, ethnicity)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        if self.decomposed:
+            analysis, parsed, _ = self._analyze_decomposed([(soap_note, doctor_plan, ethnicity)])[0]
+        else:
+            analysis, parsed = self._generate(soap_note, doctor_plan, ethnicity)
+        if key is not None and parsed:
+            self.cache.put(key, analysis)
+        return analysis
+
+    def analyze_stream(self, soap_note: dict, doctor_plan: dict, ethnicity: str = "Not provided",
+                       use_cache: bool = True):
+        """
+        Streaming variant of `analyze`.
+
+        Yields partial analyses holding the top-level sections completed so far,
+        then the final analysis exactly as `analyze` would return it. In decomposed
+        mode the assembled SOAP note comes first, then each section as it finishes.
+        """
+        key = None
+        if self.cache is not None and use_cache:
+            key = self._cache_key(soap_note, doctor_plan, ethnicity)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        if self.decomposed:
+            partial = {"soap_note": assemble_soap_note(soap_note, doctor_plan)}
+            yield dict(partial)
+            size = self._input_size(soap_note, doctor_plan)
+            jobs = [(self._build_section_messages(soap_note, doctor_plan, ethnicity, section), section, size)
+                    for section in SECTIONS]
+            parsed = True
+            for i, text, _ in self._iter_sections(jobs):
+                values, section_parsed = self._parse_section(jobs[i][1], text)
+                partial.update(values)
+                parsed = parsed and section_parsed
+                yield dict(partial)
+            analysis = _in_output_order(partial)
+            if key is not None and parsed:
+                self.cache.put(key, analysis)
+            yield analysis
+            return
+
+        messages = self._build_messages(soap_note, doctor_plan, ethnicity)
+        size = self._input_size(soap_note, doctor_plan)
+        max_new_tokens = self.token_budget.budget(PROMPT_VERSION, size, MAX_NEW_TOKENS)
+        while True:
+            parser = IncrementalJSONParser()
+            t0 = time.perf_counter()
+            for chunk in stream_pipe(self.pipe, messages, max_new_tokens=max_new_tokens, **self._generation_kwargs()):
+                if parser.feed(chunk):
+                    yield dict(parser.fields)
+                if parser.done:
+                    break
+
+            analysis, parsed = self._parse(parser.text)
+            stats = batch_item_stats(self.pipe, messages, parser.text, time.perf_counter() - t0, parsed)
+            salvaged = None if parsed else self._salvage(parser.text)
+            retry = None if salvaged else self._retry_budget(parser.text, max_new_tokens, parsed, MAX_NEW_TOKENS)
+            self._record_usage(stats, PROMPT_VERSION, size, max_new_tokens, truncated=bool(retry))
+            if not retry:
+                break
+            # The retry streams the sections again from the start
+            max_new_tokens = retry
+        if salvaged:
+            analysis, parsed = self._complete([(salvaged, soap_note, doctor_plan, ethnicity)])[0]
+        if key is not None and parsed:
+            self.cache.put(key, analysis)
+        yield analysis
+
+    def analyze_batch(self, soap_notes: list, doctor_plans: list, ethnicities: list = None, batch_size: int = None,
+                      use_cache: bool = True):
+        """
+        Analyzes many (SOAP note, doctor plan) pairs, padding them into shared forward passes.
+
+        Args:
+            soap_notes: List of Agent 1 notes.
+            doctor_plans: List of doctor plans, parallel to `soap_notes`.
+            ethnicities: Optional list of ethnicities, parallel to `soap_notes`.
+            batch_size: Conversations per forward pass. Defaults to the whole list.
+
+        Returns (analyses, stats), with the same per-item fallback and stats as
+        `SoapNoteGenerator.generate_batch`. In decomposed mode `batch_size` counts
+        section prompts, and an item's stats add up its sections.
+        """
+        ethnicities = ethnicities or ["Not provided"] * len(soap_notes)
+        if not (len(soap_notes) == len(doctor_plans) == len(ethnicities)):
+            raise ValueError("soap_notes, doctor_plans and ethnicities must have the same length")
+
+        t0 = time.perf_counter()
+        analyses = [None] * len(soap_notes)
+        items = [None] * len(soap_notes)
+        keys = [None] * len(soap_notes)
+        pending = []
+        for i, (note, plan, eth) in enumerate(zip(soap_notes, doctor_plans, ethnicities)):
+            if self.cache is not None and use_cache:
+                keys[i] = self._cache_key(note, plan, eth)
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    analyses[i] = cached
+                    items[i] = {"cached": True, "parsed": True, "wall_time": 0.0}
+                    continue
+            pending.append(i)
+
+        if self.decomposed:
+            cases = [(soap_notes[i], doctor_plans[i], ethnicities[i]) for i in pending]
+            for i, (analysis, parsed, stats) in zip(pending, self._analyze_decomposed(cases, batch_size)):
+                analyses[i], items[i] = analysis, stats
+                if keys[i] is not None and parsed:
+                    self.cache.put(keys[i], analysis)
+            return analyses, {"wall_time": time.perf_counter() - t0, "items": items}
+
+        sizes = {i: self._input_size(soap_notes[i], doctor_plans[i]) for i in pending}
+        # Rows stop once their JSON closes, so the batch gets the largest budget of its rows
+        max_new_tokens = max((self.token_budget.budget(PROMPT_VERSION, sizes[i], MAX_NEW_TOKENS) for i in pending),
+                             default=MAX_NEW_TOKENS)
+        while pending:
+            conversations = [self._build_messages(soap_notes[i], doctor_plans[i], ethnicities[i]) for i in pending]
+            results = run_pipe_batch(self.pipe, conversations, max_new_tokens=max_new_tokens, batch_size=batch_size,
+                                     **self._generation_kwargs())
+
+            truncated, retry, salvaged = [], None, {}
+            for i, messages, (output, wall_time) in zip(pending, conversations, results):
+                text = extract_generated_text(output)
+                analyses[i], parsed = self._parse(text)
+                items[i] = batch_item_stats(self.pipe, messages, text, wall_time, parsed)
+                if not parsed:
+                    salvaged[i] = self._salvage(text)
+                row_retry = None if salvaged.get(i) else self._retry_budget(text, max_new_tokens, parsed,
+                                                                            MAX_NEW_TOKENS)
+                self._record_usage(items[i], PROMPT_VERSION, sizes[i], max_new_tokens, truncated=bool(row_retry))
+                if row_retry:
+                    truncated.append(i)
+                    retry = row_retry
+                elif keys[i] is not None and parsed:
+                    self.cache.put(keys[i], analyses[i])
+
+            # Partial replies keep their complete keys; only the missing sections are generated
+            partial = [i for i in salvaged if salvaged[i]]
+            completed = self._complete([(salvaged[i], soap_notes[i], doctor_plans[i], ethnicities[i])
+                                        for i in partial], batch_size)
+            for i, (analysis, parsed) in zip(partial, completed):
+                analyses[i] = analysis
+                items[i]["parsed"] = parsed
+                if keys[i] is not None and parsed:
+                    self.cache.put(keys[i], analysis)
+            # Truncated rows with nothing to salvage are generated once more, together, at the ceiling
+            pending, max_new_tokens = truncated, retry
+        return analyses, {"wall_time": time.perf_counter() - t0, "items": items}
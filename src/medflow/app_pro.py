@@ -7,15 +7,21 @@ src_dir = os.path.abspath(os.path.join(current_dir, ".."))
 if src_dir not in sys.path:
     sys.path.insert(0, src_dir)
 
-import json
-import torch
-import gradio as gr
-from PIL import Image
-from transformers import pipeline
-from huggingface_hub import login
+import uuid
+import time
+import threading
 from medflow.agents.agent1 import SoapNoteGenerator
 from medflow.agents.agent2 import PlanAnalyzer
-from medflow.utils.pdf_generator import generate_soap_pdf
+from medflow.utils.response_cache import ResponseCache
+from medflow.utils.encounter_store import EncounterStore
+from medflow.utils.metrics import METRICS
+from medflow.serving.scheduler import MicroBatchScheduler
+from medflow.serving.prefetch import Prefetcher, SpeculativePipe
+from medflow.model import MODEL_ID
+from medflow.serving.model_host import load_model_pipe
+
+# Gradio, torch and transformers are imported on first use (build_demo / get_agents),
+# so importing this module is cheap
 
 # Setup organized PDF storage
 PROJECT_ROOT = os.path.abspath(os.path.join(src_dir, ".."))
@@ -23,35 +29,51 @@ PDF_DIR = os.path.join(PROJECT_ROOT, "pdfs")
 if not os.path.exists(PDF_DIR):
     os.makedirs(PDF_DIR)
 
-# Initialize Model & Agents
-print("Initializing MedFlow AI Production Pipeline...")
-hf_token = os.getenv("HF_TOKEN")
-if hf_token:
-    login(token=hf_token)
-
-try:
-    pipe = pipeline(
-        "image-text-to-text",
-        model="google/medgemma-4b-it",
-        torch_dtype=torch.bfloat16,
-        device="cuda" if torch.cuda.is_available() else "cpu",
-    )
-    generator = SoapNoteGenerator(pipe)
-    analyzer = PlanAnalyzer(pipe)
-except Exception as e:
-    print(f"Error loading model: {e}")
-    # Fallback to demo mode or error UI if needed, but here we assume user wants the real thing
-    generator = None
-    analyzer = None
+# Agent outputs keyed on their inputs, so re-clicking with the same data is instant
+response_cache = ResponseCache(cache_dir=os.path.join(PROJECT_ROOT, ".cache", "responses"))
+
+# Step 1 results stay on the server; the browser only holds the encounter id
+encounters = EncounterStore(ttl=4 * 3600, spill_dir=os.path.join(PROJECT_ROOT, ".cache", "encounters"))
+
+# Initialize Model & Agents (on first use)
+generator = None
+analyzer = None
+# Runs Agent 1 speculatively while the Step 1 form is being filled in (see launch)
+prefetcher = None
+_agents_loaded = False
+_agents_lock = threading.Lock()
+
+def get_agents(model_id=MODEL_ID, workers=1, pin_cores=False, server_url=None, decompose_analysis=False,
+               prestructure_intake=False, record=None, replay=None, prefetch=False):
+    """Loads the model and both agents once; returns (None, None) if loading failed."""
+    global generator, analyzer, prefetcher, _agents_loaded
+    with _agents_lock:
+        if _agents_loaded:
+            return generator, analyzer
+        print("Initializing MedFlow AI Production Pipeline...")
+        try:
+            # Reuse the KV states of the constant system prompts across calls, and group
+            # concurrent requests from all sessions into micro-batches, one in flight per worker
+            pipe = MicroBatchScheduler(load_model_pipe(model_id, workers, pin_cores, server_url, record, replay),
+                                       max_batch_size=8, max_wait_ms=50, dispatchers=workers)
+            generator = SoapNoteGenerator(pipe, cache=response_cache, prestructured=prestructure_intake)
+            analyzer = PlanAnalyzer(pipe, cache=response_cache, decomposed=decompose_analysis)
+            if prefetch:
+                prefetcher = Prefetcher(SoapNoteGenerator(SpeculativePipe(pipe), cache=response_cache,
+                                                          prestructured=prestructure_intake,
+                                                          token_budget=generator.token_budget))
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            generator = None
+            analyzer = None
+        _agents_loaded = True
+        return generator, analyzer
 
 def sanitize_filename(name):
     return "".join([c for c in name if c.isalnum() or c in (" ", "-", "_")]).strip().replace(" ", "_")
 
-def run_step1(name, pid, age, gender, symptoms, duration, severity, history, medications, bp, hr, image):
-    if not generator:
-        return {"error": "Model failed to load. Please check logs and HF_TOKEN."}, ""
-    
-    patient_info = {
+def build_patient_info(name, pid, age, gender, symptoms, duration, severity, history, medications, bp, hr):
+    return {
         "patient_name": name,
         "patient_id": pid,
         "age": age,
@@ -66,34 +88,92 @@ def run_step1(name, pid, age, gender, symptoms, duration, severity, history, med
             "heart_rate": hr
         }
     }
+
+def prefetch_step1(name, pid, age, gender, symptoms, duration, severity, history, medications, bp, hr, image,
+                   session=None):
+    """Step 1 form change: Agent 1 runs speculatively once the inputs stop changing."""
+    if prefetcher is None or not session:
+        return
+    if not symptoms:
+        prefetcher.cancel(session)
+        return
+    patient_info = build_patient_info(name, pid, age, gender, symptoms, duration, severity, history, medications, bp, hr)
+    prefetcher.update(session, patient_info, [image] if image else None)
+
+def take_prefetched(session, patient_info, images, fresh):
+    """Agent 1's note if it was generated speculatively for exactly these inputs, else None."""
+    if prefetcher is None or not session:
+        return None
+    if fresh:
+        prefetcher.cancel(session)
+        return None
+    note = prefetcher.take(session, patient_info, images)
+    stats = prefetcher.stats()
+    print(f"[prefetch] {'hit' if note is not None else 'miss'}: hit rate {stats['hit_rate']:.0%} over "
+          f"{stats['hits'] + stats['misses']} clicks, {stats['saved_seconds']:.1f}s generated ahead, "
+          f"{stats['wasted_seconds']:.1f}s ({stats['wasted_tokens']} tokens) wasted")
+    return note
+
+def run_step1(name, pid, age, gender, symptoms, duration, severity, history, medications, bp, hr, image, fresh=False,
+              session=None):
+    """Streams Agent 1 sections into the UI as they complete, then the final draft."""
+    generator, _ = get_agents()
+    if not generator:
+        yield {"error": "Model failed to load. Please check logs and HF_TOKEN."}, ""
+        return
     
+    patient_info = build_patient_info(name, pid, age, gender, symptoms, duration, severity, history, medications, bp, hr)
     images = [image] if image else None
     
     try:
-        soap_note_partial = generator.generate(patient_info, images=images)
+        t0 = time.perf_counter()
+        first_field = True
+        soap_note_partial = {}
+        note = take_prefetched(session, patient_info, images, fresh)
+        notes = [note] if note is not None else generator.generate_stream(patient_info, images=images, use_cache=not fresh)
+        for soap_note_partial in notes:
+            if first_field:
+                # Click to the first streamed section shown in the UI
+                METRICS.observe("medflow_stage_seconds", time.perf_counter() - t0, stage="first_field", step="step1")
+                first_field = False
+            yield soap_note_partial, ""
+
         # Add patient details to the structure for Step 2
         soap_note_partial["patient_name"] = name
         soap_note_partial["patient_id"] = pid
-        return soap_note_partial, json.dumps(soap_note_partial)
+        encounter_id = encounters.put({"soap_note": soap_note_partial, "images": images})
+        yield soap_note_partial, encounter_id
     except Exception as e:
-        return {"error": f"Agent 1 Error: {e}"}, ""
+        yield {"error": f"Agent 1 Error: {e}"}, ""
 
-def run_step2(soap_note_partial_json, med_plan, lab_tests, follow_up, ethnicity):
+def run_step2(encounter_id, med_plan, lab_tests, follow_up, ethnicity, fresh=False):
+    """Streams Agent 2 sections into the UI as they complete, then the final analysis and PDF."""
+    _, analyzer = get_agents()
     if not analyzer:
-        return {"error": "Model failed to load."}, None
+        yield {"error": "Model failed to load."}, None
+        return
     
-    if not soap_note_partial_json:
-        return {"error": "No assessment data found. Please run Step 1 first."}, None
+    encounter = encounters.get(encounter_id)
+    if encounter is None:
+        yield {"error": "No assessment data found. Please run Step 1 first."}, None
+        return
         
     try:
-        soap_note_partial = json.loads(soap_note_partial_json)
+        soap_note_partial = encounter["soap_note"]
         doctor_plan = {
             "medications": [m.strip() for m in med_plan.split(",")] if med_plan else [],
             "lab_tests": [l.strip() for l in lab_tests.split(",")] if lab_tests else [],
             "follow_up": follow_up
         }
         
-        final_output = analyzer.analyze(soap_note_partial, doctor_plan, ethnicity)
+        t0 = time.perf_counter()
+        first_field = True
+        final_output = {}
+        for final_output in analyzer.analyze_stream(soap_note_partial, doctor_plan, ethnicity, use_cache=not fresh):
+            if first_field:
+                METRICS.observe("medflow_stage_seconds", time.perf_counter() - t0, stage="first_field", step="step2")
+                first_field = False
+            yield final_output, None
         
         # Extract name/id for filename
         name = soap_note_partial.get("patient_name", "Unknown")
@@ -102,82 +182,117 @@ def run_step2(soap_note_partial_json, med_plan, lab_tests, follow_up, ethnicity)
         # Generate PDF
         clean_name = sanitize_filename(name)
         clean_pid = sanitize_filename(pid)
-        pdf_name = f"soap_note_{clean_name}_{clean_pid}.pdf"
+        # A per-request suffix keeps concurrent users from overwriting each other's file
+        pdf_name = f"soap_note_{clean_name}_{clean_pid}_{uuid.uuid4().hex[:8]}.pdf"
         pdf_filename = os.path.join(PDF_DIR, pdf_name)
         
         # Agent 2 output usually contains the final soap_note
         final_soap_note = final_output.get("soap_note", soap_note_partial)
         
+        from medflow.utils.pdf_generator import generate_soap_pdf
         generate_soap_pdf(final_soap_note, final_output, filename=pdf_filename, 
                           patient_name=name, patient_id=pid)
         
-        return final_output, pdf_filename
+        yield final_output, pdf_filename
     except Exception as e:
-        return {"error": f"Agent 2 Error: {e}"}, None
+        yield {"error": f"Agent 2 Error: {e}"}, None
 
 # UI Definition
-with gr.Blocks(title="MedFlow AI - Clinical Assistant (PRO)") as demo:
-    gr.Markdown("# 🏥 MedFlow AI (Production Mode)")
-    gr.Markdown("Powered by Google MedGemma. Real-time clinical assessment and plan analysis.")
+def build_demo():
+    import gradio as gr
+
+    with gr.Blocks(title="MedFlow AI - Clinical Assistant (PRO)") as demo:
+        gr.Markdown("# 🏥 MedFlow AI (Production Mode)")
+        gr.Markdown("Powered by Google MedGemma. Real-time clinical assessment and plan analysis.")
     
-    with gr.Tab("Step 1: Patient Assessment"):
-        with gr.Row():
-            with gr.Column():
-                with gr.Row():
-                    patient_name = gr.Textbox(label="Patient Name", value="John Doe")
-                    p_id = gr.Textbox(label="Patient ID", value="P-12345")
-                age = gr.Number(label="Age", value=45)
-                gender = gr.Dropdown(label="Gender", choices=["Male", "Female", "Other"], value="Male")
-                symptoms = gr.Textbox(label="Symptoms (comma separated)", placeholder="Chest discomfort, Fatigue", value="Chest discomfort, Shortness of breath during exertion, Fatigue")
-                duration = gr.Textbox(label="Duration", value="2 weeks")
-                severity = gr.Dropdown(label="Severity", choices=["Mild", "Moderate", "Severe"], value="Moderate")
-                history = gr.Textbox(label="Medical History (comma separated)", value="Hypertension")
-                meds = gr.Textbox(label="Current Medications (comma separated)", value="")
-                bp = gr.Textbox(label="Blood Pressure", value="145/90")
-                hr = gr.Textbox(label="Heart Rate", value="92 bpm")
-                input_image = gr.Image(type="pil", label="Medical Scan (Optional)")
+        with gr.Tab("Step 1: Patient Assessment"):
+            with gr.Row():
+                with gr.Column():
+                    with gr.Row():
+                        patient_name = gr.Textbox(label="Patient Name", value="John Doe")
+                        p_id = gr.Textbox(label="Patient ID", value="P-12345")
+                    age = gr.Number(label="Age", value=45)
+                    gender = gr.Dropdown(label="Gender", choices=["Male", "Female", "Other"], value="Male")
+                    symptoms = gr.Textbox(label="Symptoms (comma separated)", placeholder="Chest discomfort, Fatigue", value="Chest discomfort, Shortness of breath during exertion, Fatigue")
+                    duration = gr.Textbox(label="Duration", value="2 weeks")
+                    severity = gr.Dropdown(label="Severity", choices=["Mild", "Moderate", "Severe"], value="Moderate")
+                    history = gr.Textbox(label="Medical History (comma separated)", value="Hypertension")
+                    meds = gr.Textbox(label="Current Medications (comma separated)", value="")
+                    bp = gr.Textbox(label="Blood Pressure", value="145/90")
+                    hr = gr.Textbox(label="Heart Rate", value="92 bpm")
+                    input_image = gr.Image(type="pil", label="Medical Scan (Optional)")
+                    fresh_step1 = gr.Checkbox(label="Fresh sample (bypass response cache)", value=False)
                 
-                generate_draft_btn = gr.Button("📝 Run AI Assessment", variant="primary")
+                    generate_draft_btn = gr.Button("📝 Run AI Assessment", variant="primary")
             
-            with gr.Column():
-                draft_output_json = gr.JSON(label="Structured Assessment (Agent 1 Output)")
-                draft_output_raw = gr.Textbox(label="Hidden Draft JSON (for Step 2)", visible=False)
+                with gr.Column():
+                    draft_output_json = gr.JSON(label="Structured Assessment (Agent 1 Output)")
+                    encounter_id = gr.Textbox(label="Hidden Encounter ID (for Step 2)", visible=False)
                 
-        generate_draft_btn.click(
-            run_step1, 
-            inputs=[patient_name, p_id, age, gender, symptoms, duration, severity, history, meds, bp, hr, input_image],
-            outputs=[draft_output_json, draft_output_raw]
-        )
+            step1_inputs = [patient_name, p_id, age, gender, symptoms, duration, severity, history, meds, bp, hr, input_image]
+
+            # Gradio passes the request to the first parameter annotated gr.Request
+            def step1(request: gr.Request, *values):
+                yield from run_step1(*values, session=request.session_hash)
+
+            def form_changed(request: gr.Request, *values):
+                prefetch_step1(*values, session=request.session_hash)
 
-    with gr.Tab("Step 2: Doctor's Plan & Finalization"):
-        with gr.Row():
-            with gr.Column():
-                gr.Markdown("### Input Doctor's Plan")
-                plan_meds = gr.Textbox(label="Prescribed Medications (comma separated)", value="Omeprazole 20mg once daily")
-                plan_labs = gr.Textbox(label="Lab Tests (comma separated)", value="H. pylori test, CBC")
-                plan_followup = gr.Textbox(label="Follow-up", value="2 weeks")
-                ethnicity = gr.Textbox(label="Patient Ethnicity", value="South Asian")
+            generate_draft_btn.click(
+                step1, 
+                inputs=step1_inputs + [fresh_step1],
+                outputs=[draft_output_json, encounter_id]
+            )
+            if prefetcher is not None:
+                for component in step1_inputs:
+                    component.change(form_changed, inputs=step1_inputs, outputs=None, show_progress="hidden",
+                                     trigger_mode="always_last")
+
+        with gr.Tab("Step 2: Doctor's Plan & Finalization"):
+            with gr.Row():
+                with gr.Column():
+                    gr.Markdown("### Input Doctor's Plan")
+                    plan_meds = gr.Textbox(label="Prescribed Medications (comma separated)", value="Omeprazole 20mg once daily")
+                    plan_labs = gr.Textbox(label="Lab Tests (comma separated)", value="H. pylori test, CBC")
+                    plan_followup = gr.Textbox(label="Follow-up", value="2 weeks")
+                    ethnicity = gr.Textbox(label="Patient Ethnicity", value="South Asian")
+                    fresh_step2 = gr.Checkbox(label="Fresh sample (bypass response cache)", value=False)
                 
-                finalize_btn = gr.Button("✅ Finalize & Analyze Plan", variant="primary")
+                    finalize_btn = gr.Button("✅ Finalize & Analyze Plan", variant="primary")
             
-            with gr.Column():
-                final_output_json = gr.JSON(label="Final Analysis (Agent 2 Output)")
-                pdf_download = gr.File(label="Download Final SOAP Note PDF")
-
-        finalize_btn.click(
-            run_step2,
-            inputs=[draft_output_raw, plan_meds, plan_labs, plan_followup, ethnicity],
-            outputs=[final_output_json, pdf_download]
+                with gr.Column():
+                    final_output_json = gr.JSON(label="Final Analysis (Agent 2 Output)")
+                    pdf_download = gr.File(label="Download Final SOAP Note PDF")
+
+            finalize_btn.click(
+                run_step2,
+                inputs=[encounter_id, plan_meds, plan_labs, plan_followup, ethnicity, fresh_step2],
+                outputs=[final_output_json, pdf_download]
+            )
+
+        gr.Examples(
+            examples=[
+                ["John Doe", "P-12345", 45, "Male", "Chest discomfort, Fatigue", "2 weeks", "Moderate", "Hypertension", "", "145/90", "92 bpm", None],
+                ["Jane Smith", "P-67890", 30, "Female", "Sore throat, Fever", "3 days", "Mild", "None", "Vitamins", "120/80", "72 bpm", None]
+            ],
+            inputs=[patient_name, p_id, age, gender, symptoms, duration, severity, history, meds, bp, hr, input_image]
         )
 
-    gr.Examples(
-        examples=[
-            ["John Doe", "P-12345", 45, "Male", "Chest discomfort, Fatigue", "2 weeks", "Moderate", "Hypertension", "", "145/90", "92 bpm", None],
-            ["Jane Smith", "P-67890", 30, "Female", "Sore throat, Fever", "3 days", "Mild", "None", "Vitamins", "120/80", "72 bpm", None]
-        ],
-        inputs=[patient_name, p_id, age, gender, symptoms, duration, severity, history, meds, bp, hr, input_image]
-    )
+    return demo
+
+def launch(model_id=MODEL_ID, workers=1, pin_cores=False, server_url=None, decompose_analysis=False,
+           prestructure_intake=False, record=None, replay=None, prefetch=True, **launch_kwargs):
+    import gradio as gr
+
+    # Load the model before the first visitor arrives rather than on their click, and
+    # before Gradio starts any threads, since model workers are forked
+    get_agents(model_id, workers, pin_cores, server_url, decompose_analysis, prestructure_intake, record, replay,
+               prefetch)
+    demo = build_demo()
+    # Let sessions reach the scheduler concurrently so their requests can share batches
+    demo.queue(default_concurrency_limit=16)
+    demo.launch(theme=gr.themes.Soft(), **launch_kwargs)
 
 if __name__ == "__main__":
     # In production, we typically don't share=True unless needed, but we keep it modular
-    demo.launch(theme=gr.themes.Soft())
+    launch()
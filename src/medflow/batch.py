@@ -0,0 +1,391 @@
+"""
+Bulk runner for JSONL files of cases.
+
+Each input line is one case:
+    {"id": "P-12345", "patient_info": {...}, "doctor_plan": {...},
+     "ethnicity": "South Asian", "images": ["scan.png"]}
+
+Agent 1, Agent 2 and PDF rendering run as overlapping stages connected by bounded
+queues, so memory stays flat however large the file is. Results are appended to the
+output JSONL as they finish, and ids already present there are skipped on restart.
+An input line that is not a JSON object gets an error result with the id `line-<n>`
+and the run goes on.
+
+PDFs go either to one file per case in a directory, or are rendered in memory and
+appended to a single tar archive. Each PDF reaches the disk before its result line;
+on restart, a member torn by a crash is cut off the archive before appending.
+"""
+import io
+import os
+import json
+import time
+import queue
+import tarfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.agents.agent2 import PlanAnalyzer
+from medflow.utils.token_log import TOKEN_LOG
+
+_DONE = object()
+
+
+def sanitize_filename(name):
+    return "".join([c for c in str(name) if c.isalnum() or c in (" ", "-", "_")]).strip().replace(" ", "_")
+
+
+def completed_ids(output_path: str) -> set:
+    """Ids already written to `output_path` (a partially written last line is ignored)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+    return done
+
+
+def _start_new_line(path):
+    """Appends a newline to `path` if its last line was torn by a crash."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+
+def _load_images(paths):
+    if not paths:
+        return None
+    from PIL import Image
+    return [Image.open(path) for path in paths]
+
+
+def _render_pdf(final_soap_note, final_output, filename, patient_name, patient_id):
+    # Runs in a worker process; returns the PDF bytes when filename is None
+    from medflow.utils.pdf_generator import generate_soap_pdf
+    return generate_soap_pdf(final_soap_note, final_output, filename=filename,
+                             patient_name=patient_name, patient_id=patient_id, verbose=False)
+
+
+def _add_to_archive(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    archive.addfile(info, io.BytesIO(data))
+    archive.fileobj.flush()
+    os.fsync(archive.fileobj.fileno())
+
+
+def _open_archive(path):
+    """
+    Opens a tar archive for appending. A run that was killed leaves no end-of-archive
+    blocks and possibly a partly written member, so the file is first cut back to its
+    last complete member.
+    """
+    if not os.path.exists(path):
+        return tarfile.open(path, "a")
+    size = os.path.getsize(path)
+    end = 0
+    try:
+        with tarfile.open(path, "r") as tar:
+            for member in tar:
+                member_end = member.offset_data + -(-member.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                if member_end > size:
+                    break
+                end = member_end
+    except tarfile.ReadError:
+        pass
+    if end == 0:
+        os.remove(path)
+        return tarfile.open(path, "a")
+    with open(path, "r+b") as f:
+        f.truncate(end)
+        f.seek(end)
+        # End-of-archive marker, which "a" mode looks for and then overwrites
+        f.write(b"\0" * (2 * tarfile.BLOCKSIZE))
+    return tarfile.open(path, "a")
+
+
+def _take_batch(q, batch_size):
+    """Blocks for one item, then takes whatever else is ready, up to `batch_size`."""
+    items = [q.get()]
+    while len(items) < batch_size and items[-1] is not _DONE:
+        try:
+            items.append(q.get_nowait())
+        except queue.Empty:
+            break
+    return items
+
+
+class BatchRunner:
+    """
+    Runs a JSONL file of cases through Agent 1 -> Agent 2 -> PDF.
+
+    Args:
+        pipe: Pipeline shared by both agents.
+        pdf_dir: Directory for rendered PDFs.
+        pdf_archive: Tar file the PDFs are appended to instead of `pdf_dir`.
+            No PDFs are rendered when both are None.
+        batch_size: Cases per agent forward pass.
+        queue_size: Capacity of each inter-stage queue.
+        pdf_workers: Processes rendering PDFs; 0 renders in the Agent 2 thread.
+        log_every: Print throughput every this many finished cases.
+        decompose_analysis: Run Agent 2 as short per-section prompts (see PlanAnalyzer).
+        prestructure_intake: Agent 1 only generates the narrative (see SoapNoteGenerator).
+    """
+
+    def __init__(self, pipe, pdf_dir: str = None, pdf_archive: str = None, batch_size: int = 4,
+                 queue_size: int = 16, pdf_workers: int = 2, log_every: int = 10, decompose_analysis: bool = False,
+                 prestructure_intake: bool = False):
+        if pdf_dir and pdf_archive:
+            raise ValueError("Pass either pdf_dir or pdf_archive, not both")
+        self.agent1 = SoapNoteGenerator(pipe, prestructured=prestructure_intake)
+        self.agent2 = PlanAnalyzer(pipe, decomposed=decompose_analysis)
+        self.pdf_dir = pdf_dir
+        self.pdf_archive = pdf_archive
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.pdf_workers = pdf_workers
+        self.log_every = log_every
+
+    def run(self, input_path: str, output_path: str) -> dict:
+        skip = completed_ids(output_path)
+        if skip:
+            print(f"Resuming: {len(skip)} cases already in {output_path}")
+        if self.pdf_dir:
+            os.makedirs(self.pdf_dir, exist_ok=True)
+
+        to_agent1 = queue.Queue(self.queue_size)
+        to_agent2 = queue.Queue(self.queue_size)
+        results = queue.Queue(self.queue_size)
+        errors = []
+
+        pool = None
+        if (self.pdf_dir or self.pdf_archive) and self.pdf_workers > 0:
+            # Spawned workers do not inherit model threads or weights from this process
+            pool = ProcessPoolExecutor(self.pdf_workers, mp_context=multiprocessing.get_context("spawn"))
+        # Bounds the PDFs in flight so rendering cannot buffer unbounded results
+        pdf_slots = threading.BoundedSemaphore(self.queue_size)
+
+        def guarded(stage, *args):
+            try:
+                stage(*args)
+            except Exception as e:
+                errors.append(e)
+                results.put(_DONE)
+
+        stages = [
+            threading.Thread(target=guarded, args=(self._read, input_path, skip, to_agent1), daemon=True),
+            threading.Thread(target=guarded, args=(self._run_agent1, to_agent1, to_agent2), daemon=True),
+            threading.Thread(target=guarded, args=(self._run_agent2, to_agent2, results, pool, pdf_slots), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+
+        summary = self._write(results, output_path)
+        if pool is not None:
+            pool.shutdown()
+        if errors:
+            raise errors[0]
+        return summary
+
+    def _read(self, input_path, skip, out):
+        with open(input_path, "r") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError(f"expected an object, got {type(record).__name__}")
+                except ValueError as e:
+                    record = {"id": f"line-{line_no}", "error": f"Input Error: line {line_no}: {e}"}
+                # Prefixed so a line number cannot clash with a real case id
+                record.setdefault("id", f"line-{line_no}")
+                if str(record["id"]) in skip:
+                    continue
+                out.put(record)
+        out.put(_DONE)
+
+    def _prepare(self, records, out):
+        """
+        Checks each record and loads its images, so one bad case goes to `out` as an
+        error instead of failing its whole micro-batch.
+        """
+        ready, images = [], []
+        for record in records:
+            if "error" not in record:
+                try:
+                    if not isinstance(record.get("patient_info"), dict):
+                        raise ValueError("patient_info must be an object")
+                    images.append(_load_images(record.get("images")))
+                    ready.append(record)
+                    continue
+                except Exception as e:
+                    record["error"] = f"Input Error: {e}"
+            out.put(record)
+        return ready, images
+
+    def _run_agent1(self, inp, out):
+        while True:
+            records = _take_batch(inp, self.batch_size)
+            done = records[-1] is _DONE
+            records, images = self._prepare([r for r in records if r is not _DONE], out)
+            if records:
+                t0 = time.perf_counter()
+                try:
+                    notes, _ = self.agent1.generate_batch([r["patient_info"] for r in records], images=images)
+                except Exception as e:
+                    notes = [None] * len(records)
+                    for r in records:
+                        r["error"] = f"Agent 1 Error: {e}"
+                elapsed = time.perf_counter() - t0
+                for record, note in zip(records, notes):
+                    record["soap_note_partial"] = note
+                    record["timings"] = {"agent1": elapsed}
+                    out.put(record)
+            if done:
+                out.put(_DONE)
+                return
+
+    def _run_agent2(self, inp, out, pool, pdf_slots):
+        while True:
+            records = _take_batch(inp, self.batch_size)
+            done = records[-1] is _DONE
+            ready = [r for r in records if r is not _DONE and "error" not in r]
+            failed = [r for r in records if r is not _DONE and "error" in r]
+
+            if ready:
+                t0 = time.perf_counter()
+                try:
+                    analyses, _ = self.agent2.analyze_batch(
+                        [r["soap_note_partial"] for r in ready],
+                        [r.get("doctor_plan", {}) for r in ready],
+                        [r.get("ethnicity", "Not provided") for r in ready],
+                    )
+                except Exception as e:
+                    analyses = [None] * len(ready)
+                    for r in ready:
+                        r["error"] = f"Agent 2 Error: {e}"
+                elapsed = time.perf_counter() - t0
+                for record, analysis in zip(ready, analyses):
+                    record["timings"]["agent2"] = elapsed
+                    if analysis is None:
+                        out.put(record)
+                        continue
+                    if not isinstance(analysis, dict):
+                        record["error"] = f"Agent 2 Error: expected an object, got {type(analysis).__name__}"
+                        out.put(record)
+                        continue
+                    record["final_output"] = analysis
+                    self._render(record, out, pool, pdf_slots)
+
+            for record in failed:
+                out.put(record)
+            if done:
+                # Taking every slot waits for the PDFs still rendering to be handed on
+                if pool is not None:
+                    for _ in range(self.queue_size):
+                        pdf_slots.acquire()
+                out.put(_DONE)
+                return
+
+    def _render(self, record, out, pool, pdf_slots):
+        if not (self.pdf_dir or self.pdf_archive):
+            out.put(record)
+            return
+
+        analysis = record["final_output"]
+        patient_info = record.get("patient_info", {})
+        name = patient_info.get("patient_name", "Unknown")
+        pid = patient_info.get("patient_id", record["id"])
+        try:
+            soap_note = analysis.get("soap_note") or dict(record["soap_note_partial"], plan=record.get("doctor_plan", {}))
+        except Exception as e:
+            record["error"] = f"PDF Error: {e}"
+            out.put(record)
+            return
+        pdf_name = f"soap_note_{sanitize_filename(record['id'])}.pdf"
+        # Archived PDFs come back as bytes and are added by the writer
+        filename = os.path.join(self.pdf_dir, pdf_name) if self.pdf_dir else None
+        args = (soap_note, analysis, filename, name, pid)
+
+        def store(result):
+            if filename:
+                record["pdf"] = result
+            else:
+                record["pdf"] = f"{self.pdf_archive}:{pdf_name}"
+                record["pdf_member"] = (pdf_name, result)
+
+        if pool is None:
+            try:
+                store(_render_pdf(*args))
+            except Exception as e:
+                record["error"] = f"PDF Error: {e}"
+            out.put(record)
+            return
+
+        pdf_slots.acquire()
+        t0 = time.perf_counter()
+        future = pool.submit(_render_pdf, *args)
+
+        def finished(f, record=record):
+            record["timings"]["pdf"] = time.perf_counter() - t0
+            try:
+                store(f.result())
+            except Exception as e:
+                record["error"] = f"PDF Error: {e}"
+            out.put(record)
+            pdf_slots.release()
+
+        future.add_done_callback(finished)
+
+    def _write(self, results, output_path):
+        written = failed = 0
+        t0 = time.perf_counter()
+        archive = _open_archive(self.pdf_archive) if self.pdf_archive else None
+        _start_new_line(output_path)
+        try:
+            with open(output_path, "a") as f:
+                while True:
+                    record = results.get()
+                    if record is _DONE:
+                        break
+                    # The PDF is on disk before its line, so a resumed id always has its PDF
+                    member = record.pop("pdf_member", None)
+                    if member is not None:
+                        _add_to_archive(archive, *member)
+                    f.write(json.dumps({
+                        "id": record["id"],
+                        "soap_note_partial": record.get("soap_note_partial"),
+                        "final_output": record.get("final_output"),
+                        "pdf": record.get("pdf"),
+                        "error": record.get("error"),
+                        "timings": record.get("timings", {}),
+                    }) + "\n")
+                    f.flush()
+                    written += 1
+                    failed += "error" in record
+                    if written % self.log_every == 0:
+                        rate = written / (time.perf_counter() - t0)
+                        print(f"{written} cases written ({failed} failed), {rate:.2f} cases/s")
+        finally:
+            if archive is not None:
+                archive.close()
+
+        elapsed = time.perf_counter() - t0
+        print(f"Done: {written} cases written ({failed} failed) in {elapsed:.1f}s")
+        for agent, usage in sorted(TOKEN_LOG.summary().items()):
+            prompt, output = usage["prompt_tokens"], usage["output_tokens"]
+            if prompt and output:
+                print(f"  {agent}: {usage['calls']} calls, prompt {prompt['mean']:.0f} mean / {prompt['p95']} p95 tokens, "
+                      f"output {output['mean']:.0f} mean / {output['p95']} p95 tokens")
+        return {"written": written, "failed": failed, "seconds": elapsed}
@@ -0,0 +1,286 @@
+"""
+The `medflow` command line: python -m medflow <run|batch|pdf|graph|serve|model-server|workflow> ...
+
+Each subcommand imports what it needs inside its handler, so building the parser and
+running the light subcommands (pdf, graph) never loads torch, transformers or gradio.
+"""
+import os
+import json
+import argparse
+
+
+def cmd_run(args):
+    from medflow.main import run
+
+    run(args)
+
+
+def _start_metrics(args):
+    if args.metrics_port is not None:
+        from medflow.utils.metrics import serve_metrics
+        serve_metrics(args.metrics_port)
+
+
+def cmd_batch(args):
+    from medflow.batch import BatchRunner
+    from medflow.serving.model_host import load_model_pipe
+
+    _start_metrics(args)
+    if args.replay:
+        print(f"Replaying {args.replay}...")
+    else:
+        print(f"Using model server {args.model_server}..." if args.model_server else f"Loading {args.model}...")
+    pipe = load_model_pipe(args.model, args.workers, args.pin_cores, args.model_server, args.record, args.replay)
+    runner = BatchRunner(
+        pipe,
+        pdf_dir=args.pdf_dir,
+        pdf_archive=args.pdf_archive,
+        batch_size=args.batch_size,
+        queue_size=args.queue_size,
+        pdf_workers=args.pdf_workers,
+        log_every=args.log_every,
+        decompose_analysis=args.decompose_analysis,
+        prestructure_intake=args.prestructure_intake,
+    )
+    runner.run(args.input, args.output)
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        raise SystemExit(f"Error: Input file '{path}' not found.")
+    with open(path, "r") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError as e:
+            raise SystemExit(f"Error: Failed to parse JSON in '{path}': {e}")
+
+
+def cmd_pdf(args):
+    from medflow.utils.pdf_generator import generate_soap_pdf
+
+    final_output = _load_json(args.input)
+    soap_note = final_output.get("soap_note", final_output)
+    generate_soap_pdf(soap_note, final_output, filename=args.output,
+                      patient_name=args.patient_name, patient_id=args.patient_id)
+
+
+def cmd_graph(args):
+    from medflow.utils.visualization import save_visualization_html, EXAMPLE_OUTPUT
+
+    if args.input:
+        data = _load_json(args.input)
+    else:
+        print("No input file provided. Using example data...")
+        data = EXAMPLE_OUTPUT
+
+    # Filter data if soap_only is set
+    if args.soap_only:
+        if "soap_note" in data:
+            data = data["soap_note"]
+            print("Filtering data to show only 'soap_note'...")
+        else:
+            print("Warning: 'soap_note' key not found in data. Visualizing full structure.")
+
+    output_path = save_visualization_html(data, args.output)
+    print(f"Success! Graph generated at: {output_path}")
+
+
+def cmd_serve(args):
+    _start_metrics(args)
+    launch_kwargs = {"server_name": args.host, "server_port": args.port, "share": args.share}
+    if args.demo:
+        from medflow.app_simulation import launch
+        launch(**launch_kwargs)
+    else:
+        from medflow.app_pro import launch
+        launch(args.model, args.workers, args.pin_cores, args.model_server,
+               decompose_analysis=args.decompose_analysis, prestructure_intake=args.prestructure_intake,
+               record=args.record, replay=args.replay, prefetch=not args.no_prefetch, **launch_kwargs)
+
+
+def cmd_model_server(args):
+    from medflow.serving.model_host import load_model_pipe
+    from medflow.serving.model_server import ModelServer
+    from medflow.utils.metrics import METRICS
+
+    if args.metrics:
+        METRICS.enable()
+    print(f"Replaying {args.replay}..." if args.replay else f"Loading {args.model}...")
+    pipe = load_model_pipe(args.model, args.workers, args.pin_cores, record=args.record, replay=args.replay)
+    server = ModelServer(pipe, host=args.host, port=args.port, max_batch_size=args.max_batch_size,
+                         max_wait_ms=args.max_wait_ms, dispatchers=args.workers, verbose=args.verbose)
+    server.serve_forever()
+
+
+def cmd_workflow(args):
+    import asyncio
+    from medflow.workflow import MedFlowWorkflow
+
+    if args.action != "status" and not args.input:
+        raise SystemExit(f"Error: {args.action} needs --input.")
+    pipe = None
+    if args.action != "status":
+        from medflow.serving.model_host import load_model_pipe
+
+        if args.replay:
+            print(f"Replaying {args.replay}...")
+        else:
+            print(f"Using model server {args.model_server}..." if args.model_server else f"Loading {args.model}...")
+        pipe = load_model_pipe(args.model, server_url=args.model_server, record=args.record, replay=args.replay)
+
+    async def run():
+        async with MedFlowWorkflow(pipe, args.db) as workflow:
+            if args.action == "start":
+                return await workflow.start(args.id, _load_json(args.input), ethnicity=args.ethnicity)
+            if args.action == "resume":
+                return await workflow.resume(args.id, _load_json(args.input))
+            return await workflow.state(args.id)
+
+    try:
+        result = asyncio.run(run())
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved to {args.output}")
+    else:
+        print(json.dumps(result, indent=2))
+    if args.action == "start":
+        print(f"Encounter {args.id} is waiting for the doctor's plan: medflow workflow resume --id {args.id} --input PLAN.json")
+
+
+def _add_worker_arguments(parser):
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Model worker processes sharing one copy of the weights. Default: 1")
+    parser.add_argument("--pin-cores", action="store_true",
+                        help="Bind each model worker to its own set of CPU cores (with one worker, this process "
+                             "with a torch thread per core).")
+
+
+def _add_model_server_argument(parser):
+    parser.add_argument("--model-server", default=None, metavar="URL",
+                        help="Send generation to a `medflow model-server` at URL instead of loading the model here.")
+
+
+def _add_replay_arguments(parser):
+    parser.add_argument("--record", default=None, metavar="PATH",
+                        help="Append every model call (messages, reply, timings) to a replay corpus at PATH.")
+    parser.add_argument("--replay", default=None, metavar="PATH",
+                        help="Serve recorded replies from the corpus at PATH with their latency; no model is loaded.")
+
+
+def _add_metrics_argument(parser):
+    parser.add_argument("--metrics-port", type=int, default=None, metavar="PORT",
+                        help="Record stage timings and token counts and serve them at http://HOST:PORT/metrics.")
+
+
+def _add_agent_arguments(parser):
+    parser.add_argument("--prestructure-intake", action="store_true",
+                        help="Fill vitals, lists and missing fields without the model; Agent 1 only writes the narrative.")
+    parser.add_argument("--decompose-analysis", action="store_true",
+                        help="Run Agent 2 as short concurrent per-section prompts instead of one long reply.")
+
+
+def build_parser():
+    from medflow.main import add_arguments as add_run_arguments
+    from medflow.model import MODEL_ID
+
+    parser = argparse.ArgumentParser(prog="medflow", description="MedFlow AI command line tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Run the two-agent flow on example data and write a PDF.")
+    add_run_arguments(run)
+    run.set_defaults(func=cmd_run)
+
+    batch = subparsers.add_parser("batch", help="Run a JSONL file of cases through Agent 1, Agent 2 and PDF rendering.")
+    batch.add_argument("input", help="Input JSONL, one case per line.")
+    batch.add_argument("--output", default="medflow_results.jsonl",
+                       help="Output JSONL. Ids already in it are skipped, so reruns resume. Default: medflow_results.jsonl")
+    pdf_target = batch.add_mutually_exclusive_group()
+    pdf_target.add_argument("--pdf-dir", default=None, help="Directory for rendered PDFs. No PDFs when omitted.")
+    pdf_target.add_argument("--pdf-archive", default=None,
+                            help="Tar file the PDFs are appended to, rendered in memory instead of one file per case.")
+    batch.add_argument("--model", default=MODEL_ID)
+    batch.add_argument("--batch-size", type=int, default=4, help="Cases per agent forward pass. Default: 4")
+    batch.add_argument("--queue-size", type=int, default=16, help="Capacity of each stage queue. Default: 16")
+    batch.add_argument("--pdf-workers", type=int, default=2, help="PDF rendering processes. Default: 2")
+    batch.add_argument("--log-every", type=int, default=10, help="Print throughput every N cases. Default: 10")
+    _add_worker_arguments(batch)
+    _add_model_server_argument(batch)
+    _add_agent_arguments(batch)
+    _add_metrics_argument(batch)
+    _add_replay_arguments(batch)
+    batch.set_defaults(func=cmd_batch)
+
+    pdf = subparsers.add_parser("pdf", help="Render a SOAP note PDF from a saved Agent 2 output JSON.")
+    pdf.add_argument("input", help="Agent 2 output JSON (with a 'soap_note' key) or a bare SOAP note.")
+    pdf.add_argument("--output", default="medical_soap_note.pdf", help="Default: medical_soap_note.pdf")
+    pdf.add_argument("--patient-name", default="N/A")
+    pdf.add_argument("--patient-id", default="N/A")
+    pdf.set_defaults(func=cmd_pdf)
+
+    graph = subparsers.add_parser("graph", help="Generate clinical data visualization using JSON Crack.")
+    graph.add_argument("--input", type=str, help="Path to JSON input file. If not provided, example data will be used.")
+    graph.add_argument("--output", type=str, default="output_graph.html",
+                       help="Path to save the output HTML file. Default: output_graph.html")
+    graph.add_argument("--soap-only", action="store_true", help="Only visualize the SOAP note part of the data.")
+    graph.set_defaults(func=cmd_graph)
+
+    serve = subparsers.add_parser("serve", help="Launch the Gradio app.")
+    serve.add_argument("--demo", action="store_true", help="Serve the simulation app, which loads no model.")
+    serve.add_argument("--model", default=MODEL_ID)
+    serve.add_argument("--host", default=None, help="Interface to listen on. Default: Gradio's default.")
+    serve.add_argument("--port", type=int, default=None, help="Port to listen on. Default: Gradio's default.")
+    serve.add_argument("--share", action="store_true", help="Create a public Gradio share link.")
+    serve.add_argument("--no-prefetch", action="store_true",
+                       help="Do not run Agent 1 speculatively while the Step 1 form is being filled in.")
+    _add_worker_arguments(serve)
+    _add_model_server_argument(serve)
+    _add_agent_arguments(serve)
+    _add_metrics_argument(serve)
+    _add_replay_arguments(serve)
+    serve.set_defaults(func=cmd_serve)
+
+    model_server = subparsers.add_parser("model-server", help="Serve the model over HTTP for remote app nodes.")
+    model_server.add_argument("--model", default=MODEL_ID)
+    model_server.add_argument("--host", default="127.0.0.1", help="Interface to listen on. Default: 127.0.0.1")
+    model_server.add_argument("--port", type=int, default=8600, help="Default: 8600")
+    model_server.add_argument("--max-batch-size", type=int, default=8,
+                              help="Concurrent requests merged into one forward pass. Default: 8")
+    model_server.add_argument("--max-wait-ms", type=float, default=20,
+                              help="How long a request waits for others to batch with. Default: 20")
+    model_server.add_argument("--verbose", action="store_true", help="Log every request.")
+    model_server.add_argument("--metrics", action="store_true",
+                              help="Record stage timings and token counts, served at /metrics.")
+    _add_worker_arguments(model_server)
+    _add_replay_arguments(model_server)
+    model_server.set_defaults(func=cmd_model_server)
+
+    workflow = subparsers.add_parser(
+        "workflow", help="Durable two-agent flow that pauses for the doctor's plan between processes.")
+    workflow.add_argument("action", choices=["start", "resume", "status"],
+                          help="start: run Agent 1 and pause; resume: submit the plan and run Agent 2; "
+                               "status: print the saved state.")
+    workflow.add_argument("--id", required=True, help="Encounter id.")
+    workflow.add_argument("--input", default=None,
+                          help="Patient info JSON for start, doctor's plan JSON for resume.")
+    workflow.add_argument("--ethnicity", default="Not provided")
+    workflow.add_argument("--output", default=None, help="Write the result JSON here instead of printing it.")
+    workflow.add_argument("--db", default=os.path.join(".cache", "workflow.sqlite"),
+                          help="SQLite checkpoint database. Default: .cache/workflow.sqlite")
+    workflow.add_argument("--model", default=MODEL_ID)
+    _add_model_server_argument(workflow)
+    _add_replay_arguments(workflow)
+    workflow.set_defaults(func=cmd_workflow)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
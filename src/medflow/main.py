@@ -1,41 +1,36 @@
 import os
-import json
-import torch
-from transformers import pipeline
+import argparse
 from medflow.agents.agent1 import SoapNoteGenerator
 from medflow.agents.agent2 import PlanAnalyzer
-from medflow.utils.pdf_generator import generate_soap_pdf
-from huggingface_hub import login
-from PIL import Image
-import requests
+from medflow.utils.response_cache import ResponseCache
+from medflow.model import MODEL_ID, load_pipeline
 
-def main():
+# torch, transformers, PIL and requests are imported where they are used, so that
+# importing this module (e.g. to build the CLI) stays fast
+
+def add_arguments(parser):
+    parser.add_argument("--model", default=MODEL_ID)
+    parser.add_argument("--cache-dir", default=os.path.join(".cache", "responses"),
+                        help="Directory of the on-disk response cache. Default: .cache/responses")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the response cache and sample fresh outputs.")
+
+def run(args):
     print("Initializing MedFlow AI...")
-    
-    # 1. Setup Environment
-    # Ensure HF_TOKEN is in environment or user is already logged in
-    hf_token = os.getenv("HF_TOKEN")
-    if hf_token:
-        login(token=hf_token)
-    else:
-        print("Warning: HF_TOKEN not found in environment variables. Assuming already logged in.")
 
-    # 2. Initialize Model
+    # 1-2. Log in (HF_TOKEN) and load the model, reusing the KV states of the
+    # constant system prompts across calls
     print("Loading MedGemma model (this may take a while)...")
     try:
-        pipe = pipeline(
-            "image-text-to-text",
-            model="google/medgemma-4b-it",
-            torch_dtype=torch.bfloat16,
-            device="cuda" if torch.cuda.is_available() else "cpu",
-        )
+        pipe = load_pipeline(args.model)
     except Exception as e:
         print(f"Failed to load model: {e}")
         return
 
     # 3. Instantiate Agents
-    agent1 = SoapNoteGenerator(pipe)
-    agent2 = PlanAnalyzer(pipe)
+    cache = None if args.no_cache else ResponseCache(cache_dir=args.cache_dir)
+    agent1 = SoapNoteGenerator(pipe, cache=cache)
+    agent2 = PlanAnalyzer(pipe, cache=cache)
 
     # 4. Mock Input Data (Example)
     print("Running with example data...")
@@ -62,6 +57,8 @@ def main():
     # Example Image (Optional)
     image_url = "https://upload.wikimedia.org/wikipedia/commons/c/c8/Chest_Xray_PA_3-8-2010.png"
     try:
+        import requests
+        from PIL import Image
         image = Image.open(requests.get(image_url, headers={"User-Agent": "medflow"}, stream=True).raw)
         images = [image]
     except Exception as e:
@@ -95,9 +92,17 @@ def main():
         final_soap_note = soap_note_partial
         final_soap_note['plan'] = str(doctor_plan)
 
+    from medflow.utils.pdf_generator import generate_soap_pdf
     pdf_filename = "medical_soap_note.pdf"
     generate_soap_pdf(final_soap_note, final_output, filename=pdf_filename)
     print(f"Done! PDF saved to {pdf_filename}")
+    if cache is not None:
+        print(f"Response cache: {cache.stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the MedFlow AI two-agent flow on example data.")
+    add_arguments(parser)
+    run(parser.parse_args())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,35 @@
+import os
+
+MODEL_ID = "google/medgemma-4b-it"
+
+
+def load_pipeline(model_id: str = MODEL_ID, low_cpu_mem_usage: bool = True):
+    """
+    Logs in to Hugging Face when HF_TOKEN is set and loads the image-text-to-text
+    pipeline, wrapped so the agents' constant system prompts are prefilled only once.
+
+    Weights are read from memory-mapped safetensors and, with `low_cpu_mem_usage`,
+    materialized once instead of via a randomly initialized copy, which keeps the peak
+    footprint near the model size (see medflow.serving.model_host).
+    """
+    import torch
+    from transformers import pipeline
+    from huggingface_hub import login
+    from medflow.utils.prefix_cache import PrefixCachedPipeline
+    from medflow.utils.metrics import METRICS
+
+    hf_token = os.getenv("HF_TOKEN")
+    if hf_token:
+        login(token=hf_token)
+    else:
+        print("Warning: HF_TOKEN not found in environment variables. Assuming already logged in.")
+
+    with METRICS.stage("model_load"):
+        pipe = pipeline(
+            "image-text-to-text",
+            model=model_id,
+            torch_dtype=torch.bfloat16,
+            device="cuda" if torch.cuda.is_available() else "cpu",
+            model_kwargs={"low_cpu_mem_usage": low_cpu_mem_usage, "use_safetensors": True},
+        )
+    return PrefixCachedPipeline(pipe)
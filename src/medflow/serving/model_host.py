@@ -0,0 +1,360 @@
+"""
+Load-once, fork-after-load model workers.
+
+The host loads the pipeline once (memory-mapped safetensors, low_cpu_mem_usage) and
+only then forks its worker processes, so every worker shares the parent's weight pages
+copy-on-write instead of holding its own copy. With `pin_cores=True` each worker is
+bound to its own slice of the machine's cores and sizes its torch thread pool to it,
+which on CPU-only nodes serves small batches better than one process spread over
+every core.
+
+The host is itself a drop-in pipe; each call is routed to the least-loaded worker:
+
+    host = ModelHost(workers=4, pin_cores=True).start()
+    SoapNoteGenerator(host)
+
+Start the host before any other threads (Gradio, the scheduler), since forking a
+process with running threads is unsafe.
+"""
+import os
+import time
+import queue
+import pickle
+import itertools
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import Future
+
+from medflow.model import MODEL_ID, load_pipeline
+from medflow.utils.generation import portable_generation_kwargs, restore_generation_kwargs, stream_pipe
+
+
+def memory_usage(pid: int) -> dict:
+    """
+    Resident (RSS) and proportional (PSS) set size of a process, in bytes.
+    PSS splits each shared page between the processes mapping it, so the PSS of all
+    workers adds up to their real footprint. Values are None where /proc is unavailable.
+    """
+    usage = {"rss": None, "pss": None}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    usage[name.lower()] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return usage
+
+
+def core_sets(workers: int) -> list:
+    """
+    Splits the cores this process may run on into `workers` disjoint, contiguous sets.
+    With fewer cores than workers, workers share cores round-robin.
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    if len(cores) < workers:
+        return [{cores[i % len(cores)]} for i in range(workers)]
+    size, extra = divmod(len(cores), workers)
+    sets, start = [], 0
+    for i in range(workers):
+        end = start + size + (i < extra)
+        sets.append(set(cores[start:end]))
+        start = end
+    return sets
+
+
+def _picklable_error(e):
+    try:
+        pickle.dumps(e)
+        return e
+    except Exception:
+        return RuntimeError(f"{type(e).__name__}: {e}")
+
+
+def _pin(cores, threads):
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    threads = threads or (len(cores) if cores else None)
+    if threads:
+        # Forked workers already have torch loaded; spawned ones set it before loading
+        try:
+            import torch
+        except ImportError:
+            return
+        torch.set_num_threads(threads)
+
+
+def _serve(conn, pipe, loader, cores, threads):
+    # Worker process main loop; `pipe` is inherited when forked, otherwise loaded here
+    _pin(cores, threads)
+    if pipe is None:
+        pipe = loader()
+    conn.send((None, "ready", os.getpid()))
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        request_id, kind, text, max_new_tokens, kwargs = request
+        try:
+            kwargs = restore_generation_kwargs(pipe, kwargs)
+            if kind == "stream":
+                for chunk in stream_pipe(pipe, text, max_new_tokens, **kwargs):
+                    conn.send((request_id, "chunk", chunk))
+                conn.send((request_id, "end", None))
+            else:
+                conn.send((request_id, "result", pipe(text=text, max_new_tokens=max_new_tokens, **kwargs)))
+        except Exception as e:
+            conn.send((request_id, "error", _picklable_error(e)))
+
+
+def _ignore_chunks(done):
+    def waiter(kind, value):
+        if kind != "chunk":
+            done(kind, value)
+    return waiter
+
+
+class _Worker:
+    """Parent-side handle: the connection, requests in flight and their total cost."""
+
+    def __init__(self, index, process, conn, cores):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.pid = process.pid
+        self.cores = cores
+        self.alive = True
+        self.load = 0
+        self.served = 0
+        self.pending = {}
+        self.send_lock = threading.Lock()
+        self.reader = None
+
+
+class ModelHost:
+    """
+    Pool of model worker processes sharing one loaded copy of the weights.
+
+    Args:
+        loader: Zero-argument callable returning a pipe. Defaults to model.load_pipeline.
+        workers: Number of worker processes.
+        start_method: "fork" loads once in this process and forks the workers after;
+            "spawn" makes every worker load its own copy (the baseline to compare against).
+        pin_cores: Bind each worker to a disjoint set of cores (see core_sets).
+        threads_per_worker: Torch threads per worker. Defaults to the worker's core
+            count when pinned, otherwise torch's default.
+    """
+
+    # Agents hand over JSON settings by value; each worker builds them for its tokenizer
+    portable_generation = True
+
+    def __init__(self, loader=None, workers: int = 2, start_method: str = "fork", pin_cores: bool = False,
+                 threads_per_worker: int = None):
+        self.loader = loader or load_pipeline
+        self.num_workers = workers
+        self.start_method = start_method
+        self.pin_cores = pin_cores
+        self.threads_per_worker = threads_per_worker
+        self.pipe = None
+        self.load_seconds = None
+        self.ready_seconds = None
+        self._workers = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def __getattr__(self, name):
+        # Tokenizer, model, etc. come from the pipe loaded in this process
+        if name == "pipe" or name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.pipe, name)
+
+    def start(self):
+        """Loads the model (fork mode), starts the workers and waits until all are ready."""
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == "fork":
+            t0 = time.perf_counter()
+            self.pipe = self.loader()
+            self.load_seconds = time.perf_counter() - t0
+
+        cores = core_sets(self.num_workers) if self.pin_cores else [None] * self.num_workers
+        t0 = time.perf_counter()
+        for index in range(self.num_workers):
+            parent_conn, child_conn = context.Pipe()
+            loader = None if self.start_method == "fork" else self.loader
+            process = context.Process(
+                target=_serve, args=(child_conn, self.pipe, loader, cores[index], self.threads_per_worker),
+                name=f"medflow-model-{index}", daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._workers.append(_Worker(index, process, parent_conn, cores[index]))
+        for worker in self._workers:
+            try:
+                worker.conn.recv()
+            except EOFError:
+                self.shutdown()
+                raise RuntimeError(f"Model worker {worker.pid} failed to start")
+            worker.reader = threading.Thread(target=self._read, args=(worker,), daemon=True)
+            worker.reader.start()
+        self.ready_seconds = time.perf_counter() - t0
+        if self.load_seconds is not None:
+            self.ready_seconds += self.load_seconds
+        print(f"Model host ready: {self.num_workers} {self.start_method}ed workers in {self.ready_seconds:.1f}s")
+        return self
+
+    def _read(self, worker):
+        # Hands each worker message to the caller waiting on its request id
+        while True:
+            try:
+                request_id, kind, value = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                waiter = worker.pending.get(request_id)
+                if kind != "chunk":
+                    worker.pending.pop(request_id, None)
+            if waiter is not None:
+                waiter(kind, value)
+        with self._lock:
+            worker.alive = False
+            orphans = list(worker.pending.values())
+            worker.pending.clear()
+        for waiter in orphans:
+            waiter("error", RuntimeError(f"Model worker {worker.pid} exited"))
+
+    def _route(self, cost: int):
+        """Picks the live worker with the least work in flight and charges it `cost`."""
+        with self._lock:
+            alive = [w for w in self._workers if w.alive]
+            if not alive:
+                raise RuntimeError("No model workers are running")
+            worker = min(alive, key=lambda w: (w.load, w.served))
+            worker.load += cost
+            return worker
+
+    def _submit(self, kind, text, max_new_tokens, kwargs, waiter):
+        cost = len(text) if text and isinstance(text[0], list) else 1
+        request_id = next(self._ids)
+        request = (request_id, kind, text, max_new_tokens, portable_generation_kwargs(kwargs))
+        worker = self._route(cost)
+
+        def done(kind, value):
+            if kind != "chunk":
+                with self._lock:
+                    worker.load -= cost
+                    worker.served += cost
+            waiter(kind, value)
+
+        with self._lock:
+            worker.pending[request_id] = done
+        try:
+            with worker.send_lock:
+                worker.conn.send(request)
+        except OSError:
+            with self._lock:
+                worker.pending.pop(request_id, None)
+            done("error", RuntimeError(f"Model worker {worker.pid} exited"))
+        return worker, request_id
+
+    def __call__(self, text, max_new_tokens: int = 256, **kwargs):
+        future = Future()
+
+        def waiter(kind, value):
+            if kind == "error":
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+
+        self._submit("call", text, max_new_tokens, kwargs, waiter)
+        return future.result()
+
+    def stream(self, text, max_new_tokens: int = 256, **kwargs):
+        """Yields text chunks of the reply as the worker generates them."""
+        chunks = queue.Queue()
+        worker, request_id = self._submit("stream", text, max_new_tokens, kwargs,
+                                          lambda kind, value: chunks.put((kind, value)))
+        finished = False
+        try:
+            while True:
+                kind, value = chunks.get()
+                if kind == "chunk":
+                    yield value
+                    continue
+                finished = True
+                if kind == "error":
+                    raise value
+                return
+        finally:
+            if not finished:
+                # Abandoned early: the rest of the reply is dropped when it arrives
+                with self._lock:
+                    if request_id in worker.pending:
+                        worker.pending[request_id] = _ignore_chunks(worker.pending[request_id])
+
+    def memory_report(self) -> dict:
+        """RSS and PSS of this process and of each worker."""
+        return {
+            "host": dict(pid=os.getpid(), **memory_usage(os.getpid())),
+            "workers": [dict(pid=w.pid, **memory_usage(w.pid)) for w in self._workers],
+        }
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.num_workers,
+            "alive": sum(w.alive for w in self._workers),
+            "start_method": self.start_method,
+            "load_seconds": self.load_seconds,
+            "ready_seconds": self.ready_seconds,
+            "per_worker": [
+                {"pid": w.pid, "cores": sorted(w.cores) if w.cores else None, "in_flight": w.load, "served": w.served}
+                for w in self._workers
+            ],
+        }
+
+    def shutdown(self):
+        for worker in self._workers:
+            if worker.alive:
+                try:
+                    with worker.send_lock:
+                        worker.conn.send(None)
+                except OSError:
+                    pass
+        for worker in self._workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+            worker.alive = False
+
+
+def load_model_pipe(model_id: str = MODEL_ID, workers: int = 1, pin_cores: bool = False, server_url: str = None,
+                    record: str = None, replay: str = None):
+    """
+    The pipeline itself for one worker, otherwise a started ModelHost of `workers` processes.
+    `pin_cores` applies to this process when it is the only worker.
+    With `server_url`, a RemotePipe to that model server; nothing is loaded locally.
+    With `replay`, a ReplayPipe over that recorded corpus instead of any model, and with
+    `record`, every call is also appended to that corpus (see medflow.serving.replay).
+    """
+    if replay:
+        from medflow.serving.replay import ReplayPipe
+        pipe = ReplayPipe(replay)
+    elif server_url:
+        from medflow.serving.remote import RemotePipe
+        pipe = RemotePipe(server_url)
+    elif workers <= 1:
+        if pin_cores:
+            # The lone worker is this process: bound to all of its cores, with a torch thread per core
+            _pin(core_sets(1)[0], None)
+        pipe = load_pipeline(model_id)
+    else:
+        pipe = ModelHost(functools.partial(load_pipeline, model_id), workers=workers, pin_cores=pin_cores).start()
+    if record:
+        from medflow.serving.replay import RecordingPipe
+        pipe = RecordingPipe(pipe, record)
+    return pipe
@@ -0,0 +1,170 @@
+"""
+HTTP model server: exposes any pipe (a loaded model, a ModelHost, a fake) over the
+protocol in medflow.serving.protocol, so app nodes can stay thin and use RemotePipe.
+
+    server = ModelServer(pipe, port=8600).start()
+    pipe = RemotePipe(server.url)
+
+Concurrent requests from all clients go through a MicroBatchScheduler, so they share
+forward passes. GET /metrics returns medflow.utils.metrics.METRICS in the Prometheus
+text format (empty unless metrics are enabled). A full scheduler queue answers 503,
+which RemotePipe retries after a backoff.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from medflow.serving.protocol import (
+    GENERATE_PATH, STREAM_PATH, HEALTH_PATH, decode_messages, is_batch
+)
+from medflow.serving.scheduler import MicroBatchScheduler, QueueFullError
+from medflow.utils.generation import extract_generated_text, model_id, restore_generation_kwargs, stream_pipe
+from medflow.utils.metrics import METRICS, METRICS_PATH
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients can reuse their pooled connections
+    protocol_version = "HTTP/1.1"
+    server_version = "MedFlowModelServer/1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_request(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length))
+        text = body["text"]
+        text = [decode_messages(m) for m in text] if is_batch(text) else decode_messages(text)
+        kwargs = restore_generation_kwargs(self.server.pipe, body.get("kwargs") or {})
+        return text, int(body.get("max_new_tokens", 256)), kwargs
+
+    def do_GET(self):
+        if self.path == METRICS_PATH:
+            data = METRICS.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if self.path != HEALTH_PATH:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self._send_json(200, {"status": "ok", "model": self.server.model})
+
+    def do_POST(self):
+        if self.path not in (GENERATE_PATH, STREAM_PATH):
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            text, max_new_tokens, kwargs = self._read_request()
+        # OSError: an image that PIL cannot decode
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self._send_json(400, {"error": f"Bad request: {e}"})
+            return
+        if self.path == STREAM_PATH:
+            self._stream(text, max_new_tokens, kwargs)
+            return
+        try:
+            outputs = self.server.pipe(text=text, max_new_tokens=max_new_tokens, **kwargs)
+            # A single conversation, or a one-item batch, may come back unwrapped
+            if not is_batch(text) or (outputs and isinstance(outputs[0], dict)):
+                outputs = [outputs]
+            replies = [extract_generated_text(output) for output in outputs]
+        except QueueFullError as e:
+            # Overloaded: clients back off and retry
+            self._send_json(503, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send_json(200, {"replies": replies})
+
+    def _write_line(self, body):
+        line = (json.dumps(body) + "\n").encode("utf-8")
+        # One chunk of the chunked transfer encoding per NDJSON line
+        self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, messages, max_new_tokens, kwargs):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in stream_pipe(self.server.pipe, messages, max_new_tokens, **kwargs):
+                self._write_line({"chunk": chunk})
+            self._write_line({"done": True})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; nothing left to send
+            self.close_connection = True
+            return
+        except Exception as e:
+            self._write_line({"error": f"{type(e).__name__}: {e}"})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class ModelServer:
+    """
+    Threaded HTTP server in front of a pipe.
+
+    Args:
+        pipe: The pipeline to serve.
+        host, port: Address to listen on; port 0 picks a free port (see `url`).
+        max_batch_size, max_wait_ms: Micro-batching of concurrent requests; a
+            max_batch_size of 1 calls the pipe directly.
+        dispatchers: Batches in flight at once (one per model worker).
+        verbose: Log every request.
+    """
+
+    def __init__(self, pipe, host: str = "127.0.0.1", port: int = 8600, max_batch_size: int = 8,
+                 max_wait_ms: float = 20, dispatchers: int = 1, verbose: bool = False):
+        self.model = model_id(pipe)
+        if max_batch_size > 1:
+            pipe = MicroBatchScheduler(pipe, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                       dispatchers=dispatchers)
+        self.pipe = pipe
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.pipe = pipe
+        self.httpd.model = self.model
+        self.httpd.verbose = verbose
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serves in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="medflow-model-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        print(f"Serving {self.model} at {self.url}")
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
+        if isinstance(self.pipe, MicroBatchScheduler):
+            self.pipe.shutdown()
@@ -0,0 +1,301 @@
+"""
+Speculative Agent 1 generation while the intake form is still being filled in.
+
+    prefetcher = Prefetcher(SoapNoteGenerator(SpeculativePipe(pipe)))
+    prefetcher.update(session, patient_info, images)      # on every form change
+    note = prefetcher.take(session, patient_info, images)  # on click; None unless the inputs match
+
+A session's generation starts once its inputs have been unchanged for `debounce_s`,
+and any later edit cancels it. Through a MicroBatchScheduler, speculative calls are
+background requests: they only start while no clicked request is queued or running,
+and a click arriving meanwhile preempts them (see MicroBatchScheduler). Once its own
+click waits on a speculation, the speculation is promoted to a normal request, so
+clicks from other sessions can no longer hold it back. The prefetcher counts hits and misses, and the model time and tokens spent on
+speculations that were never used.
+"""
+import time
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from medflow.serving.protocol import is_batch
+from medflow.serving.scheduler import MicroBatchScheduler
+from medflow.utils.generation import extract_generated_text, runs_in_process, with_event_stopping
+from medflow.utils.metrics import METRICS
+from medflow.utils.prompt_builder import estimate_tokens
+from medflow.utils.response_cache import image_hash, make_cache_key
+
+
+class Cancelled(Exception):
+    """Raised from a speculative generation once it has been cancelled."""
+
+
+class SpeculativePipe:
+    """
+    Wraps the agents' pipe for speculative calls.
+
+    Calls made inside `running(event)`, from the same thread, are submitted as
+    background requests when the pipe is a MicroBatchScheduler, until `promote(event)`
+    makes them normal requests. Once `event` is set, they raise Cancelled. When the model runs in this process, generation also stops
+    at the next token; other pipes (model workers, remote servers) finish the call
+    first. Model time and output tokens are added to the dict that `running` yields.
+    Outside `running`, calls pass straight through.
+    """
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._runs = {}
+
+    def __getattr__(self, name):
+        if name in ("pipe", "_local", "_lock", "_runs"):
+            raise AttributeError(name)
+        return getattr(self.pipe, name)
+
+    @contextlib.contextmanager
+    def running(self, event):
+        run = _Run(event)
+        self._local.run = run
+        with self._lock:
+            self._runs[event] = run
+        try:
+            yield run.usage
+        finally:
+            self._local.run = None
+            with self._lock:
+                del self._runs[event]
+
+    def promote(self, event):
+        """Someone is waiting on the run for `event`: its scheduler requests, queued or later, become normal ones."""
+        with self._lock:
+            run = self._runs.get(event)
+            if run is None:
+                return
+            run.promoted = True
+            futures = list(run.futures)
+        for future in futures:
+            self.pipe.promote(future)
+
+    def _submit(self, run, text, max_new_tokens, kwargs):
+        """MicroBatchScheduler.__call__, keeping the futures of background requests so they can be promoted."""
+        kwargs.pop("batch_size", None)
+        with self._lock:
+            background = not run.promoted
+            futures = [self.pipe.submit(messages, max_new_tokens, background=background, **kwargs)
+                       for messages in (text if is_batch(text) else [text])]
+            if background:
+                run.futures = futures
+        try:
+            results = [future.result() for future in futures]
+        finally:
+            with self._lock:
+                run.futures = []
+        return results if is_batch(text) else results[0]
+
+    def __call__(self, text, max_new_tokens: int = 256, **kwargs):
+        run = getattr(self._local, "run", None)
+        if run is None:
+            return self.pipe(text=text, max_new_tokens=max_new_tokens, **kwargs)
+        event, usage = run.event, run.usage
+        if event.is_set():
+            raise Cancelled()
+        if runs_in_process(self.pipe):
+            kwargs = with_event_stopping(kwargs, event)
+
+        t0 = time.perf_counter()
+        try:
+            if isinstance(self.pipe, MicroBatchScheduler):
+                outputs = self._submit(run, text, max_new_tokens, kwargs)
+            else:
+                outputs = self.pipe(text=text, max_new_tokens=max_new_tokens, **kwargs)
+        finally:
+            usage["seconds"] += time.perf_counter() - t0
+        rows = outputs if is_batch(text) else [outputs]
+        # A one-item batch may come back unwrapped
+        if is_batch(text) and len(text) == 1 and outputs and isinstance(outputs[0], dict):
+            rows = [outputs]
+        usage["tokens"] += sum(estimate_tokens(self.pipe, extract_generated_text(row)) for row in rows)
+        # A cut-off reply must not be parsed, cached or learned from
+        if event.is_set():
+            raise Cancelled()
+        return outputs
+
+
+class _Run:
+    __slots__ = ("event", "usage", "promoted", "futures")
+
+    def __init__(self, event):
+        self.event = event
+        self.usage = {"seconds": 0.0, "tokens": 0}
+        self.promoted = False
+        self.futures = []
+
+
+class _Speculation:
+    __slots__ = ("key", "patient_info", "images", "event", "timer", "future", "usage", "updated_at", "promoted")
+
+    def __init__(self, key, patient_info, images, now):
+        self.key = key
+        self.patient_info = patient_info
+        self.images = images
+        self.event = threading.Event()
+        self.timer = None
+        self.future = None
+        self.usage = None
+        self.updated_at = now
+        self.promoted = False
+
+
+class Prefetcher:
+    """
+    Runs Agent 1 ahead of the click, one speculation per session.
+
+    Args:
+        generator: SoapNoteGenerator over a SpeculativePipe.
+        debounce_s: How long a session's inputs must stay unchanged before generating.
+        workers: Speculative generations running at once, over all sessions.
+        ttl: Seconds after its last update that an unclaimed speculation is dropped.
+    """
+
+    def __init__(self, generator, debounce_s: float = 1.5, workers: int = 1, ttl: float = 900):
+        if not isinstance(generator.pipe, SpeculativePipe):
+            raise TypeError("The prefetch generator must run on a SpeculativePipe")
+        self.generator = generator
+        self.debounce_s = debounce_s
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="medflow-prefetch")
+        self._sessions = {}
+        self._lock = threading.Lock()
+        # Counters are also updated from finishing generations, outside `_lock`
+        self._stats_lock = threading.Lock()
+        self.launched = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+        self.wasted_tokens = 0
+
+    @staticmethod
+    def key(patient_info: dict, images: list = None) -> str:
+        return make_cache_key(patient_info=patient_info, images=[image_hash(image) for image in images or []])
+
+    def update(self, session: str, patient_info: dict, images: list = None):
+        """Form change: cancels the session's speculation if its inputs changed and restarts the debounce."""
+        key = self.key(patient_info, images)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            spec = self._sessions.get(session)
+            if spec is not None and spec.key == key:
+                spec.updated_at = now
+                return
+            if spec is not None:
+                self._drop(spec)
+            spec = self._sessions[session] = _Speculation(key, patient_info, images, now)
+            spec.timer = threading.Timer(self.debounce_s, self._launch, (session, spec))
+            spec.timer.daemon = True
+            spec.timer.start()
+
+    def cancel(self, session: str):
+        with self._lock:
+            spec = self._sessions.pop(session, None)
+            if spec is not None:
+                self._drop(spec)
+
+    def take(self, session: str, patient_info: dict, images: list = None, timeout: float = None):
+        """
+        Click: returns the note generated speculatively for exactly these inputs, waiting
+        for it if it is running, or None. The session's speculation is used up either way.
+        """
+        key = self.key(patient_info, images)
+        with self._lock:
+            spec = self._sessions.pop(session, None)
+            # Still debouncing, or queued behind other sessions: a normal request is faster
+            if spec is not None and (spec.key != key or spec.future is None or spec.future.cancel()):
+                self._drop(spec)
+                spec = None
+        note = None
+        if spec is not None:
+            # The click is waiting now, so the generation must not yield to other sessions
+            spec.promoted = True
+            self.generator.pipe.promote(spec.event)
+            try:
+                note = spec.future.result(timeout)
+            except Exception:
+                with self._lock:
+                    self._drop(spec)
+        with self._stats_lock:
+            if note is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_seconds += spec.usage["seconds"]
+        METRICS.inc("medflow_prefetch_total", outcome="miss" if note is None else "hit")
+        return note
+
+    def _expire(self, now):
+        for session, spec in list(self._sessions.items()):
+            if now - spec.updated_at > self.ttl:
+                del self._sessions[session]
+                self._drop(spec)
+
+    def _launch(self, session, spec):
+        with self._lock:
+            if self._sessions.get(session) is not spec:
+                return
+            spec.future = self._pool.submit(self._run, spec)
+        with self._stats_lock:
+            self.launched += 1
+
+    def _run(self, spec):
+        if spec.event.is_set():
+            raise Cancelled()
+        with self.generator.pipe.running(spec.event) as usage:
+            spec.usage = usage
+            # Clicked before the run started
+            if spec.promoted:
+                self.generator.pipe.promote(spec.event)
+            return self.generator.generate(spec.patient_info, spec.images)
+
+    def _drop(self, spec):
+        """Cancels a speculation nobody will use; its model time counts as wasted once it stops."""
+        spec.timer.cancel()
+        spec.event.set()
+        if spec.future is None:
+            return
+        if not spec.future.done():
+            with self._stats_lock:
+                self.cancelled += 1
+        spec.future.add_done_callback(lambda _: self._waste(spec))
+
+    def _waste(self, spec):
+        if spec.usage is None:
+            return
+        with self._stats_lock:
+            self.wasted_seconds += spec.usage["seconds"]
+            self.wasted_tokens += spec.usage["tokens"]
+        METRICS.inc("medflow_prefetch_wasted_seconds_total", spec.usage["seconds"])
+        METRICS.inc("medflow_prefetch_wasted_tokens_total", spec.usage["tokens"])
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            clicks = self.hits + self.misses
+            return {
+                "launched": self.launched,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / clicks if clicks else 0.0,
+                "cancelled": self.cancelled,
+                "saved_seconds": self.saved_seconds,
+                "wasted_seconds": self.wasted_seconds,
+                "wasted_tokens": self.wasted_tokens,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            for spec in self._sessions.values():
+                self._drop(spec)
+            self._sessions.clear()
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,71 @@
+"""
+Wire format shared by the model server and RemotePipe.
+
+    POST /generate  {"text": messages | [messages, ...], "max_new_tokens": int, "kwargs": {...}}
+                    -> {"replies": [str, ...]}
+    POST /stream    same body, one conversation -> NDJSON lines {"chunk": str}, then {"done": true}
+                    or {"error": str}
+    GET  /health    -> {"status": "ok", "model": str}
+
+Only the assistant replies travel back; the client rebuilds the pipeline output
+shape around its own copy of the messages. Images inside messages are sent as
+base64: PIL images as PNG, encoded image bytes as they are. Generation settings use
+portable_generation_kwargs.
+"""
+import io
+import base64
+
+GENERATE_PATH = "/generate"
+STREAM_PATH = "/stream"
+HEALTH_PATH = "/health"
+
+
+def _encode_image(image):
+    if isinstance(image, str):
+        return {"type": "image", "url": image}
+    # Already an encoded image file, e.g. an upload
+    if isinstance(image, (bytes, bytearray)):
+        return {"type": "image", "image_base64": base64.b64encode(image).decode("ascii")}
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return {"type": "image", "image_base64": base64.b64encode(buffer.getvalue()).decode("ascii")}
+
+
+def _decode_image(part):
+    if "url" in part:
+        return {"type": "image", "image": part["url"]}
+    from PIL import Image
+    image = Image.open(io.BytesIO(base64.b64decode(part["image_base64"])))
+    image.load()
+    return {"type": "image", "image": image}
+
+
+def encode_messages(messages: list) -> list:
+    """Chat messages with PIL images and image bytes replaced by JSON-safe base64 parts."""
+    encoded = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = [_encode_image(part["image"]) if part.get("type") == "image" else part for part in content]
+        encoded.append(dict(message, content=content))
+    return encoded
+
+
+def decode_messages(messages: list) -> list:
+    """Inverse of `encode_messages`."""
+    decoded = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = [_decode_image(part) if part.get("type") == "image" else part for part in content]
+        decoded.append(dict(message, content=content))
+    return decoded
+
+
+def is_batch(text) -> bool:
+    return bool(text) and isinstance(text[0], list)
+
+
+def chat_output(messages: list, reply: str) -> list:
+    """The chat pipeline output shape for one conversation."""
+    return [{"generated_text": messages + [{"role": "assistant", "content": reply}]}]
@@ -0,0 +1,180 @@
+"""
+Drop-in pipe that sends generation to a model server (see medflow.serving.model_server).
+
+    pipe = RemotePipe("http://model-host:8600")
+    SoapNoteGenerator(pipe)
+
+Requests reuse a small pool of keep-alive connections. Failures to connect or send
+and overload responses (502/503/504) are retried with exponential backoff. Once a
+generation request has been sent, a missing reply (e.g. a read timeout) is not
+retried, as the server may still be generating it; only a pooled connection the
+server had already closed is. A stream is only retried before its first chunk arrives.
+"""
+import json
+import time
+import queue
+import http.client
+from urllib.parse import urlsplit
+
+from medflow.serving.protocol import (
+    GENERATE_PATH, STREAM_PATH, HEALTH_PATH, chat_output, encode_messages, is_batch
+)
+from medflow.utils.generation import portable_generation_kwargs
+
+_RETRY_STATUSES = (502, 503, 504)
+
+
+class RemoteError(RuntimeError):
+    """The model server failed the request, or could not be reached after all retries."""
+
+
+class RemotePipe:
+    """
+    HTTP client for a model server, with the call and stream interface of a pipe.
+
+    Args:
+        url: Base URL of the model server, e.g. "http://localhost:8600".
+        timeout: Socket timeout in seconds for each request.
+        retries: Extra attempts after a failure to connect or send, or an overload response.
+        backoff: Delay before the first retry, doubled for every further one.
+        pool_size: Idle keep-alive connections kept for reuse.
+    """
+
+    # Agents hand over JSON settings by value; the server builds them for its tokenizer
+    portable_generation = True
+
+    def __init__(self, url: str, timeout: float = 120, retries: int = 2, backoff: float = 0.5, pool_size: int = 8):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported model server URL: {url}")
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._scheme = parts.scheme
+        self._netloc = parts.netloc
+        self._base_path = parts.path.rstrip("/")
+        self._pool = queue.LifoQueue(pool_size)
+        self._model_id = None
+        self.connections_opened = 0
+
+    @property
+    def model_id(self) -> str:
+        if self._model_id is None:
+            try:
+                self._model_id = self.health().get("model") or f"remote:{self.url}"
+            except RemoteError:
+                return f"remote:{self.url}"
+        return self._model_id
+
+    def _connect(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        self.connections_opened += 1
+        cls = http.client.HTTPSConnection if self._scheme == "https" else http.client.HTTPConnection
+        return cls(self._netloc, timeout=self.timeout)
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _request(self, method, path, body=None):
+        """Sends one request, retrying on failure; returns the open response and its connection."""
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            conn = self._connect()
+            reused = conn.sock is not None
+            try:
+                conn.request(method, self._base_path + path, body=data, headers=headers)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                error = e
+                continue
+            try:
+                response = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                # A pooled connection the server closed while idle never reached it
+                stale = reused and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError))
+                if method == "POST" and not stale:
+                    raise RemoteError(f"No reply from {self.url} to a sent request, not retried: {e!r}")
+                error = e
+                continue
+            if response.status in _RETRY_STATUSES:
+                response.read()
+                self._release(conn)
+                error = RemoteError(f"Model server returned {response.status}")
+                continue
+            if response.status != 200:
+                message = response.read().decode("utf-8", "replace")
+                self._release(conn)
+                try:
+                    message = json.loads(message)["error"]
+                except (ValueError, KeyError, TypeError):
+                    pass
+                raise RemoteError(f"Model server returned {response.status}: {message}")
+            return response, conn
+        raise RemoteError(f"Model server {self.url} unavailable after {self.retries + 1} attempts: {error}")
+
+    def _post(self, path, text, max_new_tokens, kwargs):
+        encoded = [encode_messages(m) for m in text] if is_batch(text) else encode_messages(text)
+        body = {"text": encoded, "max_new_tokens": max_new_tokens, "kwargs": portable_generation_kwargs(kwargs)}
+        return self._request("POST", path, body)
+
+    def __call__(self, text, max_new_tokens: int = 256, **kwargs):
+        response, conn = self._post(GENERATE_PATH, text, max_new_tokens, kwargs)
+        try:
+            replies = json.loads(response.read())["replies"]
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise RemoteError(f"Reading the reply from {self.url} failed: {e}")
+        self._release(conn)
+        if is_batch(text):
+            return [chat_output(messages, reply) for messages, reply in zip(text, replies)]
+        return chat_output(text, replies[0])
+
+    def stream(self, text, max_new_tokens: int = 256, **kwargs):
+        """Yields text chunks of the reply as the server generates them."""
+        response, conn = self._post(STREAM_PATH, text, max_new_tokens, kwargs)
+        finished = False
+        try:
+            for line in response:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if "chunk" in event:
+                    yield event["chunk"]
+                elif "error" in event:
+                    raise RemoteError(event["error"])
+                elif event.get("done"):
+                    response.read()
+                    finished = True
+                    return
+            raise RemoteError(f"Stream from {self.url} ended early")
+        finally:
+            if finished:
+                self._release(conn)
+            else:
+                # Abandoned or broken mid-stream: the connection cannot be reused
+                conn.close()
+
+    def health(self) -> dict:
+        response, conn = self._request("GET", HEALTH_PATH)
+        health = json.loads(response.read())
+        self._release(conn)
+        return health
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,264 @@
+"""
+Record and replay of model calls, so performance work can run without the model.
+
+    pipe = RecordingPipe(load_pipeline(), "calls.jsonl")   # real calls, appended to the corpus
+    pipe = ReplayPipe("calls.jsonl")                        # the same replies, no model
+
+The corpus is JSONL. System prompts, identical across the calls of an agent, are
+stored once as {"prompt": ref, "content": ...} lines and referenced from the calls.
+Each call line holds the other messages (images as content hashes), the raw reply
+and its timings:
+
+    {"key": "...", "messages": [{"role": "system", "prompt": "..."}, ...], "max_new_tokens": 800,
+     "text": "...", "output_tokens": 312, "wall_time": 9.1, "prefill_s": 0.41, "token_s": 0.028,
+     "batch_size": 1}
+
+ReplayPipe serves the reply recorded for the same messages or, failing that, cycles
+through the replies recorded under the same system prompt, so new inputs replay too.
+It sleeps for the recorded prefill and per-token latency and serves `capacity` calls
+at a time, like model workers; a batch takes as long as its slowest row.
+"""
+import os
+import json
+import time
+import hashlib
+import itertools
+import threading
+
+from medflow.serving.protocol import chat_output, is_batch
+from medflow.utils.generation import extract_generated_text, get_tokenizer, stream_pipe
+from medflow.utils.metrics import GenerationTimer
+from medflow.utils.prompt_builder import estimate_tokens
+from medflow.utils.response_cache import image_hash, make_cache_key
+
+
+def _recorded_content(content):
+    if not isinstance(content, list):
+        return content
+    return [
+        {"type": "image", "hash": image_hash(part.get("image", part.get("url")))} if part.get("type") == "image"
+        else part
+        for part in content
+    ]
+
+
+def _prompt_ref(content) -> str:
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _system_ref(messages: list):
+    for message in messages:
+        if message.get("role") == "system":
+            return _prompt_ref(_recorded_content(message.get("content")))
+    return None
+
+
+def call_key(messages: list) -> str:
+    """Identifies a conversation by its text and image hashes."""
+    return make_cache_key(messages=[dict(m, content=_recorded_content(m.get("content"))) for m in messages])
+
+
+def load_corpus(path: str):
+    """Returns ({prompt ref: content}, [call, ...]) from a corpus file; a torn last line is ignored."""
+    prompts, calls = {}, []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "prompt" in record:
+                prompts[record["prompt"]] = record["content"]
+            elif "key" in record:
+                calls.append(record)
+    return prompts, calls
+
+
+def _rows(text, outputs):
+    if not is_batch(text):
+        return [outputs]
+    # A one-item batch may come back unwrapped
+    if len(text) == 1 and outputs and isinstance(outputs[0], dict):
+        return [outputs]
+    return outputs
+
+
+class RecordingPipe:
+    """
+    Wraps a pipe and appends every call it serves to a replay corpus at `path`.
+
+    Attributes of the wrapped pipe (tokenizer, portable_generation, ...) show through,
+    so agents treat it like the pipe itself. Prefill and per-token times come from a
+    generate() streamer when the model is in this process, otherwise from wall time.
+    """
+
+    def __init__(self, pipe, path: str):
+        self.pipe = pipe
+        self.path = path
+        self._lock = threading.Lock()
+        self._prompts = set()
+        if os.path.exists(path):
+            self._prompts.update(load_corpus(path)[0])
+            with open(path, "rb+") as f:
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        # Start on a fresh line after a torn last record
+                        f.write(b"\n")
+        self.recorded = 0
+
+    def __getattr__(self, name):
+        return getattr(self.pipe, name)
+
+    def __call__(self, text, max_new_tokens: int = 256, **kwargs):
+        timer = None
+        if not getattr(self.pipe, "portable_generation", False) and get_tokenizer(self.pipe) is not None:
+            generate_kwargs = dict(kwargs.get("generate_kwargs") or {})
+            timer = generate_kwargs["streamer"] = GenerationTimer(inner=generate_kwargs.get("streamer"))
+            kwargs["generate_kwargs"] = generate_kwargs
+
+        t0 = time.perf_counter()
+        outputs = self.pipe(text=text, max_new_tokens=max_new_tokens, **kwargs)
+        wall_time = time.perf_counter() - t0
+
+        conversations = text if is_batch(text) else [text]
+        replies = [extract_generated_text(output) for output in _rows(text, outputs)]
+        tokens = [estimate_tokens(self.pipe, reply) for reply in replies]
+        if timer is not None and timer.calls:
+            prefill_s = sum(call[0] for call in timer.calls) / len(timer.calls)
+            token_s = sum(call[1] for call in timer.calls) / max(sum(call[2] for call in timer.calls), 1)
+        else:
+            prefill_s, token_s = None, wall_time / max(max(tokens), 1)
+        for messages, reply, output_tokens in zip(conversations, replies, tokens):
+            self._write(messages, max_new_tokens, reply, output_tokens, wall_time, prefill_s, token_s,
+                        len(conversations))
+        return outputs
+
+    def stream(self, text, max_new_tokens: int = 256, **kwargs):
+        t0 = time.perf_counter()
+        first, chunks = None, []
+        try:
+            for chunk in stream_pipe(self.pipe, text, max_new_tokens, **kwargs):
+                if first is None:
+                    first = time.perf_counter() - t0
+                chunks.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            # Consumers stop reading once the JSON object closes; record what they got
+            self._write_stream(text, max_new_tokens, "".join(chunks), first, time.perf_counter() - t0)
+            raise
+        self._write_stream(text, max_new_tokens, "".join(chunks), first, time.perf_counter() - t0)
+
+    def _write_stream(self, text, max_new_tokens, reply, first, wall_time):
+        output_tokens = estimate_tokens(self.pipe, reply)
+        if first is None:
+            # Nothing was generated; all of the time was prefill
+            first = wall_time
+        token_s = (wall_time - first) / max(output_tokens - 1, 1)
+        self._write(text, max_new_tokens, reply, output_tokens, wall_time, first, token_s, 1)
+
+    def _write(self, messages, max_new_tokens, reply, output_tokens, wall_time, prefill_s, token_s, batch_size):
+        lines, recorded = [], []
+        with self._lock:
+            for message in messages:
+                content = _recorded_content(message.get("content"))
+                if message.get("role") != "system":
+                    recorded.append(dict(message, content=content))
+                    continue
+                ref = _prompt_ref(content)
+                if ref not in self._prompts:
+                    self._prompts.add(ref)
+                    lines.append({"prompt": ref, "content": content})
+                recorded.append({"role": "system", "prompt": ref})
+            lines.append({
+                "key": call_key(messages),
+                "messages": recorded,
+                "max_new_tokens": max_new_tokens,
+                "text": reply,
+                "output_tokens": output_tokens,
+                "wall_time": round(wall_time, 6),
+                "prefill_s": None if prefill_s is None else round(prefill_s, 6),
+                "token_s": round(token_s, 6),
+                "batch_size": batch_size,
+            })
+            with open(self.path, "a") as f:
+                f.write("".join(json.dumps(line) + "\n" for line in lines))
+            self.recorded += 1
+
+
+class ReplayPipe:
+    """
+    Pipe serving recorded replies with their recorded latency.
+
+    Args:
+        path: Corpus written by RecordingPipe.
+        time_scale: Multiplies every delay; 0 replays instantly.
+        capacity: Calls served at once, like model workers; the others wait their turn.
+        strict: Only serve replies recorded for exactly the same messages.
+
+    Replies longer than a call's `max_new_tokens` are cut off proportionally, as the
+    model would have been.
+    """
+
+    model_id = "replay"
+
+    def __init__(self, path: str, time_scale: float = 1.0, capacity: int = 1, strict: bool = False):
+        _, calls = load_corpus(path)
+        if not calls:
+            raise ValueError(f"No recorded calls in {path}")
+        self.time_scale = time_scale
+        self.strict = strict
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._lock = threading.Lock()
+        self._by_key = {}
+        by_prompt = {}
+        for call in calls:
+            self._by_key.setdefault(call["key"], call)
+            ref = next((m["prompt"] for m in call["messages"] if "prompt" in m), None)
+            by_prompt.setdefault(ref, []).append(call)
+        self._by_prompt = {ref: itertools.cycle(pool) for ref, pool in by_prompt.items()}
+        self.exact = 0
+        self.fallbacks = 0
+
+    def lookup(self, messages: list) -> dict:
+        """The recorded call to serve for `messages`; LookupError when there is none."""
+        call = self._by_key.get(call_key(messages))
+        pool = None if call is not None or self.strict else self._by_prompt.get(_system_ref(messages))
+        if call is None and pool is None:
+            raise LookupError("No recorded call matches these messages")
+        with self._lock:
+            if call is not None:
+                self.exact += 1
+                return call
+            self.fallbacks += 1
+            return next(pool)
+
+    def _reply(self, call, max_new_tokens):
+        tokens = call["output_tokens"]
+        if tokens <= max_new_tokens:
+            return call["text"], tokens
+        return call["text"][:len(call["text"]) * max_new_tokens // tokens], max_new_tokens
+
+    def _sleep(self, seconds):
+        if seconds > 0 and self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def __call__(self, text, max_new_tokens: int = 256, **kwargs):
+        conversations = text if is_batch(text) else [text]
+        calls = [self.lookup(messages) for messages in conversations]
+        replies = [self._reply(call, max_new_tokens) for call in calls]
+        with self._slots:
+            self._sleep(max((call["prefill_s"] or 0) + call["token_s"] * tokens
+                            for call, (_, tokens) in zip(calls, replies)))
+        outputs = [chat_output(messages, reply) for messages, (reply, _) in zip(conversations, replies)]
+        return outputs if is_batch(text) else outputs[0]
+
+    def stream(self, text, max_new_tokens: int = 256, **kwargs):
+        call = self.lookup(text)
+        reply, tokens = self._reply(call, max_new_tokens)
+        step = max(len(reply) // max(tokens, 1), 1)
+        with self._slots:
+            self._sleep(call["prefill_s"] or 0)
+            for start in range(0, len(reply), step):
+                self._sleep(call["token_s"])
+                yield reply[start:start + step]
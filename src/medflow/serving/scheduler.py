@@ -0,0 +1,310 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from medflow.utils.generation import run_pipe_batch, runs_in_process, with_event_stopping
+from medflow.utils.metrics import METRICS, SIZE_BUCKETS
+from medflow.utils.token_log import percentile
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a request is rejected because the scheduler queue is at its depth limit."""
+
+
+def _batch_key(max_new_tokens, kwargs):
+    """
+    Requests can share a forward pass when they use the same generation settings.
+    Stopping criteria are per-row and interchangeable; streamed requests never batch.
+    """
+    generate_kwargs = kwargs.get("generate_kwargs") or {}
+    if "streamer" in generate_kwargs:
+        return None
+    settings = []
+    for name, value in sorted(generate_kwargs.items()):
+        if name == "stopping_criteria":
+            continue
+        settings.append((name, getattr(value, "batch_key", None) or repr(value)))
+    other = tuple(sorted((k, repr(v)) for k, v in kwargs.items() if k != "generate_kwargs"))
+    return max_new_tokens, tuple(settings), other
+
+
+class _Request:
+    __slots__ = ("messages", "max_new_tokens", "kwargs", "key", "future", "enqueued_at", "preempt", "promoted")
+
+    def __init__(self, messages, max_new_tokens, kwargs, background=False):
+        self.messages = messages
+        self.max_new_tokens = max_new_tokens
+        self.kwargs = kwargs
+        # Background requests carry their own stopping criteria (e.g. cancellation), so they run alone
+        self.key = None if background else _batch_key(max_new_tokens, kwargs)
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.preempt = threading.Event() if background else None
+        self.promoted = False
+
+
+class MicroBatchScheduler:
+    """
+    In-process scheduler that queues generation requests from all sessions and runs
+    them through the pipeline in micro-batches.
+
+    A batch is dispatched as soon as `max_batch_size` compatible requests are queued,
+    or `max_wait_ms` after its oldest request arrived. At most `max_queue_depth`
+    requests may wait; beyond that `submit` rejects with QueueFullError (or blocks
+    when `block=True`).
+
+    The scheduler is itself a drop-in pipe, so agents can use it unchanged:
+        pipe = MicroBatchScheduler(pipe)
+        SoapNoteGenerator(pipe)
+
+    `dispatchers` batches may be in flight at once, for pipes that run them in
+    parallel (e.g. a ModelHost with several workers).
+
+    Background requests (`background=True`, e.g. speculative generations) wait in a
+    separate queue and run one at a time on their own dispatcher, only while no
+    other request is queued or in flight. They are never batched, and are rejected
+    rather than blocked when the queue is full. A request submitted while a
+    background request runs preempts it: when the model runs in this process its
+    generation stops at the next token and the request goes back to the front of
+    the background queue, to start over once the scheduler is idle again. Other pipes
+    finish the background call alongside the new request. `promote` turns a
+    background request that someone is now waiting on into a normal one.
+    """
+
+    def __init__(self, pipe, max_batch_size: int = 8, max_wait_ms: float = 20, max_queue_depth: int = 64,
+                 history: int = 1000, dispatchers: int = 1):
+        self.pipe = pipe
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_depth = max_queue_depth
+        self._pending = deque()
+        self._background = deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._in_flight = 0
+        self._background_request = None
+        self._stoppable = runs_in_process(pipe)
+
+        self.submitted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.preempted = 0
+        self.queue_waits = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.latencies = deque(maxlen=history)
+
+        self._workers = [
+            threading.Thread(target=self._run, name=f"medflow-scheduler-{i}", daemon=True) for i in range(dispatchers)
+        ]
+        self._workers.append(threading.Thread(target=self._run_background, name="medflow-scheduler-background",
+                                              daemon=True))
+        for worker in self._workers:
+            worker.start()
+
+    def __getattr__(self, name):
+        # Tokenizer, model, etc. come from the wrapped pipe
+        if name == "pipe":
+            raise AttributeError(name)
+        return getattr(self.pipe, name)
+
+    def submit(self, messages: list, max_new_tokens: int, block: bool = False, timeout: float = None,
+               background: bool = False, **kwargs):
+        """Queues one conversation and returns a Future resolving to its pipeline output."""
+        request = _Request(messages, max_new_tokens, kwargs, background)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("Scheduler is shut down")
+            if background:
+                if len(self._background) >= self.max_queue_depth:
+                    self.rejected += 1
+                    raise QueueFullError(f"Background queue is full ({self.max_queue_depth} pending requests)")
+                self._background.append(request)
+                self.submitted += 1
+                self._cond.notify_all()
+                return request.future
+            if len(self._pending) >= self.max_queue_depth:
+                if not block or not self._cond.wait_for(
+                    lambda: len(self._pending) < self.max_queue_depth or not self._running, timeout
+                ):
+                    self.rejected += 1
+                    raise QueueFullError(f"Scheduler queue is full ({self.max_queue_depth} pending requests)")
+            self._pending.append(request)
+            self.submitted += 1
+            METRICS.set("medflow_queue_depth", len(self._pending), queue="scheduler")
+            if self._background_request is not None and not self._background_request.promoted:
+                self._background_request.preempt.set()
+            self._cond.notify_all()
+        return request.future
+
+    def promote(self, future) -> bool:
+        """
+        Turns the background request behind `future` into a normal one: a queued request
+        moves to the front of the normal queue, and a running one is no longer preempted.
+        Returns False when the request has already finished.
+        """
+        with self._cond:
+            request = self._background_request
+            if request is not None and request.future is future:
+                request.promoted = True
+                return True
+            for request in self._background:
+                if request.future is future:
+                    self._background.remove(request)
+                    self._to_front(request)
+                    return True
+        return False
+
+    def _to_front(self, request):
+        """Queues a promoted background request ahead of all others. Must be called with the condition held."""
+        request.preempt = None
+        self._pending.appendleft(request)
+        METRICS.set("medflow_queue_depth", len(self._pending), queue="scheduler")
+        self._cond.notify_all()
+
+    def __call__(self, text, max_new_tokens: int = 256, **kwargs):
+        kwargs.pop("batch_size", None)
+        if text and isinstance(text[0], list):
+            futures = [self.submit(messages, max_new_tokens, **kwargs) for messages in text]
+            return [future.result() for future in futures]
+        return self.submit(text, max_new_tokens, **kwargs).result()
+
+    def _take_batch(self):
+        """Waits for a dispatchable batch. Must be called with the condition held."""
+        while True:
+            while self._running and not self._pending:
+                self._cond.wait()
+            if not self._pending:
+                return []
+
+            head = self._pending[0]
+            if head.key is not None:
+                deadline = head.enqueued_at + self.max_wait
+                while self._running and self._pending and self._pending[0] is head:
+                    compatible = sum(1 for r in self._pending if r.key == head.key)
+                    remaining = deadline - time.perf_counter()
+                    if compatible >= self.max_batch_size or remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            # Another dispatcher took this head while we waited
+            if not self._pending or self._pending[0] is not head:
+                continue
+
+            batch, rest = [], deque()
+            for request in self._pending:
+                if len(batch) < self.max_batch_size and request.key == head.key and (head.key is not None or not batch):
+                    batch.append(request)
+                else:
+                    rest.append(request)
+            self._pending = rest
+            self._in_flight += 1
+            METRICS.set("medflow_queue_depth", len(rest), queue="scheduler")
+            # Room freed for blocked submitters
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if not batch:
+                return
+            try:
+                self._dispatch(batch)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _take_background(self):
+        """Waits for an idle scheduler and takes the next background request. Must be called with the condition held."""
+        while self._background or self._running:
+            if self._background and not self._pending and not self._in_flight:
+                self._background_request = self._background.popleft()
+                return self._background_request
+            self._cond.wait()
+        return None
+
+    def _run_background(self):
+        while True:
+            with self._cond:
+                request = self._take_background()
+            if request is None:
+                return
+            self._dispatch([request])
+
+    def _requeue(self, request):
+        """Puts a preempted background request back at the front of its queue, or of the normal one once promoted."""
+        with self._cond:
+            request.preempt.clear()
+            if request.promoted:
+                self._to_front(request)
+            else:
+                self._background.appendleft(request)
+            self.preempted += 1
+            self._cond.notify_all()
+        METRICS.inc("medflow_preempted_total", queue="scheduler")
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        for request in batch:
+            self.queue_waits.append(started - request.enqueued_at)
+            METRICS.observe("medflow_queue_wait_seconds", started - request.enqueued_at, queue="scheduler")
+        self.batch_sizes.append(len(batch))
+        METRICS.observe("medflow_batch_size", len(batch), buckets=SIZE_BUCKETS, queue="scheduler")
+
+        head = batch[0]
+        kwargs = head.kwargs
+        if head.preempt is not None and self._stoppable:
+            kwargs = with_event_stopping(kwargs, head.preempt)
+        try:
+            results = run_pipe_batch(self.pipe, [r.messages for r in batch], max_new_tokens=head.max_new_tokens, **kwargs)
+        except Exception as e:
+            if head.preempt is not None:
+                with self._cond:
+                    self._background_request = None
+            self.failed += len(batch)
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        if head.preempt is not None:
+            with self._cond:
+                self._background_request = None
+                # The generation may have been cut off, so the reply cannot be used
+                preempted = self._stoppable and head.preempt.is_set()
+                # Requeued under the same lock, so a promotion cannot miss the request
+                if preempted:
+                    self._requeue(head)
+            if preempted:
+                return
+
+        finished = time.perf_counter()
+        for request, (output, _) in zip(batch, results):
+            self.latencies.append(finished - request.enqueued_at)
+            request.future.set_result(output)
+
+    def shutdown(self, wait: bool = True):
+        """Stops accepting requests; queued requests are still served."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self._pending),
+            "background_depth": len(self._background),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "preempted": self.preempted,
+            "batches": len(self.batch_sizes),
+            "mean_batch_size": sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else None,
+            "queue_wait_p50": percentile(self.queue_waits, 0.5),
+            "queue_wait_p95": percentile(self.queue_waits, 0.95),
+            "latency_p50": percentile(self.latencies, 0.5),
+            "latency_p95": percentile(self.latencies, 0.95),
+        }
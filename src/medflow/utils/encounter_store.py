@@ -0,0 +1,140 @@
+import os
+import time
+import pickle
+import secrets
+import threading
+from collections import OrderedDict
+
+
+class EncounterStore:
+    """
+    Server-side store for the state carried from step 1 to step 2 of the app, keyed by
+    an opaque, unguessable id, so that only the id travels through the browser.
+
+    Entries expire `ttl` seconds after they were last read or written. Past
+    `max_bytes` of pickled entries in memory, the least recently used ones move to
+    `spill_dir` if set, and are dropped otherwise. Spilled entries are loaded back on
+    access, and survive a restart of the server until they expire.
+
+    Values are returned as stored, not copied; callers must not mutate them.
+    """
+
+    def __init__(self, ttl: float = 3600, max_bytes: int = 64 * 1024 * 1024, spill_dir: str = None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        # id -> (value, size, last access), least recently used first
+        self._memory = OrderedDict()
+        # id -> (size, last access) of spilled entries, least recently used first
+        self._spilled = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.spills = 0
+        self.expired = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            files = [name for name in os.listdir(spill_dir) if name.endswith(".pkl")]
+            for name in sorted(files, key=lambda name: os.path.getmtime(os.path.join(spill_dir, name))):
+                path = os.path.join(spill_dir, name)
+                self._spilled[name[:-4]] = (os.path.getsize(path), os.path.getmtime(path))
+
+    def _path(self, encounter_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{encounter_id}.pkl")
+
+    def _remove_file(self, encounter_id):
+        try:
+            os.remove(self._path(encounter_id))
+        except OSError:
+            pass
+
+    def _expire(self, now):
+        # Both tiers are ordered by last access, so expired entries are at the front
+        while self._memory:
+            encounter_id, (_, size, accessed) = next(iter(self._memory.items()))
+            if now - accessed < self.ttl:
+                break
+            del self._memory[encounter_id]
+            self._memory_bytes -= size
+            self.expired += 1
+        while self._spilled:
+            encounter_id, (_, accessed) = next(iter(self._spilled.items()))
+            if now - accessed < self.ttl:
+                break
+            del self._spilled[encounter_id]
+            self._remove_file(encounter_id)
+            self.expired += 1
+
+    def _store(self, encounter_id, value, payload, now):
+        self._memory[encounter_id] = (value, len(payload), now)
+        self._memory_bytes += len(payload)
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            spilled_id, (spilled, size, accessed) = self._memory.popitem(last=False)
+            self._memory_bytes -= size
+            if self.spill_dir:
+                path = self._path(spilled_id)
+                with open(path, "wb") as f:
+                    pickle.dump(spilled, f, protocol=pickle.HIGHEST_PROTOCOL)
+                # The expiry clock after a restart is the file's mtime
+                os.utime(path, (accessed, accessed))
+                self._spilled[spilled_id] = (size, accessed)
+                self.spills += 1
+
+    def put(self, value, encounter_id: str = None) -> str:
+        """Stores `value` under `encounter_id`, or a new id; returns the id."""
+        # Serialized once to size the entry; the same bytes are never kept
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            encounter_id = encounter_id or secrets.token_urlsafe(16)
+            self._discard(encounter_id)
+            self._store(encounter_id, value, payload, now)
+        return encounter_id
+
+    def get(self, encounter_id: str):
+        """Returns the value stored under `encounter_id`, or None if unknown or expired."""
+        if not encounter_id:
+            return None
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            if encounter_id in self._memory:
+                value, size, _ = self._memory.pop(encounter_id)
+                self._memory[encounter_id] = (value, size, now)
+                return value
+            if encounter_id not in self._spilled:
+                return None
+            del self._spilled[encounter_id]
+            try:
+                with open(self._path(encounter_id), "rb") as f:
+                    payload = f.read()
+                value = pickle.loads(payload)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return None
+            self._remove_file(encounter_id)
+            self._store(encounter_id, value, payload, now)
+            return value
+
+    def _discard(self, encounter_id):
+        if encounter_id in self._memory:
+            self._memory_bytes -= self._memory.pop(encounter_id)[1]
+        if self._spilled.pop(encounter_id, None) is not None:
+            self._remove_file(encounter_id)
+
+    def delete(self, encounter_id: str):
+        with self._lock:
+            self._discard(encounter_id)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._memory) + len(self._spilled)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "spilled_entries": len(self._spilled),
+                "spills": self.spills,
+                "expired": self.expired,
+            }
@@ -0,0 +1,321 @@
+import json
+import time
+
+from medflow.utils.json_stream import JSONObjectScanner
+
+
+def get_tokenizer(pipe):
+    """
+    Returns the tokenizer behind a pipeline-like object, or None.
+    Text pipelines expose `tokenizer`, image-text-to-text pipelines keep it on the processor.
+    """
+    tokenizer = getattr(pipe, "tokenizer", None)
+    if tokenizer is None:
+        processor = getattr(pipe, "processor", None)
+        tokenizer = getattr(processor, "tokenizer", None)
+    return tokenizer
+
+
+def model_id(pipe) -> str:
+    """Best-effort identifier of the model behind a pipeline-like object."""
+    model = getattr(pipe, "model", None)
+    config = getattr(model, "config", None)
+    name = getattr(config, "_name_or_path", None) or getattr(model, "name_or_path", None)
+    if isinstance(name, str) and name:
+        return name
+    name = getattr(pipe, "model_id", None)
+    return name if isinstance(name, str) and name else type(pipe).__name__
+
+
+def count_tokens(pipe, text: str):
+    """
+    Counts tokens in `text` with the pipeline's tokenizer.
+    Returns None when the pipeline has no usable tokenizer (e.g. mocks or remote pipes).
+    """
+    tokenizer = get_tokenizer(pipe)
+    if tokenizer is None:
+        return None
+    if not text:
+        return 0
+    try:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    except Exception:
+        return None
+
+
+def messages_text(messages: list) -> str:
+    """Flattens the text parts of chat messages (images are skipped)."""
+    parts = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for item in content:
+            if item.get("type") == "text":
+                parts.append(item.get("text", ""))
+    return "\n".join(parts)
+
+
+def extract_generated_text(output) -> str:
+    """
+    Returns the assistant reply from a chat pipeline output.
+    With chat templates the pipeline returns the whole conversation, so the reply is the last message.
+    """
+    generated = output[-1]["generated_text"]
+    if isinstance(generated, list):
+        generated = generated[-1]["content"]
+    if isinstance(generated, list):
+        generated = "".join(part.get("text", "") for part in generated if isinstance(part, dict))
+    return generated
+
+
+def _ensure_left_padding(pipe):
+    # Decoder-only generation needs left padding so every row ends at the prompt boundary
+    tokenizer = get_tokenizer(pipe)
+    if tokenizer is not None and getattr(tokenizer, "padding_side", "left") != "left":
+        tokenizer.padding_side = "left"
+
+
+def run_pipe_batch(pipe, conversations: list, max_new_tokens: int, batch_size: int = None, **kwargs):
+    """
+    Runs several chat conversations through the pipeline, `batch_size` at a time.
+
+    Returns a list of (output, wall_time) tuples in input order, where `output` has the same
+    shape as a single `pipe(text=messages)` call and `wall_time` is the time of the forward
+    pass the item was part of.
+    """
+    if not conversations:
+        return []
+    batch_size = batch_size or len(conversations)
+    _ensure_left_padding(pipe)
+
+    results = []
+    for start in range(0, len(conversations), batch_size):
+        chunk = conversations[start:start + batch_size]
+        t0 = time.perf_counter()
+        outputs = pipe(text=chunk, max_new_tokens=max_new_tokens, batch_size=len(chunk), **kwargs)
+        elapsed = time.perf_counter() - t0
+
+        # A one-item batch may come back unwrapped
+        if len(chunk) == 1 and outputs and isinstance(outputs[0], dict):
+            outputs = [outputs]
+        if len(outputs) != len(chunk):
+            raise ValueError(f"Pipeline returned {len(outputs)} outputs for {len(chunk)} conversations")
+        results.extend((output, elapsed) for output in outputs)
+    return results
+
+
+def batch_item_stats(pipe, messages: list, text: str, wall_time: float, parsed: bool) -> dict:
+    """Per-item statistics reported by the agents' batch methods."""
+    return {
+        "prompt_tokens": count_tokens(pipe, messages_text(messages)),
+        "output_tokens": count_tokens(pipe, text),
+        "wall_time": wall_time,
+        "parsed": parsed,
+        "cached": False,
+    }
+
+
+def json_stopping_criteria(tokenizer):
+    """
+    Builds a transformers StoppingCriteriaList that ends generation for each row as
+    soon as its top-level JSON object closes, instead of running to max_new_tokens.
+    """
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class JSONObjectClosed(StoppingCriteria):
+        def __init__(self):
+            self._scanners = None
+            self._length = None
+
+        def __call__(self, input_ids, scores, **kwargs):
+            rows, length = input_ids.shape
+            # A new generate() call (or a reused instance) starts with a fresh prompt
+            if self._scanners is None or len(self._scanners) != rows or length != self._length + 1:
+                self._scanners = [JSONObjectScanner() for _ in range(rows)]
+                self._length = length - 1
+            new_tokens = input_ids[:, self._length:]
+            self._length = length
+
+            done = []
+            for scanner, tokens in zip(self._scanners, new_tokens):
+                if not scanner.done:
+                    scanner.feed(tokenizer.decode(tokens, skip_special_tokens=True))
+                done.append(scanner.done)
+            return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    criteria = StoppingCriteriaList([JSONObjectClosed()])
+    # Identifies the criteria by value, see portable_generation_kwargs
+    criteria.batch_key = ("json_stop",)
+    return criteria
+
+
+def event_stopping_criteria(event):
+    """Builds a transformers StoppingCriteria that ends generation for every row once `event` is set."""
+    import torch
+    from transformers import StoppingCriteria
+
+    class EventSet(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+    return EventSet()
+
+
+def runs_in_process(pipe) -> bool:
+    """Whether generate_kwargs such as stopping criteria reach a model in this process."""
+    return not getattr(pipe, "portable_generation", False) and get_tokenizer(pipe) is not None
+
+
+def with_event_stopping(kwargs: dict, event) -> dict:
+    """Returns pipe call kwargs whose generation also stops at the next token once `event` is set."""
+    from transformers import StoppingCriteriaList
+
+    generate_kwargs = dict(kwargs.get("generate_kwargs") or {})
+    criteria = list(generate_kwargs.get("stopping_criteria") or [])
+    generate_kwargs["stopping_criteria"] = StoppingCriteriaList(criteria + [event_stopping_criteria(event)])
+    return {**kwargs, "generate_kwargs": generate_kwargs}
+
+
+# Token enforcer data is expensive to build for large vocabularies, so it is kept per tokenizer
+_ENFORCER_TOKENIZER_DATA = {}
+
+
+def require_schema_decoding():
+    """Raises ImportError with an install hint when constrained decoding is unavailable."""
+    try:
+        import lmformatenforcer.integrations.transformers  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "Schema-constrained decoding requires the 'lm-format-enforcer' package "
+            "(pip install lm-format-enforcer)."
+        ) from e
+
+
+def schema_prefix_allowed_tokens_fn(tokenizer, schema: dict):
+    """Builds a `prefix_allowed_tokens_fn` that only lets the model emit JSON matching `schema`."""
+    require_schema_decoding()
+    from lmformatenforcer import JsonSchemaParser
+    from lmformatenforcer.integrations.transformers import (
+        build_token_enforcer_tokenizer_data, build_transformers_prefix_allowed_tokens_fn
+    )
+
+    tokenizer_data = _ENFORCER_TOKENIZER_DATA.get(id(tokenizer))
+    if tokenizer_data is None:
+        tokenizer_data = build_token_enforcer_tokenizer_data(tokenizer)
+        _ENFORCER_TOKENIZER_DATA[id(tokenizer)] = tokenizer_data
+    # The enforcer caches every prefix it sees, so each call gets a fresh one. The tag
+    # lets the scheduler batch calls that share a schema.
+    fn = build_transformers_prefix_allowed_tokens_fn(tokenizer_data, JsonSchemaParser(schema))
+    fn.batch_key = ("json_schema", json.dumps(schema, sort_keys=True))
+    return fn
+
+
+def json_generation_kwargs(pipe, schema: dict = None) -> dict:
+    """
+    Pipeline kwargs for JSON replies: stop as soon as the object closes and, when a
+    `schema` is given, constrain decoding so the reply is valid by construction.
+    Pipes that forward requests to another process or host (`portable_generation`)
+    get the settings by value and rebuild them next to the model. Empty for other
+    pipelines without a local tokenizer (mocks, replay pipes).
+    """
+    if getattr(pipe, "portable_generation", False):
+        kwargs = {"json_stop": True}
+        if schema is not None:
+            kwargs["json_schema"] = schema
+        return kwargs
+    tokenizer = get_tokenizer(pipe)
+    if tokenizer is None:
+        return {}
+    generate_kwargs = {"stopping_criteria": json_stopping_criteria(tokenizer)}
+    if schema is not None:
+        generate_kwargs["prefix_allowed_tokens_fn"] = schema_prefix_allowed_tokens_fn(tokenizer, schema)
+    return {"generate_kwargs": generate_kwargs}
+
+
+def portable_generation_kwargs(kwargs: dict) -> dict:
+    """
+    Replaces the JSON stopping criteria and schema constraint in pipeline kwargs by
+    plain values, so the kwargs can be sent to another process or host. The receiver
+    rebuilds them against its own tokenizer with `restore_generation_kwargs`.
+    """
+    kwargs = dict(kwargs)
+    generate_kwargs = dict(kwargs.pop("generate_kwargs", None) or {})
+    if "streamer" in generate_kwargs:
+        raise ValueError("A streamer cannot be sent to another process; use the pipe's stream() instead")
+
+    criteria = generate_kwargs.pop("stopping_criteria", None)
+    if criteria is not None:
+        if getattr(criteria, "batch_key", None) != ("json_stop",):
+            raise ValueError("Only the JSON stopping criteria can be sent to another process")
+        kwargs["json_stop"] = True
+    fn = generate_kwargs.pop("prefix_allowed_tokens_fn", None)
+    if fn is not None:
+        key = getattr(fn, "batch_key", None)
+        if not key or key[0] != "json_schema":
+            raise ValueError("Only JSON schema constraints can be sent to another process")
+        kwargs["json_schema"] = json.loads(key[1])
+    if generate_kwargs:
+        kwargs["generate_kwargs"] = generate_kwargs
+    return kwargs
+
+
+def restore_generation_kwargs(pipe, kwargs: dict) -> dict:
+    """
+    Inverse of `portable_generation_kwargs`, building the objects for `pipe`'s tokenizer.
+    Pipes that forward requests themselves get the kwargs unchanged, and pipes without a
+    tokenizer (mocks) without the JSON settings.
+    """
+    kwargs = dict(kwargs)
+    if getattr(pipe, "portable_generation", False):
+        return kwargs
+    json_stop = kwargs.pop("json_stop", False)
+    schema = kwargs.pop("json_schema", None)
+    tokenizer = get_tokenizer(pipe)
+    if tokenizer is not None and (json_stop or schema is not None):
+        generate_kwargs = dict(kwargs.pop("generate_kwargs", None) or {})
+        if json_stop:
+            generate_kwargs["stopping_criteria"] = json_stopping_criteria(tokenizer)
+        if schema is not None:
+            generate_kwargs["prefix_allowed_tokens_fn"] = schema_prefix_allowed_tokens_fn(tokenizer, schema)
+        kwargs["generate_kwargs"] = generate_kwargs
+    return kwargs
+
+
+def stream_pipe(pipe, messages: list, max_new_tokens: int, **kwargs):
+    """
+    Yields the assistant reply as text chunks while it is generated.
+
+    Pipelines that implement `stream(text=..., max_new_tokens=...)` are used directly;
+    Hugging Face pipelines run in a background thread feeding a TextIteratorStreamer.
+    """
+    if hasattr(pipe, "stream"):
+        yield from pipe.stream(text=messages, max_new_tokens=max_new_tokens, **kwargs)
+        return
+
+    import threading
+    from transformers import TextIteratorStreamer
+
+    streamer = TextIteratorStreamer(get_tokenizer(pipe), skip_prompt=True, skip_special_tokens=True)
+    generate_kwargs = dict(kwargs.pop("generate_kwargs", None) or {})
+    generate_kwargs["streamer"] = streamer
+    errors = []
+
+    def run():
+        try:
+            pipe(text=messages, max_new_tokens=max_new_tokens, generate_kwargs=generate_kwargs, **kwargs)
+        except Exception as e:
+            errors.append(e)
+            # Unblock the consumer
+            streamer.end()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    for chunk in streamer:
+        if chunk:
+            yield chunk
+    thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,183 @@
+"""
+Deterministic pre-structuring of intake data.
+
+Everything in a SOAP note that follows mechanically from the intake form (parsed
+vitals, symptom and history lists, the fields that were not provided) is filled in
+here, so Agent 1 only has to write the narrative parts:
+
+    intake = prestructure(patient_info)
+    intake["objective"]["vital_signs"]   # {"blood_pressure": "145/90 mmHg", ...}
+    intake["vitals"]                     # {"blood_pressure": {"systolic": 145, ...}, ...}
+    intake["missing_information"]        # ["Respiratory rate", "Temperature", ...]
+"""
+import re
+
+MISSING = "Missing"
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+_BLOOD_PRESSURE = re.compile(r"(\d{2,3})\s*/\s*(\d{2,3})")
+
+# Canonical vital name -> accepted intake keys
+VITAL_ALIASES = {
+    "blood_pressure": ("blood_pressure", "bp"),
+    "heart_rate": ("heart_rate", "hr", "pulse"),
+    "respiratory_rate": ("respiratory_rate", "rr"),
+    "temperature": ("temperature", "temp"),
+    "oxygen_saturation": ("oxygen_saturation", "spo2", "o2_sat"),
+}
+
+VITAL_LABELS = {
+    "blood_pressure": "Blood pressure",
+    "heart_rate": "Heart rate",
+    "respiratory_rate": "Respiratory rate",
+    "temperature": "Temperature",
+    "oxygen_saturation": "Oxygen saturation",
+}
+
+# Intake fields reported under missing_information when absent or empty
+REQUIRED_FIELDS = {
+    "age": "Age",
+    "gender": "Gender",
+    "symptoms": "Symptoms",
+    "duration": "Symptom duration",
+    "severity": "Symptom severity",
+    "medical_history": "Past medical history",
+    "medications": "Medications",
+    "allergies": "Allergies",
+    "social_history": "Social history",
+    "family_history": "Family history",
+}
+
+
+def _is_blank(value) -> bool:
+    return value is None or (isinstance(value, (str, list, tuple, dict)) and not value)
+
+
+def _as_list(value) -> list:
+    if _is_blank(value):
+        return []
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(",") if part.strip()]
+    return [str(v).strip() for v in value if str(v).strip()]
+
+
+def _first_number(value):
+    if isinstance(value, (int, float)):
+        return value
+    match = _NUMBER.search(str(value))
+    if match is None:
+        return None
+    number = float(match.group())
+    return int(number) if number.is_integer() else number
+
+
+def parse_vital(name: str, value):
+    """
+    Parses one vital sign, e.g. ("blood_pressure", "145/90") or ("heart_rate", "92 bpm").
+    Returns a typed dict with a `unit`, or None when the value cannot be read.
+    """
+    if name == "blood_pressure":
+        match = _BLOOD_PRESSURE.search(str(value))
+        if match is None:
+            return None
+        return {"systolic": int(match.group(1)), "diastolic": int(match.group(2)), "unit": "mmHg"}
+
+    number = _first_number(value)
+    if number is None:
+        return None
+    if name == "heart_rate":
+        return {"value": number, "unit": "bpm"}
+    if name == "respiratory_rate":
+        return {"value": number, "unit": "breaths/min"}
+    if name == "oxygen_saturation":
+        return {"value": number, "unit": "%"}
+    if name == "temperature":
+        text = str(value).upper()
+        if "F" in text:
+            unit = "F"
+        elif "C" in text:
+            unit = "C"
+        else:
+            # No unit given: body temperatures above 50 can only be Fahrenheit
+            unit = "F" if number > 50 else "C"
+        return {"value": number, "unit": unit}
+    raise ValueError(f"Unknown vital sign: {name}")
+
+
+def format_vital(name: str, vital: dict) -> str:
+    """The display string of a parsed vital, e.g. "145/90 mmHg" or "98.6 F"."""
+    if name == "blood_pressure":
+        return f"{vital['systolic']}/{vital['diastolic']} {vital['unit']}"
+    if vital["unit"] == "%":
+        return f"{vital['value']}%"
+    return f"{vital['value']} {vital['unit']}"
+
+
+def _join(items: list) -> str:
+    return ", ".join(items) if items else MISSING
+
+
+def prestructure(patient_info: dict) -> dict:
+    """
+    Builds the deterministic part of Agent 1's note from intake data.
+
+    Returns a dict with `subjective` and `objective` in the SOAP_PARTIAL_SCHEMA layout
+    (narrative fields left as "Missing" for the model to write), the typed `vitals`,
+    the computed `missing_information` and the `facts` the narrative prompt is built from.
+    """
+    missing = [label for key, label in REQUIRED_FIELDS.items() if _is_blank(patient_info.get(key))]
+
+    raw_vitals = patient_info.get("vitals") or {}
+    vitals, vital_signs = {}, {}
+    for name, aliases in VITAL_ALIASES.items():
+        value = next((raw_vitals[a] for a in aliases if not _is_blank(raw_vitals.get(a))), None)
+        if value is None:
+            missing.append(VITAL_LABELS[name])
+            vital_signs[name] = MISSING
+            continue
+        vital = parse_vital(name, value)
+        if vital is None:
+            missing.append(f"{VITAL_LABELS[name]} (could not read {value!r})")
+            vital_signs[name] = str(value)
+            continue
+        vitals[name] = vital
+        vital_signs[name] = format_vital(name, vital)
+
+    symptoms = _as_list(patient_info.get("symptoms"))
+    history = _as_list(patient_info.get("medical_history"))
+    medications = _as_list(patient_info.get("medications"))
+    allergies = _as_list(patient_info.get("allergies"))
+
+    subjective = {
+        "chief_complaint": symptoms[0] if symptoms else MISSING,
+        "history_of_present_illness": MISSING,
+        "past_medical_history": _join(history),
+        "medications": medications,
+        "allergies": allergies,
+        "social_history": patient_info.get("social_history") or MISSING,
+        "family_history": patient_info.get("family_history") or MISSING,
+        "review_of_systems": MISSING,
+    }
+    objective = {
+        "vital_signs": vital_signs,
+        "physical_exam": patient_info.get("physical_exam") or MISSING,
+        "imaging": {"chest_xray": MISSING, "other_imaging": MISSING},
+        "laboratory_results": patient_info.get("laboratory_results") or MISSING,
+    }
+    facts = {
+        "age": patient_info.get("age"),
+        "gender": patient_info.get("gender"),
+        "symptoms": _join(symptoms),
+        "duration": patient_info.get("duration") or MISSING,
+        "severity": patient_info.get("severity") or MISSING,
+        "medical_history": subjective["past_medical_history"],
+        "medications": _join(medications),
+        "vital_signs": {name: value for name, value in vital_signs.items() if value != MISSING},
+    }
+    return {
+        "subjective": subjective,
+        "objective": objective,
+        "vitals": vitals,
+        "missing_information": missing,
+        "facts": {k: v for k, v in facts.items() if not _is_blank(v)},
+    }
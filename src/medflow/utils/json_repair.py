@@ -0,0 +1,269 @@
+"""
+Salvaging parser for truncated or malformed model JSON.
+
+`salvage_object` repairs the first top-level object of a reply in one linear pass:
+
+- trailing commas are dropped and missing commas between members inserted,
+- single-quoted strings, raw newlines in strings and Python literals
+  (True, False, None) are rewritten as JSON,
+- structures left open by a cut-off reply are closed.
+
+Every top-level member that was fully produced is kept. A member cut off at the end,
+or one that still does not parse, is dropped and reported in `missing`, together
+with any expected key the reply never reached, so only those fields need to be
+generated again:
+
+    salvaged = salvage_object(text, expected=["medication_review", "test_validation"])
+    salvaged.data      # {"medication_review": {...}}
+    salvaged.missing   # ["test_validation"]
+"""
+import re
+import json
+from collections import namedtuple
+
+Salvaged = namedtuple("Salvaged", ["data", "missing", "repaired"])
+
+LITERALS = {"true": "true", "false": "false", "null": "null",
+            "True": "true", "False": "false", "None": "null", "NaN": "null"}
+
+STRING_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+_SPACE = re.compile(r"\s+")
+# Characters a string scan has to stop at, per opening quote
+_STRING_STOPS = {'"': re.compile(r'["\\\n\r\t]'), "'": re.compile(r'[\'"\\\n\r\t]')}
+_KEY = re.compile(r'\s*"((?:[^"\\]|\\.)*)"\s*:')
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+
+
+def _member_key(member: str):
+    match = _KEY.match(member)
+    if match is None:
+        return None
+    try:
+        return json.loads(f'"{match.group(1)}"')
+    except json.JSONDecodeError:
+        return match.group(1)
+
+
+class _Repairer:
+    """
+    Rewrites the text of one top-level object into JSON, splitting it into members.
+    Each character is emitted at most once and removed at most once, so the pass is
+    linear in the length of the reply.
+    """
+
+    def __init__(self, text: str, start: int):
+        self.text = text
+        self.pos = start + 1
+        self.out = []
+        self.stack = ["{"]
+        # For objects: whether the next string is a key
+        self.expect_key = [True]
+        # Whether a complete value was just emitted in the innermost container
+        self.after_value = False
+        self.members = []
+        self.truncated_member = None
+        self.closed = False
+        self.changed = False
+        # Whether the value just emitted could be cut short (a number or bare word)
+        self.open_ended = False
+
+    def emit(self, s: str):
+        self.out.append(s)
+
+    def value_done(self, open_ended: bool = False):
+        self.after_value = True
+        self.open_ended = open_ended
+        if self.stack[-1] == "{":
+            self.expect_key[-1] = True
+
+    def end_member(self):
+        self.members.append("".join(self.out))
+        self.out = []
+
+    def drop_trailing_comma(self):
+        while self.out and self.out[-1].isspace():
+            self.out.pop()
+        if self.out and self.out[-1] == ",":
+            self.out.pop()
+            self.changed = True
+
+    def separate(self):
+        """Inserts a comma when a value starts right after another one."""
+        if self.after_value:
+            self.changed = True
+            if len(self.stack) == 1:
+                self.end_member()
+            else:
+                self.emit(",")
+            self.after_value = False
+
+    def read_string(self, quote: str):
+        text, i = self.text, self.pos + 1
+        self.changed |= quote != '"'
+        stops = _STRING_STOPS[quote]
+        parts = ['"']
+        while True:
+            match = stops.search(text, i)
+            if match is None:
+                break
+            parts.append(text[i:match.start()])
+            ch, i = match.group(0), match.end()
+            if ch == "\\":
+                if i >= len(text):
+                    break
+                parts.append("'" if text[i] == "'" else ch + text[i])
+                i += 1
+            elif ch == quote:
+                parts.append('"')
+                self.pos = i
+                self.emit("".join(parts))
+                return True
+            elif ch == '"':
+                parts.append('\\"')
+            else:
+                parts.append(STRING_ESCAPES[ch])
+                self.changed = True
+        # Cut off inside the string
+        parts.append(text[i:])
+        self.pos = len(text)
+        self.emit("".join(parts))
+        return False
+
+    def run(self):
+        text = self.text
+        while self.pos < len(text):
+            ch = text[self.pos]
+            if ch.isspace():
+                match = _SPACE.match(text, self.pos)
+                self.emit(match.group(0))
+                self.pos = match.end()
+            elif ch in "\"'":
+                in_object = self.stack[-1] == "{"
+                is_key = in_object and self.expect_key[-1]
+                self.separate()
+                if not self.read_string(ch):
+                    return
+                if is_key:
+                    self.expect_key[-1] = False
+                else:
+                    self.value_done()
+            elif ch == ":":
+                self.emit(ch)
+                self.after_value = False
+                self.pos += 1
+            elif ch == ",":
+                self.pos += 1
+                if not self.after_value:
+                    # Doubled or leading comma
+                    self.changed = True
+                    continue
+                self.after_value = False
+                if len(self.stack) == 1:
+                    self.end_member()
+                else:
+                    self.emit(ch)
+            elif ch in "{[":
+                self.separate()
+                self.stack.append(ch)
+                self.expect_key.append(ch == "{")
+                self.emit(ch)
+                self.pos += 1
+            elif ch in "}]":
+                self.pos += 1
+                if (ch == "}") != (self.stack[-1] == "{"):
+                    # Mismatched bracket: close what is actually open
+                    ch = "}" if self.stack[-1] == "{" else "]"
+                    self.changed = True
+                self.drop_trailing_comma()
+                self.stack.pop()
+                self.expect_key.pop()
+                if not self.stack:
+                    if "".join(self.out).strip():
+                        self.end_member()
+                    self.closed = True
+                    return
+                self.emit(ch)
+                self.value_done()
+            else:
+                match = _NUMBER.match(text, self.pos) or _WORD.match(text, self.pos)
+                if match is None:
+                    # Stray character such as a comment slash; skipped
+                    self.changed = True
+                    self.pos += 1
+                    continue
+                word = match.group(0)
+                self.separate()
+                self.pos = match.end()
+                if self.stack[-1] == "{" and self.expect_key[-1] and _WORD.fullmatch(word):
+                    # Unquoted key
+                    self.changed = True
+                    self.emit(json.dumps(word))
+                    self.expect_key[-1] = False
+                elif word in LITERALS:
+                    self.changed |= LITERALS[word] != word
+                    self.emit(LITERALS[word])
+                    self.value_done()
+                else:
+                    # Numbers pass through; unknown bare words make the member invalid.
+                    # Either may have been cut short at the end of the reply.
+                    self.emit(word)
+                    self.value_done(open_ended=True)
+
+    def finish(self):
+        """Members of a cut-off object: the last one is kept only if it is certainly complete."""
+        tail = "".join(self.out)
+        if tail.strip():
+            complete = len(self.stack) == 1 and self.after_value and not self.open_ended
+            if complete:
+                self.members.append(tail)
+            else:
+                self.truncated_member = tail
+        return self.members
+
+
+def salvage_object(text: str, expected=None) -> Salvaged:
+    """
+    Parses the first top-level JSON object of `text`, repairing it where needed.
+
+    Args:
+        text: Model reply, possibly fenced, cut off or slightly malformed.
+        expected: Keys the object should have; those not recovered are added to `missing`.
+
+    Returns Salvaged(data, missing, repaired): the recovered members, the keys to
+    regenerate (in `expected` order, then in reply order), and whether any repair
+    was needed. `data` is empty when the reply holds no object at all.
+    """
+    expected = list(expected or [])
+    start = text.find("{")
+    if start < 0:
+        return Salvaged({}, expected, True)
+
+    try:
+        # Well-formed replies take the C decoder; trailing chatter is ignored
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+    except json.JSONDecodeError:
+        value = None
+    if isinstance(value, dict):
+        return Salvaged(value, [key for key in expected if key not in value], False)
+
+    repairer = _Repairer(text, start)
+    repairer.run()
+    members = repairer.members if repairer.closed else repairer.finish()
+
+    data, lost = {}, []
+    for member in members:
+        if not member.strip():
+            continue
+        try:
+            data.update(json.loads("{" + member + "}", strict=False))
+        except json.JSONDecodeError:
+            lost.append(_member_key(member))
+    if repairer.truncated_member is not None:
+        lost.append(_member_key(repairer.truncated_member))
+
+    missing = [key for key in expected if key not in data]
+    missing += [key for key in lost if key is not None and key not in data and key not in missing]
+    repaired = repairer.changed or not repairer.closed or bool(lost)
+    return Salvaged(data, missing, repaired)
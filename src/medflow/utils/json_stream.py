@@ -0,0 +1,127 @@
+import json
+
+
+class JSONObjectScanner:
+    """
+    Tracks brace and string state of the first top-level JSON object in a text stream.
+
+    Text is fed in arbitrary chunks. Anything before the opening brace (e.g. a ```json
+    fence) is skipped, and scanning stops once the top-level object closes, so trailing
+    chatter is never looked at.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.start = None
+        self.end = None
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    @property
+    def started(self) -> bool:
+        return self.start is not None
+
+    @property
+    def done(self) -> bool:
+        return self.end is not None
+
+    @property
+    def object_text(self):
+        """The complete top-level object, or None while it is still open."""
+        return self.text[self.start:self.end] if self.done else None
+
+    def feed(self, chunk: str) -> bool:
+        """Consumes `chunk` and returns True once the top-level object is complete."""
+        self._scan(chunk)
+        return self.done
+
+    def _on_member(self, member: str):
+        """Called with the raw text of each top-level member as it completes."""
+
+    def _scan(self, chunk: str):
+        if self.done or not chunk:
+            return
+        self.text += chunk
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if not self.started:
+                if ch == "{":
+                    self.start = i
+                    self._depth = 1
+                    self._member_start = i + 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._on_member(text[self._member_start:i])
+                    self.end = i + 1
+                    self._pos = i + 1
+                    return
+            elif ch == "," and self._depth == 1:
+                self._on_member(text[self._member_start:i])
+                self._member_start = i + 1
+        self._pos = len(text)
+
+
+class IncrementalJSONParser(JSONObjectScanner):
+    """
+    Parses a JSON object while it is being generated.
+
+    `feed` returns the top-level fields that became complete in that chunk, so a UI
+    can show each section as soon as it is finished.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+        self._completed = {}
+
+    def feed(self, chunk: str) -> dict:
+        """Consumes `chunk` and returns the top-level fields completed by it."""
+        self._completed = {}
+        self._scan(chunk)
+        return self._completed
+
+    def _on_member(self, member: str):
+        member = member.strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads("{" + member + "}")
+        except json.JSONDecodeError:
+            return
+        self.fields.update(parsed)
+        self._completed.update(parsed)
+
+
+def extract_json_object(text: str) -> str:
+    """
+    Returns the first top-level JSON object in a model reply, dropping fences and
+    any chatter before or after it. An unterminated object is returned from its
+    opening brace; text without a brace is returned stripped.
+    """
+    scanner = JSONObjectScanner()
+    scanner.feed(text)
+    if scanner.done:
+        return scanner.object_text
+    if scanner.started:
+        return text[scanner.start:].strip()
+    return text.strip()
@@ -0,0 +1,331 @@
+"""
+Lightweight pipeline metrics in the Prometheus text format.
+
+Stages report their durations to one histogram, `medflow_stage_seconds{stage=...}`:
+model_load, prompt_build, template, prefill, decode, generate, json_parse,
+pdf_build, pdf_write, html_build and html_write, and first_field (click to the first
+streamed section in the app, per step). Counters and gauges cover tokens,
+parse failures and queue depths.
+
+Metrics are off unless MEDFLOW_METRICS is set or `METRICS.enable()` is called; while
+off, every call returns after one attribute check, so instrumented code pays next to
+nothing:
+
+    with METRICS.stage("pdf_build"):
+        doc.build(elements)
+    METRICS.inc("medflow_parse_failures_total", agent="agent1")
+
+`serve_metrics(port)` exposes `METRICS.render()` at /metrics; the model server
+serves it on its own port.
+"""
+import os
+import time
+import bisect
+import threading
+from collections import defaultdict
+
+METRICS_PATH = "/metrics"
+
+# Seconds, from a JSON parse to a long generation
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+DESCRIPTIONS = {
+    "medflow_stage_seconds": "Duration of each pipeline stage.",
+    "medflow_agent_calls_total": "Model calls made by each agent.",
+    "medflow_parse_failures_total": "Agent replies that did not parse as JSON.",
+    "medflow_prompt_tokens_total": "Prompt tokens sent by each agent.",
+    "medflow_output_tokens_total": "Tokens generated for each agent.",
+    "medflow_tokens_per_second": "Generated tokens per second of call wall time, per agent.",
+    "medflow_decode_tokens_per_second": "Decode steps per second of one generate() call.",
+    "medflow_queue_depth": "Requests waiting in a queue.",
+    "medflow_queue_wait_seconds": "Time requests waited in a queue before running.",
+    "medflow_batch_size": "Conversations per dispatched batch.",
+    "medflow_preempted_total": "Background requests preempted by a foreground request and requeued.",
+    "medflow_prefetch_total": "Clicks served by a speculative generation (hit) or not (miss).",
+    "medflow_prefetch_wasted_seconds_total": "Model time spent on speculative generations that were never used.",
+    "medflow_prefetch_wasted_tokens_total": "Tokens generated by speculative generations that were never used.",
+}
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def _label_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Registry of counters, gauges and histograms keyed by name and labels.
+
+    Args:
+        enabled: Record anything at all; while False every call is a no-op.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = defaultdict(dict)
+        self._gauges = defaultdict(dict)
+        self._histograms = defaultdict(dict)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """Sets a gauge."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[name][_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, buckets=STAGE_BUCKETS, **labels):
+        """Adds `value` to a histogram; `buckets` only applies to the first observation."""
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms[name]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def timer(self, name: str, **labels):
+        """Context manager observing its duration in seconds into histogram `name`."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def stage(self, stage: str, **labels):
+        """`timer` for one of the pipeline stages."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, "medflow_stage_seconds", dict(labels, stage=stage))
+
+    def snapshot(self) -> dict:
+        """Plain-dict copy: counters and gauges by value, histograms as {count, sum}."""
+        with self._lock:
+            return {
+                "counters": {name: dict(series) for name, series in self._counters.items()},
+                "gauges": {name: dict(series) for name, series in self._gauges.items()},
+                "histograms": {
+                    name: {key: {"count": h.count, "sum": h.sum} for key, h in series.items()}
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind):
+            if name in DESCRIPTIONS:
+                lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                header(name, "counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name, series in sorted(self._gauges.items()):
+                header(name, "gauge")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name, series in sorted(self._histograms.items()):
+                header(name, "histogram")
+                for key, h in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {h.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(h.sum)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+class GenerationTimer:
+    """
+    Streamer for `model.generate` that splits a call into prefill and decode.
+
+    generate() hands the streamer the prompt once before the first forward pass and
+    then every new token (row) after each step, so the first token marks the end of
+    prefill. An `inner` streamer still receives everything. With `metrics` None the
+    timings are only kept in `calls`.
+    """
+
+    def __init__(self, metrics=None, inner=None, **labels):
+        self.metrics = metrics
+        self.inner = inner
+        self.labels = labels
+        # (prefill seconds, decode seconds, decode steps) of each finished generate() call
+        self.calls = []
+        self._prompt_at = None
+        self._first_at = None
+        self._steps = 0
+
+    def put(self, value):
+        now = time.perf_counter()
+        if self._prompt_at is None:
+            self._prompt_at = now
+        else:
+            if self._first_at is None:
+                self._first_at = now
+                if self.metrics is not None:
+                    self.metrics.observe("medflow_stage_seconds", now - self._prompt_at, stage="prefill",
+                                         **self.labels)
+            self._steps += 1
+        if self.inner is not None:
+            self.inner.put(value)
+
+    def end(self):
+        if self._first_at is not None:
+            decode = time.perf_counter() - self._first_at
+            self.calls.append((self._first_at - self._prompt_at, decode, self._steps))
+            if self.metrics is not None:
+                self.metrics.observe("medflow_stage_seconds", decode, stage="decode", **self.labels)
+                if decode > 0 and self._steps > 1:
+                    self.metrics.observe("medflow_decode_tokens_per_second", (self._steps - 1) / decode,
+                                         buckets=RATE_BUCKETS, **self.labels)
+        # Pipelines may reuse the streamer for the next batch
+        self._prompt_at = self._first_at = None
+        self._steps = 0
+        if self.inner is not None:
+            self.inner.end()
+
+
+def timed_generate_kwargs(metrics, generate_kwargs: dict = None) -> dict:
+    """`generate_kwargs` with a GenerationTimer streamer (wrapping any existing one) when metrics are on."""
+    if not metrics.enabled:
+        return generate_kwargs
+    generate_kwargs = dict(generate_kwargs or {})
+    generate_kwargs["streamer"] = GenerationTimer(metrics, generate_kwargs.get("streamer"))
+    return generate_kwargs
+
+
+def record_agent_call(metrics, agent: str, mode: str, stats: dict):
+    """Counts one agent call from its stats dict, as built by `generation.batch_item_stats`."""
+    if not metrics.enabled:
+        return
+    metrics.inc("medflow_agent_calls_total", agent=agent, mode=mode)
+    if not stats["parsed"]:
+        metrics.inc("medflow_parse_failures_total", agent=agent, mode=mode)
+    wall_time = stats.get("wall_time")
+    if wall_time is not None:
+        metrics.observe("medflow_stage_seconds", wall_time, stage="generate", agent=agent)
+    if stats.get("prompt_tokens") is not None:
+        metrics.inc("medflow_prompt_tokens_total", stats["prompt_tokens"], agent=agent)
+    if stats.get("output_tokens") is not None:
+        metrics.inc("medflow_output_tokens_total", stats["output_tokens"], agent=agent)
+        if wall_time:
+            metrics.observe("medflow_tokens_per_second", stats["output_tokens"] / wall_time,
+                            buckets=RATE_BUCKETS, agent=agent)
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0", metrics=None):
+    """
+    Serves `metrics.render()` at /metrics from a daemon thread and enables `metrics`.
+    Returns the HTTP server; call `shutdown()` to stop it.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    metrics = metrics or METRICS
+    metrics.enable()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != METRICS_PATH:
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="medflow-metrics", daemon=True).start()
+    print(f"Metrics at http://{host}:{server.server_address[1]}{METRICS_PATH}")
+    return server
+
+
+# Shared by the whole process
+METRICS = Metrics(enabled=os.environ.get("MEDFLOW_METRICS", "") not in ("", "0"))
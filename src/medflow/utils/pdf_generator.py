@@ -4,30 +4,25 @@ from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_JUSTIFY
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
 from reportlab.lib import colors
+import io
+import os
 import json
+import time
+import threading
+import multiprocessing
 from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
-def generate_soap_pdf(soap_data: dict, agent2_output: dict, filename: str = './medical_soap_note.pdf', 
-                      patient_name: str = "N/A", patient_id: str = "N/A", provider_name: str = "MedFlow AI Provider"):
-    """
-    Generates a PDF SOAP note.
-    
-    Args:
-        soap_data: The dictionary containing the SOAP note (S, O, A, P).
-        agent2_output: The full output from Agent 2, containing recommendations and safety notices.
-        filename: Output filename for the PDF.
-        patient_name: Name of the patient.
-        patient_id: ID of the patient.
-        provider_name: Name of the healthcare provider.
-    """
-    
-    doc = SimpleDocTemplate(filename, pagesize=letter,
-                            topMargin=0.5*inch, bottomMargin=0.5*inch,
-                            leftMargin=0.75*inch, rightMargin=0.75*inch)
+from medflow.utils.metrics import METRICS
 
-    # Container for the 'Flowable' objects
-    elements = []
 
+@lru_cache(maxsize=None)
+def _styles():
+    """
+    Paragraph and table styles shared by every PDF.
+    Built on first use and then reused for the lifetime of the process.
+    """
     # Get standard styles
     styles = getSampleStyleSheet()
 
@@ -89,12 +84,94 @@ def generate_soap_pdf(soap_data: dict, agent2_output: dict, filename: str = './m
         borderPadding=6
     )
 
+    subtitle_style = ParagraphStyle('Subtitle', parent=styles['Heading2'],
+                                    fontSize=14, alignment=TA_CENTER,
+                                    textColor=colors.HexColor('#1a1a1a'),
+                                    fontName='Helvetica-Bold', spaceAfter=6)
+
+    patient_table_style = TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#2c3e50')),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ])
+
+    vital_table_style = TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#2c3e50')),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, colors.HexColor('#f8f9fa')])
+    ])
+
+    return {
+        "title": title_style,
+        "subtitle": subtitle_style,
+        "header": header_style,
+        "subheader": subheader_style,
+        "body": body_style,
+        "alert": alert_style,
+        "patient_table": patient_table_style,
+        "vital_table": vital_table_style,
+    }
+
+
+def write_atomic(path: str, data: bytes):
+    """Writes `data` through a temporary file, so readers never see a partially written file."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def generate_soap_pdf(soap_data: dict, agent2_output: dict, filename='./medical_soap_note.pdf', 
+                      patient_name: str = "N/A", patient_id: str = "N/A", provider_name: str = "MedFlow AI Provider",
+                      verbose: bool = True):
+    """
+    Generates a PDF SOAP note.
+    
+    Args:
+        soap_data: The dictionary containing the SOAP note (S, O, A, P).
+        agent2_output: The full output from Agent 2, containing recommendations and safety notices.
+        filename: Where the PDF goes. A path is written atomically; a writable binary
+            stream is written to as is; None keeps the PDF in memory.
+        patient_name: Name of the patient.
+        patient_id: ID of the patient.
+        provider_name: Name of the healthcare provider.
+        verbose: Print the path of a written PDF.
+
+    Returns:
+        The path or stream written to, or the PDF bytes when `filename` is None.
+    """
+    start = time.perf_counter()
+    # Paths are rendered in memory first and then written in one step
+    target = filename if hasattr(filename, "write") else io.BytesIO()
+    doc = SimpleDocTemplate(target, pagesize=letter,
+                            topMargin=0.5*inch, bottomMargin=0.5*inch,
+                            leftMargin=0.75*inch, rightMargin=0.75*inch)
+
+    # Container for the 'Flowable' objects
+    elements = []
+
+    styles = _styles()
+    title_style = styles["title"]
+    header_style = styles["header"]
+    subheader_style = styles["subheader"]
+    body_style = styles["body"]
+    alert_style = styles["alert"]
+
     # Title
     elements.append(Paragraph("MedFlow AI", title_style))
-    elements.append(Paragraph("SOAP NOTE", ParagraphStyle('Subtitle', parent=styles['Heading2'], 
-                                                           fontSize=14, alignment=TA_CENTER, 
-                                                           textColor=colors.HexColor('#1a1a1a'),
-                                                           fontName='Helvetica-Bold', spaceAfter=6)))
+    elements.append(Paragraph("SOAP NOTE", styles["subtitle"]))
     elements.append(Spacer(1, 0.1*inch))
 
     # Patient Information Header
@@ -106,14 +183,7 @@ def generate_soap_pdf(soap_data: dict, agent2_output: dict, filename: str = './m
     ]
 
     patient_table = Table(patient_info_data, colWidths=[1.5*inch, 4*inch])
-    patient_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#2c3e50')),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-    ]))
+    patient_table.setStyle(styles["patient_table"])
     elements.append(patient_table)
     elements.append(Spacer(1, 0.2*inch))
 
@@ -198,16 +268,7 @@ def generate_soap_pdf(soap_data: dict, agent2_output: dict, filename: str = './m
 
     if vital_data:
         vital_table = Table(vital_data, colWidths=[2*inch, 3*inch])
-        vital_table.setStyle(TableStyle([
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#2c3e50')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, colors.HexColor('#f8f9fa')])
-        ]))
+        vital_table.setStyle(styles["vital_table"])
         elements.append(vital_table)
         elements.append(Spacer(1, 0.1*inch))
 
@@ -303,4 +364,43 @@ def generate_soap_pdf(soap_data: dict, agent2_output: dict, filename: str = './m
 
     # Build PDF
     doc.build(elements)
-    print(f"PDF generated: {filename}")
+    METRICS.observe("medflow_stage_seconds", time.perf_counter() - start, stage="pdf_build")
+    if filename is None:
+        return target.getvalue()
+    if target is not filename:
+        with METRICS.stage("pdf_write"):
+            write_atomic(filename, target.getvalue())
+        if verbose:
+            print(f"PDF generated: {filename}")
+    return filename
+
+
+def _render_one(note: dict) -> str:
+    # One "PDF generated" line per note is noise in bulk runs
+    return generate_soap_pdf(**{"verbose": False, **note})
+
+
+def render_many(notes: list, workers: int = 1, chunksize: int = 16) -> list:
+    """
+    Renders many PDFs, spread over `workers` processes.
+
+    Args:
+        notes: One dict of generate_soap_pdf keyword arguments per PDF
+            (soap_data, agent2_output, filename, patient_name, ...). Notes with
+            filename=None are rendered in memory.
+        workers: Worker processes; 1 renders in this process.
+        chunksize: Notes sent to a worker at a time.
+
+    Returns:
+        Per note, in order, the filename written or the PDF bytes.
+    """
+    if workers <= 1 or len(notes) <= 1:
+        results = [_render_one(note) for note in notes]
+    else:
+        # Spawned workers do not inherit model threads or weights from this process;
+        # each builds its styles once and reuses them for every note it renders
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            results = list(pool.map(_render_one, notes, chunksize=chunksize))
+    print(f"{len(results)} PDFs generated")
+    return results
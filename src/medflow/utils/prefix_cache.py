@@ -0,0 +1,167 @@
+import copy
+import hashlib
+import threading
+
+from medflow.utils.generation import get_tokenizer
+from medflow.utils.metrics import METRICS, timed_generate_kwargs
+
+
+def _model_fingerprint(model) -> str:
+    """Identifies the loaded weights: checkpoint name, revision and the model object itself."""
+    config = getattr(model, "config", None)
+    return "|".join([
+        str(getattr(config, "_name_or_path", "")),
+        str(getattr(config, "_commit_hash", "")),
+        str(getattr(model, "dtype", "")),
+        str(id(model)),
+    ])
+
+
+def _system_text(messages: list):
+    if not messages or messages[0].get("role") != "system":
+        return None
+    content = messages[0]["content"]
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+
+def _has_images(messages: list) -> bool:
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image" for part in content):
+            return True
+    return False
+
+
+class PrefixCache:
+    """
+    Token ids and key/value states for constant system prefixes.
+
+    Entries are keyed on a hash of the system prompt text and the model fingerprint,
+    so editing a prompt or loading another model produces a new entry instead of
+    reusing stale states.
+    """
+
+    def __init__(self, model, processor, max_entries: int = 8):
+        self.model = model
+        self.processor = processor
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, system_prompt: str) -> str:
+        raw = f"{_model_fingerprint(self.model)}\n{system_prompt}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _template_ids(self, system_prompt: str, user_text: str):
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
+            {"role": "user", "content": [{"type": "text", "text": user_text}]},
+        ]
+        return self.processor.apply_chat_template(
+            messages, add_generation_prompt=True, tokenize=True, return_dict=True, return_tensors="pt"
+        )["input_ids"][0]
+
+    def _build(self, system_prompt: str):
+        import torch
+
+        # Chat templates may fold the system prompt into the first user turn, so the
+        # prefix is whatever two renders with different user texts have in common.
+        a = self._template_ids(system_prompt, "A")
+        b = self._template_ids(system_prompt, "B")
+        n = min(len(a), len(b))
+        common = 0
+        while common < n and a[common] == b[common]:
+            common += 1
+        # Leave the boundary token out; it can merge with the user text when tokenized
+        prefix_ids = a[:max(common - 1, 0)].unsqueeze(0).to(self.model.device)
+
+        with torch.no_grad():
+            past_key_values = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+        return {"input_ids": prefix_ids, "past_key_values": past_key_values}
+
+    def get(self, system_prompt: str):
+        """Returns the cached prefix entry for `system_prompt`, computing it on first use."""
+        key = self.key(system_prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            entry = self._build(system_prompt)
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = entry
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class PrefixCachedPipeline:
+    """
+    Drop-in wrapper around an image-text-to-text pipeline that reuses the KV states
+    of the system prefix, so each call only prefills the patient-specific suffix.
+
+    Calls with images or several conversations are passed through to the wrapped
+    pipeline unchanged, as are prompts whose tokens do not start with the cached prefix.
+    A batch of one conversation (as the micro-batch scheduler sends) uses the cache.
+    """
+
+    def __init__(self, pipe, max_entries: int = 8):
+        self.pipe = pipe
+        self.model = pipe.model
+        self.processor = getattr(pipe, "processor", None) or get_tokenizer(pipe)
+        self.tokenizer = get_tokenizer(pipe)
+        self.cache = PrefixCache(self.model, self.processor, max_entries=max_entries)
+
+    def __getattr__(self, name):
+        # Anything not overridden (tokenizer settings, task, ...) comes from the wrapped pipe
+        if name == "pipe":
+            raise AttributeError(name)
+        return getattr(self.pipe, name)
+
+    def __call__(self, text, max_new_tokens: int = 256, generate_kwargs: dict = None, **kwargs):
+        if text and isinstance(text[0], list) and len(text) == 1:
+            return [self(text[0], max_new_tokens, generate_kwargs, **kwargs)]
+        system_prompt = _system_text(text) if text and isinstance(text[0], dict) else None
+        if system_prompt is None or _has_images(text):
+            return self._passthrough(text, max_new_tokens, generate_kwargs, **kwargs)
+
+        import torch
+
+        entry = self.cache.get(system_prompt)
+        prefix_ids = entry["input_ids"]
+        with METRICS.stage("template"):
+            input_ids = self.processor.apply_chat_template(
+                text, add_generation_prompt=True, tokenize=True, return_dict=True, return_tensors="pt"
+            )["input_ids"].to(self.model.device)
+
+        n_prefix = prefix_ids.shape[1]
+        if input_ids.shape[1] <= n_prefix or not torch.equal(input_ids[:, :n_prefix], prefix_ids):
+            return self._passthrough(text, max_new_tokens, generate_kwargs, **kwargs)
+
+        # generate() appends to the cache in place, so every call gets its own copy
+        past_key_values = copy.deepcopy(entry["past_key_values"])
+        with torch.no_grad():
+            generated = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                max_new_tokens=max_new_tokens,
+                **(timed_generate_kwargs(METRICS, generate_kwargs) or {}),
+            )
+        reply = self.tokenizer.decode(generated[0, input_ids.shape[1]:], skip_special_tokens=True)
+        return [{"generated_text": text + [{"role": "assistant", "content": reply}]}]
+
+    def _passthrough(self, text, max_new_tokens, generate_kwargs, **kwargs):
+        # Templating happens inside the pipeline here, so it is counted in prefill
+        generate_kwargs = timed_generate_kwargs(METRICS, generate_kwargs)
+        if generate_kwargs:
+            kwargs["generate_kwargs"] = generate_kwargs
+        return self.pipe(text=text, max_new_tokens=max_new_tokens, **kwargs)
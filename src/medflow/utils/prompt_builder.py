@@ -0,0 +1,150 @@
+"""
+Compact prompt building with a token budget.
+
+Inputs are serialized as compact JSON without empty or placeholder fields, and each
+part of a prompt is a section with a priority. When the sections exceed the agent's
+input budget, the lowest-priority ones are truncated (or dropped) first:
+
+    builder = PromptBuilder(pipe, budget=1024, agent="agent2")
+    builder.add("Doctor Plan", doctor_plan, priority=4)
+    builder.add("Objective", note["objective"], priority=2)
+    text = builder.build()
+    builder.report   # {"tokens": 812, "budget": 1024, "truncated": [], "sections": {...}}
+"""
+import json
+
+from medflow.utils.generation import get_tokenizer, count_tokens
+from medflow.utils.metrics import METRICS
+
+# Values that carry no information for the model
+PLACEHOLDERS = {"missing", "n/a", "na", "not provided", "not available", "unknown"}
+
+TRUNCATION_MARKER = " ...[truncated]"
+
+# Rough characters per token, used to budget pipes without a local tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def is_placeholder(value) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return not value.strip() or value.strip().lower() in PLACEHOLDERS
+    if isinstance(value, (list, tuple, dict)):
+        return not value
+    return False
+
+
+def compact(value):
+    """`value` with empty and placeholder fields removed, recursively."""
+    if isinstance(value, dict):
+        value = {k: compact(v) for k, v in value.items()}
+        return {k: v for k, v in value.items() if not is_placeholder(v)}
+    if isinstance(value, (list, tuple)):
+        value = [compact(v) for v in value]
+        return [v for v in value if not is_placeholder(v)]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def dumps(value) -> str:
+    """Compact JSON: no indentation or spaces, no empty or placeholder fields."""
+    if isinstance(value, str):
+        return value.strip()
+    return json.dumps(compact(value), separators=(",", ":"), ensure_ascii=False)
+
+
+def estimate_tokens(pipe, text: str) -> int:
+    """Token count of `text` with the pipe's tokenizer, or a character-based estimate."""
+    tokens = count_tokens(pipe, text)
+    if tokens is None:
+        tokens = -(-len(text) // CHARS_PER_TOKEN)
+    return tokens
+
+
+def truncate_tokens(pipe, text: str, max_tokens: int) -> str:
+    """The first `max_tokens` tokens of `text`."""
+    if max_tokens <= 0:
+        return ""
+    tokenizer = get_tokenizer(pipe)
+    if tokenizer is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    ids = tokenizer.encode(text, add_special_tokens=False)
+    return tokenizer.decode(ids[:max_tokens], skip_special_tokens=True)
+
+
+class PromptBuilder:
+    """
+    Assembles the user text of a prompt from prioritized sections.
+
+    Args:
+        pipe: Pipeline whose tokenizer counts the tokens.
+        budget: Maximum input tokens for the sections; None for no limit.
+        agent: Name used in the truncation warning.
+    """
+
+    def __init__(self, pipe, budget: int = None, agent: str = "agent"):
+        self.pipe = pipe
+        self.budget = budget
+        self.agent = agent
+        self._sections = []
+        self.report = None
+
+    def add(self, title, value, priority=1):
+        """
+        Adds a section rendered as "title:\\nvalue". Values are serialized with `dumps`;
+        placeholder values are skipped. Higher priorities are truncated last and a
+        priority of None is never truncated. A title of None adds the value as bare text.
+        """
+        if is_placeholder(compact(value)):
+            return self
+        body = dumps(value)
+        self._sections.append({
+            "title": title,
+            "text": f"{title}:\n{body}" if title else body,
+            "priority": priority,
+            "order": len(self._sections),
+        })
+        return self
+
+    def build(self) -> str:
+        with METRICS.stage("prompt_build", agent=self.agent):
+            return self._build()
+
+    def _build(self) -> str:
+        sections = [dict(section) for section in self._sections]
+        for section in sections:
+            section["tokens"] = estimate_tokens(self.pipe, section["text"])
+
+        truncated = []
+        total = self._total(sections)
+        if self.budget is not None and total > self.budget:
+            truncatable = [s for s in sections if s["priority"] is not None]
+            for section in sorted(truncatable, key=lambda s: (s["priority"], -s["order"])):
+                excess = total - self.budget
+                if excess <= 0:
+                    break
+                keep = section["tokens"] - excess - estimate_tokens(self.pipe, TRUNCATION_MARKER)
+                if keep > 0:
+                    section["text"] = truncate_tokens(self.pipe, section["text"], keep) + TRUNCATION_MARKER
+                else:
+                    section["text"] = ""
+                section["tokens"] = estimate_tokens(self.pipe, section["text"]) if section["text"] else 0
+                truncated.append(section["title"] or "text")
+                total = self._total(sections)
+            print(f"[{self.agent}] input over budget ({self.budget} tokens): truncated {', '.join(truncated)}")
+
+        text = "\n\n".join(section["text"] for section in sections if section["text"])
+        self.report = {
+            "tokens": total,
+            "budget": self.budget,
+            "truncated": truncated,
+            "sections": {section["title"] or "text": section["tokens"] for section in sections},
+        }
+        return text
+
+    def _total(self, sections) -> int:
+        # Section separators are counted as one token each
+        present = [section for section in sections if section["text"]]
+        return sum(section["tokens"] for section in present) + max(len(present) - 1, 0)
@@ -0,0 +1,157 @@
+import os
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def image_hash(image) -> str:
+    """
+    Content hash of an image input: PIL images hash their mode, size and pixels,
+    bytes hash as-is and strings are treated as file paths.
+    """
+    h = hashlib.sha256()
+    if hasattr(image, "tobytes") and hasattr(image, "size"):
+        h.update(f"{image.mode}|{image.size}".encode("utf-8"))
+        h.update(image.tobytes())
+    elif isinstance(image, (bytes, bytearray)):
+        h.update(image)
+    elif isinstance(image, str) and os.path.exists(image):
+        with open(image, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    else:
+        h.update(repr(image).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _normalize(value):
+    # Whitespace around free-text fields should not produce a different key
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_cache_key(**parts) -> str:
+    """Canonical sha256 over the normalized inputs, image hashes, model id, prompt version and parameters."""
+    canonical = json.dumps(_normalize(parts), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for agent outputs: a bounded in-memory LRU in front of an optional
+    on-disk store. The disk tier evicts the least recently used files once it grows
+    past `max_disk_bytes`.
+    """
+
+    def __init__(self, max_entries: int = 256, cache_dir: str = None, max_disk_bytes: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_bytes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(os.path.getsize(path) for path in self._disk_files())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _disk_files(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    yield os.path.join(root, name)
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """Returns the cached value for `key`, or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._memory[key])
+
+            if self.cache_dir:
+                path = self._path(key)
+                try:
+                    with open(path, "r") as f:
+                        value = json.load(f)
+                    # Touch the file so disk eviction sees it as recently used
+                    os.utime(path, None)
+                except (OSError, json.JSONDecodeError):
+                    value = None
+                if value is not None:
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return copy.deepcopy(value)
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value):
+        with self._lock:
+            # Callers mutate returned notes, so the cache keeps its own copy
+            self._remember(key, copy.deepcopy(value))
+            if not self.cache_dir:
+                return
+
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+            self._disk_bytes += os.path.getsize(path) - previous
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # Drop least recently used files until the store is back under 90% of the limit
+        target = int(self.max_disk_bytes * 0.9)
+        files = sorted(self._disk_files(), key=os.path.getmtime)
+        for path in files:
+            if self._disk_bytes <= target:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.cache_dir:
+                for path in list(self._disk_files()):
+                    os.remove(path)
+                self._disk_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
@@ -0,0 +1,90 @@
+"""
+JSON schemas of the agent outputs, built from the keys that the agents and
+`pdf_generator.generate_soap_pdf` read. Used by the constrained decoding mode.
+"""
+
+def _strings(*keys):
+    return {key: {"type": "string"} for key in keys}
+
+
+def _string_list():
+    return {"type": "array", "items": {"type": "string"}}
+
+
+def _object(properties: dict):
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+SUBJECTIVE_SCHEMA = _object({
+    **_strings("chief_complaint", "history_of_present_illness", "past_medical_history"),
+    "medications": _string_list(),
+    "allergies": _string_list(),
+    **_strings("social_history", "family_history", "review_of_systems"),
+})
+
+OBJECTIVE_SCHEMA = _object({
+    "vital_signs": _object(_strings(
+        "blood_pressure", "heart_rate", "respiratory_rate", "temperature", "oxygen_saturation"
+    )),
+    "physical_exam": {"type": "string"},
+    "imaging": _object(_strings("chest_xray", "other_imaging")),
+    "laboratory_results": {"type": "string"},
+})
+
+# Agent 1: S/O/A only
+SOAP_PARTIAL_SCHEMA = _object({
+    "subjective": SUBJECTIVE_SCHEMA,
+    "objective": OBJECTIVE_SCHEMA,
+    "assessment": {"type": "string"},
+    "missing_information": _string_list(),
+    "safety_notice": {"type": "string"},
+})
+
+PLAN_SCHEMA = _object({
+    "medications": _string_list(),
+    "lab_tests": _string_list(),
+    "follow_up": {"type": "string"},
+})
+
+# Agent 2: full SOAP note plus the plan review sections
+PLAN_ANALYSIS_SCHEMA = _object({
+    "soap_note": _object({
+        "subjective": SUBJECTIVE_SCHEMA,
+        "objective": OBJECTIVE_SCHEMA,
+        "assessment": {"type": "string"},
+        "plan": PLAN_SCHEMA,
+    }),
+    "medication_review": _object({
+        "alignment_score": {"type": "number", "minimum": 0, "maximum": 100},
+        "rationale": {"type": "string"},
+    }),
+    "test_validation": {
+        "type": "array",
+        "items": _object({
+            "test": {"type": "string"},
+            "relevance_score": {"type": "number", "minimum": 0, "maximum": 100},
+            "rationale": {"type": "string"},
+        }),
+    },
+    "lifestyle_recommendations": _object(_strings("food", "exercise", "clothing", "music", "fragrance")),
+    "additional_notes": {"type": "string"},
+    "safety_notice": {"type": "string"},
+})
+
+
+def section_schema(schema: dict, keys) -> dict:
+    """Schema of an object holding only `keys` of `schema`'s properties."""
+    return _object({key: schema["properties"][key] for key in keys})
+
+
+# Agent 1 with pre-structured intake (medflow.utils.intake): only the narrative fields
+NARRATIVE_SCHEMA = _object(_strings("history_of_present_illness", "review_of_systems", "assessment", "safety_notice"))
+
+NARRATIVE_IMAGING_SCHEMA = _object(_strings(
+    "history_of_present_illness", "review_of_systems", "imaging_findings", "assessment", "safety_notice"
+))
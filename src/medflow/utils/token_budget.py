@@ -0,0 +1,111 @@
+"""
+Adaptive max_new_tokens learned from observed output lengths.
+
+The agents' fixed MAX_NEW_TOKENS are ceilings sized for the worst case. Once enough
+replies of a prompt variant have been seen, the budget becomes a high percentile of
+their lengths plus a margin, so runaway generations stop early and allocations fit
+the typical reply. Observations are kept per input-size bucket (e.g. the number of
+symptoms, medications and lab tests), since longer inputs get longer replies.
+
+A reply that hits its budget without parsing is retried once at the ceiling:
+
+    max_new_tokens = budget.budget(variant, size, ceiling=800)
+    ...generate, parse...
+    retry = budget.retry_budget(output_tokens, max_new_tokens, parsed, ceiling=800)
+"""
+import json
+import threading
+from collections import defaultdict, deque
+
+# Upper bounds of the input-size buckets; larger inputs share the last bucket
+SIZE_BUCKETS = (2, 5, 9)
+
+
+def size_bucket(size: int) -> int:
+    for bucket, upper in enumerate(SIZE_BUCKETS):
+        if size <= upper:
+            return bucket
+    return len(SIZE_BUCKETS)
+
+
+def count_items(*values) -> int:
+    """Number of entries in list or comma-separated string inputs."""
+    total = 0
+    for value in values:
+        if isinstance(value, str):
+            total += len([part for part in value.split(",") if part.strip()])
+        elif isinstance(value, (list, tuple)):
+            total += len(value)
+    return total
+
+
+class TokenBudget:
+    """
+    Args:
+        quantile: Percentile of the observed output lengths the budget is based on.
+        margin: Factor applied to that percentile.
+        extra: Tokens added on top, so short replies still get headroom.
+        min_samples: Observations a bucket needs before its budget replaces the ceiling.
+        floor: Smallest budget ever returned.
+        window: Most recent observations kept per bucket.
+    """
+
+    def __init__(self, quantile: float = 0.95, margin: float = 1.2, extra: int = 32,
+                 min_samples: int = 20, floor: int = 64, window: int = 500):
+        self.quantile = quantile
+        self.margin = margin
+        self.extra = extra
+        self.min_samples = min_samples
+        self.floor = floor
+        self._lengths = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_log(cls, path: str, agent: str, **kwargs):
+        """A budget warmed up from the parsed calls of `agent` in a TokenLog JSONL file."""
+        budget = cls(**kwargs)
+        if not path:
+            return budget
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if (record.get("agent") == agent and record.get("variant") and record.get("parsed")
+                            and not record.get("truncated") and record.get("output_tokens") is not None):
+                        budget.observe(record["variant"], record.get("size", 0), record["output_tokens"])
+        except FileNotFoundError:
+            pass
+        return budget
+
+    def observe(self, variant: str, size: int, output_tokens: int):
+        """Records the length of a complete (parsed) reply."""
+        if output_tokens is None:
+            return
+        with self._lock:
+            self._lengths[(variant, size_bucket(size))].append(output_tokens)
+
+    def budget(self, variant: str, size: int, ceiling: int) -> int:
+        """max_new_tokens for a call; the ceiling until the bucket has enough samples."""
+        with self._lock:
+            lengths = sorted(self._lengths.get((variant, size_bucket(size)), ()))
+        if len(lengths) < self.min_samples:
+            return ceiling
+        high = lengths[min(int(self.quantile * len(lengths)), len(lengths) - 1)]
+        return max(self.floor, min(ceiling, int(high * self.margin) + self.extra))
+
+    @staticmethod
+    def truncated(output_tokens, max_new_tokens: int, parsed: bool) -> bool:
+        """
+        True when a reply did not parse and used (about) its whole budget. Token counts
+        of decoded text can differ slightly from the generated ids, hence the tolerance.
+        """
+        return not parsed and output_tokens is not None and output_tokens >= 0.95 * max_new_tokens
+
+    def retry_budget(self, output_tokens, max_new_tokens: int, parsed: bool, ceiling: int):
+        """The budget to retry a truncated reply with, or None when no retry is warranted."""
+        if self.truncated(output_tokens, max_new_tokens, parsed) and max_new_tokens < ceiling:
+            return ceiling
+        return None
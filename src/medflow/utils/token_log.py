@@ -0,0 +1,85 @@
+"""
+Per-call token accounting for capacity planning.
+
+Every agent call records its prompt and output token counts here. Recent calls are
+kept in memory for `summary()`; set MEDFLOW_TOKEN_LOG to a file path to also append
+each call to that JSONL file.
+"""
+import os
+import json
+import time
+import threading
+from collections import defaultdict, deque
+
+
+def percentile(samples, q):
+    """The `q` quantile (0 to 1) of `samples`, or None when there are none."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def _describe(samples):
+    samples = [s for s in samples if s is not None]
+    if not samples:
+        return None
+    return {
+        "mean": sum(samples) / len(samples),
+        "p95": percentile(samples, 0.95),
+        "max": max(samples),
+    }
+
+
+class TokenLog:
+    """
+    Args:
+        path: Optional JSONL file every record is appended to.
+        window: Calls per agent kept in memory for `summary()`.
+    """
+
+    def __init__(self, path: str = None, window: int = 1000):
+        self.path = path
+        self.window = window
+        self._records = defaultdict(lambda: deque(maxlen=window))
+        self._calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, agent: str, prompt_tokens, output_tokens, wall_time: float = None, **extra):
+        record = {
+            "time": time.time(),
+            "agent": agent,
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "wall_time": wall_time,
+            **extra,
+        }
+        with self._lock:
+            self._records[agent].append(record)
+            self._calls[agent] += 1
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+        return record
+
+    def summary(self) -> dict:
+        """
+        Per agent: total calls, prompt/output token mean, p95 and max over the window,
+        and the calls in the window cut off by their max_new_tokens.
+        """
+        with self._lock:
+            records = {agent: list(recent) for agent, recent in self._records.items()}
+            calls = dict(self._calls)
+        return {
+            agent: {
+                "calls": calls[agent],
+                "prompt_tokens": _describe(r["prompt_tokens"] for r in recent),
+                "output_tokens": _describe(r["output_tokens"] for r in recent),
+                "truncated_calls": sum(bool(r.get("truncated")) for r in recent),
+            }
+            for agent, recent in records.items()
+        }
+
+
+# Shared by the agents unless they are given their own log
+TOKEN_LOG = TokenLog(os.environ.get("MEDFLOW_TOKEN_LOG"))
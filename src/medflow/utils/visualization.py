@@ -1,11 +1,73 @@
 import json
 import os
+import time
+
+from medflow.utils.metrics import METRICS
+
+# Agent 2 output used when no input is given (matches output_graph.html content)
+EXAMPLE_OUTPUT = {
+    "soap_note": {
+        "subjective": {
+            "chief_complaint": "Chest discomfort, shortness of breath during exertion, and fatigue.",
+            "history_of_present_illness": "Patient reports experiencing chest discomfort, shortness of breath during exertion, and fatigue for the past 2 weeks. The symptoms are described as moderate in severity.",
+            "past_medical_history": "Patient has a history of hypertension.",
+            "medications": [],
+            "allergies": [],
+            "social_history": "Missing",
+            "family_history": "Missing",
+            "review_of_systems": "Missing",
+            "missing_information": [
+                "Social history",
+                "Family history",
+                "Review of systems",
+                "Detailed description of chest discomfort (location, character, radiation)",
+                "Details about shortness of breath (onset, triggers, relieving factors)"
+            ]
+        },
+        "objective": {
+            "vital_signs": {
+                "blood_pressure": "145/90 mmHg",
+                "heart_rate": "92 bpm",
+                "respiratory_rate": "Missing",
+                "temperature": "Missing",
+                "oxygen_saturation": "Missing"
+            },
+            "physical_exam": "Missing",
+            "imaging": {
+                "chest_xray": "Attached image of chest X-ray. Analysis pending.",
+                "other_imaging": "Missing"
+            },
+            "laboratory_results": "Missing",
+            "missing_information": [
+                "Respiratory rate",
+                "Temperature",
+                "Oxygen saturation",
+                "Physical exam findings",
+                "Details of chest X-ray findings"
+            ]
+        },
+        "assessment": "Patient presents with symptoms suggestive of possible cardiac or pulmonary etiology.",
+        "plan": "Medications: Omeprazole 20mg once daily. Labs: H. pylori test, CBC. Follow-up in 2 weeks."
+    },
+    "medication_review": {
+        "alignment_score": 85,
+        "rationale": "Omeprazole is a PPI used to reduce stomach acid."
+    },
+    "test_validation": {
+        "h_pylori_test": {
+            "relevance_score": 70,
+            "rationale": "Symptoms could be related to GERD."
+        }
+    }
+}
+
 
 def save_visualization_html(json_data: dict, output_file: str = "visualization.html"):
     """
     Saves an HTML file that embeds the JSON Crack widget and sends data via postMessage.
     Includes retries and a manual button to ensure data loading.
     """
+    start = time.perf_counter()
     json_str = json.dumps(json_data)
     widget_url = "https://jsoncrack.com/widget"
     
@@ -83,8 +145,10 @@ def save_visualization_html(json_data: dict, output_file: str = "visualization.h
     </html>
     """
     
-    with open(output_file, "w") as f:
-        f.write(html_content)
+    METRICS.observe("medflow_stage_seconds", time.perf_counter() - start, stage="html_build")
+    with METRICS.stage("html_write"):
+        with open(output_file, "w") as f:
+            f.write(html_content)
     
     print(f"Visualization saved to {os.path.abspath(output_file)}")
     return os.path.abspath(output_file)
@@ -0,0 +1,177 @@
+"""
+The agent1 -> doctor -> agent2 flow as a LangGraph graph with durable, checkpointed state.
+
+Every step is saved to a local SQLite checkpointer, keyed by the encounter id. The
+doctor node suspends the graph until a plan is submitted. A paused encounter is then
+only a row in the database: no model call, thread or coroutine is held for it. It
+can be resumed hours later, from any process that opens the same database, without
+running Agent 1 again.
+
+    async with MedFlowWorkflow(pipe, "encounters.sqlite") as workflow:
+        soap_note = await workflow.start("enc-1", patient_info, ethnicity="South Asian")
+        ...
+        final_output = await workflow.resume("enc-1", doctor_plan)
+
+Requires langgraph and langgraph-checkpoint-sqlite; they are imported when a workflow
+is opened. The model calls run in worker threads, so the event loop stays free to
+start and resume other encounters meanwhile.
+"""
+import io
+import os
+import asyncio
+import contextlib
+from typing import Any, Dict, List, Optional, TypedDict
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.agents.agent2 import PlanAnalyzer
+
+DEFAULT_DB = os.path.join(".cache", "workflow.sqlite")
+
+
+class MedFlowState(TypedDict, total=False):
+    patient_info: Dict[str, Any]
+    # File paths, URLs or PNG bytes, so that the checkpoints stay serializable
+    images: Optional[List[Any]]
+    ethnicity: str
+    soap_note: Dict[str, Any]
+    doctor_plan: Dict[str, Any]
+    final_output: Dict[str, Any]
+
+
+def _portable_image(image):
+    """PIL images become PNG bytes; paths, URLs and bytes are kept."""
+    if hasattr(image, "save") and hasattr(image, "size"):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+    return image
+
+
+def _model_image(image):
+    if isinstance(image, (bytes, bytearray)):
+        from PIL import Image
+        return Image.open(io.BytesIO(image))
+    return image
+
+
+def build_graph(generator, analyzer):
+    """The uncompiled StateGraph: agent1 -> doctor (interrupt) -> agent2."""
+    from langgraph.graph import StateGraph, END
+    from langgraph.types import interrupt
+
+    async def agent1_node(state: MedFlowState):
+        images = [_model_image(image) for image in state.get("images") or []] or None
+        soap_note = await asyncio.to_thread(generator.generate, state["patient_info"], images)
+        # The images are only needed by Agent 1; keep them out of the later checkpoints
+        return {"soap_note": soap_note, "images": None}
+
+    def doctor_node(state: MedFlowState):
+        # Suspends the graph; the value passed to resume() is returned here
+        doctor_plan = interrupt({"soap_note": state["soap_note"]})
+        return {"doctor_plan": doctor_plan}
+
+    async def agent2_node(state: MedFlowState):
+        final_output = await asyncio.to_thread(
+            analyzer.analyze, state["soap_note"], state["doctor_plan"], state.get("ethnicity") or "Not provided")
+        return {"final_output": final_output}
+
+    workflow = StateGraph(MedFlowState)
+    workflow.add_node("agent1", agent1_node)
+    workflow.add_node("doctor", doctor_node)
+    workflow.add_node("agent2", agent2_node)
+    workflow.set_entry_point("agent1")
+    workflow.add_edge("agent1", "doctor")
+    workflow.add_edge("doctor", "agent2")
+    workflow.add_edge("agent2", END)
+    return workflow
+
+
+class MedFlowWorkflow:
+    """
+    Durable two-agent workflow with a human-in-the-loop pause before the plan analysis.
+
+    Args:
+        pipe: Model pipe for both agents. Processes that only resume encounters still
+            need one for Agent 2; Agent 1 is never re-run on resume.
+        db_path: SQLite file holding the checkpoints. Default: .cache/workflow.sqlite
+        cache: Optional ResponseCache shared by both agents.
+        generator, analyzer: Agents to use instead of ones built on `pipe`, e.g. the
+            app's own.
+
+    Use as an async context manager, or call open() and close().
+    """
+
+    def __init__(self, pipe=None, db_path: str = DEFAULT_DB, cache=None, generator=None, analyzer=None):
+        self.db_path = db_path
+        self.generator = generator or SoapNoteGenerator(pipe, cache=cache)
+        self.analyzer = analyzer or PlanAnalyzer(pipe, cache=cache)
+        self.graph = None
+        self._stack = None
+
+    async def open(self):
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._stack = contextlib.AsyncExitStack()
+        checkpointer = await self._stack.enter_async_context(AsyncSqliteSaver.from_conn_string(self.db_path))
+        self.graph = build_graph(self.generator, self.analyzer).compile(checkpointer=checkpointer)
+        return self
+
+    async def close(self):
+        if self._stack is not None:
+            await self._stack.aclose()
+            self._stack, self.graph = None, None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @staticmethod
+    def _config(encounter_id: str):
+        return {"configurable": {"thread_id": str(encounter_id)}}
+
+    async def start(self, encounter_id: str, patient_info: dict, images: list = None,
+                    ethnicity: str = "Not provided") -> dict:
+        """
+        Runs Agent 1 for a new encounter and suspends it for the doctor's plan.
+        Returns the S/O/A note. Raises ValueError if the encounter id is already in use.
+        """
+        if (await self.graph.aget_state(self._config(encounter_id))).values:
+            raise ValueError(f"Encounter {encounter_id} already exists")
+        state = {
+            "patient_info": patient_info,
+            "images": [_portable_image(image) for image in images] if images else None,
+            "ethnicity": ethnicity,
+        }
+        await self.graph.ainvoke(state, self._config(encounter_id))
+        return (await self.graph.aget_state(self._config(encounter_id))).values["soap_note"]
+
+    async def resume(self, encounter_id: str, doctor_plan: dict) -> dict:
+        """
+        Submits the doctor's plan for a paused encounter and runs Agent 2.
+        Returns Agent 2's output. Raises ValueError unless the encounter awaits a plan.
+        """
+        from langgraph.types import Command
+
+        if not await self.is_paused(encounter_id):
+            raise ValueError(f"Encounter {encounter_id} is not awaiting a doctor's plan")
+        result = await self.graph.ainvoke(Command(resume=doctor_plan), self._config(encounter_id))
+        return result["final_output"]
+
+    async def is_paused(self, encounter_id: str) -> bool:
+        snapshot = await self.graph.aget_state(self._config(encounter_id))
+        return "doctor" in snapshot.next
+
+    async def state(self, encounter_id: str) -> dict:
+        """The encounter's saved state ({} if unknown), plus `status`: paused, done or running."""
+        snapshot = await self.graph.aget_state(self._config(encounter_id))
+        if not snapshot.values:
+            return {}
+        if "doctor" in snapshot.next:
+            status = "paused"
+        else:
+            status = "running" if snapshot.next else "done"
+        return dict(snapshot.values, status=status)
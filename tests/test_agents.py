@@ -0,0 +1,239 @@
+import sys
+import os
+import json
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.agents.agent2 import PlanAnalyzer
+
+
+class FakePipe:
+    """Returns canned replies in the chat-pipeline output shape, one per conversation."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    def _reply(self, messages):
+        text = self.replies.pop(0)
+        return [{"generated_text": messages + [{"role": "assistant", "content": text}]}]
+
+    def __call__(self, text, max_new_tokens, **kwargs):
+        self.calls.append({"text": text, "max_new_tokens": max_new_tokens, **kwargs})
+        if text and isinstance(text[0], list):
+            return [self._reply(messages) for messages in text]
+        return self._reply(text)
+
+
+SOA_REPLY = "```json\n" + json.dumps({"S": "subj", "O": "obj", "A": "assess"}) + "\n```"
+
+
+class TestBatchGeneration(unittest.TestCase):
+    def test_generate_batch_single_forward_pass(self):
+        pipe = FakePipe([SOA_REPLY, SOA_REPLY, SOA_REPLY])
+        agent = SoapNoteGenerator(pipe)
+        notes, stats = agent.generate_batch([{"age": 1}, {"age": 2}, {"age": 3}])
+
+        self.assertEqual(len(pipe.calls), 1)
+        self.assertEqual(pipe.calls[0]["batch_size"], 3)
+        self.assertEqual([n["subjective"] for n in notes], ["subj"] * 3)
+        self.assertEqual(len(stats["items"]), 3)
+        self.assertTrue(all(item["parsed"] for item in stats["items"]))
+
+    def test_generate_batch_falls_back_per_item(self):
+        pipe = FakePipe([SOA_REPLY, "not json", SOA_REPLY])
+        agent = SoapNoteGenerator(pipe)
+        notes, stats = agent.generate_batch([{}, {}, {}], batch_size=2)
+
+        self.assertEqual(len(pipe.calls), 2)
+        self.assertEqual(notes[0]["assessment"], "assess")
+        self.assertEqual(notes[1]["assessment"], "")
+        self.assertEqual(notes[2]["assessment"], "assess")
+        self.assertEqual([item["parsed"] for item in stats["items"]], [True, False, True])
+
+    def test_analyze_batch(self):
+        pipe = FakePipe(['{"medication_review": {"alignment_score": 80}}', "{broken"])
+        agent = PlanAnalyzer(pipe)
+        analyses, stats = agent.analyze_batch([{}, {}], [{"medications": []}, {"medications": []}])
+
+        self.assertEqual(analyses[0]["medication_review"]["alignment_score"], 80)
+        self.assertIn("missing_information", analyses[1])
+        self.assertEqual([item["parsed"] for item in stats["items"]], [True, False])
+
+    def test_non_object_reply_fails_only_its_item(self):
+        pipe = FakePipe([SOA_REPLY, '["cannot comply"]', SOA_REPLY])
+        notes, stats = SoapNoteGenerator(pipe).generate_batch([{"age": 1}, {"age": 2}, {"age": 3}])
+        self.assertEqual([n["assessment"] for n in notes], ["assess", "", "assess"])
+        self.assertEqual([item["parsed"] for item in stats["items"]], [True, False, True])
+
+        pipe = FakePipe(['{"medication_review": {"alignment_score": 80}}', '["cannot comply"]'])
+        analyses, stats = PlanAnalyzer(pipe).analyze_batch([{}, {}], [{"medications": []}, {"medications": []}])
+        self.assertEqual(analyses[0]["medication_review"]["alignment_score"], 80)
+        self.assertIsInstance(analyses[1], dict)
+        self.assertIn("missing_information", analyses[1])
+        self.assertEqual([item["parsed"] for item in stats["items"]], [True, False])
+
+
+SECTION_REPLIES = [
+    '{"medication_review": {"alignment_score": 90, "rationale": "fits"}}',
+    '{"test_validation": [{"test": "CBC", "relevance_score": 70, "rationale": "ok"}]}',
+    '```json\n{"lifestyle_recommendations": {"food": "bland"}}\n```',
+    '{"additional_notes": "none", "safety_notice": "see a doctor"}',
+]
+NOTE = {"subjective": {"chief_complaint": "Cough"}, "objective": {}, "assessment": "Cold"}
+PLAN = {"medications": ["Honey"], "lab_tests": ["CBC"], "follow_up": "1 week"}
+
+
+class TestDecomposedAnalysis(unittest.TestCase):
+    def test_sections_share_one_forward_pass(self):
+        pipe = FakePipe(SECTION_REPLIES)
+        analysis = PlanAnalyzer(pipe, decomposed=True).analyze(NOTE, PLAN)
+
+        self.assertEqual(len(pipe.calls), 1)
+        self.assertEqual(pipe.calls[0]["batch_size"], 4)
+        self.assertEqual(pipe.calls[0]["max_new_tokens"], 384)
+        # The SOAP note is assembled locally, not generated
+        self.assertEqual(analysis["soap_note"], dict(NOTE, plan=PLAN))
+        self.assertEqual(analysis["medication_review"]["alignment_score"], 90)
+        self.assertEqual(analysis["test_validation"][0]["test"], "CBC")
+        self.assertEqual(analysis["lifestyle_recommendations"]["food"], "bland")
+        self.assertEqual(analysis["safety_notice"], "see a doctor")
+
+    def test_failed_section_falls_back_alone(self):
+        pipe = FakePipe(SECTION_REPLIES[:1] + ["{broken"] + SECTION_REPLIES[2:] + SECTION_REPLIES)
+        analyses, stats = PlanAnalyzer(pipe, decomposed=True).analyze_batch([NOTE, NOTE], [PLAN, PLAN])
+
+        self.assertEqual(analyses[0]["test_validation"], [])
+        self.assertEqual(analyses[0]["medication_review"]["alignment_score"], 90)
+        self.assertEqual(analyses[1]["test_validation"][0]["test"], "CBC")
+        self.assertEqual([item["parsed"] for item in stats["items"]], [False, True])
+        self.assertEqual(stats["items"][0]["sections"], 4)
+
+    def test_stream_starts_with_the_soap_note(self):
+        pipe = FakePipe(SECTION_REPLIES)
+        *partials, analysis = PlanAnalyzer(pipe, decomposed=True).analyze_stream(NOTE, PLAN)
+        self.assertEqual(list(partials[0]), ["soap_note"])
+        self.assertEqual(analysis, PlanAnalyzer(FakePipe(SECTION_REPLIES), decomposed=True).analyze(NOTE, PLAN))
+
+
+class ChunkedFakePipe(FakePipe):
+    """FakePipe that also streams each reply a few characters at a time."""
+
+    def stream(self, text, max_new_tokens, **kwargs):
+        self.calls.append({"text": text, "max_new_tokens": max_new_tokens, "stream": True, **kwargs})
+        reply = self.replies.pop(0)
+        for i in range(0, len(reply), 5):
+            yield reply[i:i + 5]
+
+
+FULL_REPLY = "```json\n" + json.dumps({
+    "soap_note": dict(NOTE, plan=PLAN),
+    "medication_review": {"alignment_score": 90, "rationale": "fits"},
+    "test_validation": [{"test": "CBC", "relevance_score": 70, "rationale": "ok"}],
+    "lifestyle_recommendations": {"food": "bland"},
+    "additional_notes": "none",
+    "safety_notice": "see a doctor",
+}) + "\n```\nLet me know if you need anything else."
+
+
+class TestFullAnalysisStream(unittest.TestCase):
+    def test_sections_stream_in_order_then_the_final_analysis(self):
+        pipe = ChunkedFakePipe([FULL_REPLY])
+        *partials, analysis = PlanAnalyzer(pipe).analyze_stream(NOTE, PLAN)
+
+        self.assertEqual(len(pipe.calls), 1)
+        self.assertTrue(pipe.calls[0]["stream"])
+        # One partial per completed top-level section, each extending the previous one
+        self.assertEqual([list(p) for p in partials], [
+            ["soap_note"],
+            ["soap_note", "medication_review"],
+            ["soap_note", "medication_review", "test_validation"],
+            ["soap_note", "medication_review", "test_validation", "lifestyle_recommendations"],
+            ["soap_note", "medication_review", "test_validation", "lifestyle_recommendations", "additional_notes"],
+            ["soap_note", "medication_review", "test_validation", "lifestyle_recommendations", "additional_notes",
+             "safety_notice"],
+        ])
+        self.assertEqual(partials[1]["medication_review"]["alignment_score"], 90)
+        self.assertEqual(analysis, PlanAnalyzer(FakePipe([FULL_REPLY])).analyze(NOTE, PLAN))
+
+    def test_cut_off_stream_completes_the_missing_sections(self):
+        cut = FULL_REPLY[:FULL_REPLY.index('"lifestyle_recommendations"') + 10]
+        pipe = ChunkedFakePipe([cut, '{"lifestyle_recommendations": {"food": "bland"}}',
+                                '{"additional_notes": "none", "safety_notice": "see a doctor"}'])
+        *partials, analysis = PlanAnalyzer(pipe).analyze_stream(NOTE, PLAN)
+
+        self.assertEqual(list(partials[-1]), ["soap_note", "medication_review", "test_validation"])
+        self.assertEqual(analysis["test_validation"][0]["test"], "CBC")
+        self.assertEqual(analysis["lifestyle_recommendations"]["food"], "bland")
+        self.assertEqual(analysis["safety_notice"], "see a doctor")
+
+
+NARRATIVE_REPLY = json.dumps({
+    "history_of_present_illness": "Two weeks of cough.",
+    "review_of_systems": "Respiratory: cough.",
+    "assessment": "Likely viral.",
+    "safety_notice": "Return if breathless.",
+})
+INTAKE = {"age": 30, "symptoms": ["Cough"], "vitals": {"blood_pressure": "120/80", "heart_rate": "70"}}
+
+
+class TestPrestructuredGeneration(unittest.TestCase):
+    def test_model_only_writes_the_narrative(self):
+        pipe = FakePipe([NARRATIVE_REPLY])
+        agent = SoapNoteGenerator(pipe, prestructured=True)
+        note = agent.generate(INTAKE)
+
+        self.assertEqual(pipe.calls[0]["max_new_tokens"], 400)
+        self.assertEqual(note["subjective"]["chief_complaint"], "Cough")
+        self.assertEqual(note["subjective"]["history_of_present_illness"], "Two weeks of cough.")
+        self.assertEqual(note["objective"]["vital_signs"]["blood_pressure"], "120/80 mmHg")
+        self.assertEqual(note["vitals"]["heart_rate"]["value"], 70)
+        self.assertEqual(note["assessment"], "Likely viral.")
+        self.assertIn("Temperature", note["missing_information"])
+        # The prompt carries the parsed facts, not the raw intake form
+        prompt = pipe.calls[0]["text"][1]["content"][0]["text"]
+        self.assertIn("120/80 mmHg", prompt)
+        self.assertNotIn("imaging_findings", prompt)
+
+    def test_unparsed_narrative_keeps_the_structured_fields(self):
+        agent = SoapNoteGenerator(FakePipe(["not json"]), prestructured=True)
+        notes, stats = agent.generate_batch([INTAKE])
+        self.assertFalse(stats["items"][0]["parsed"])
+        self.assertEqual(notes[0]["objective"]["vital_signs"]["heart_rate"], "70 bpm")
+        self.assertEqual(notes[0]["assessment"], "")
+
+
+
+class TestSalvagedReplies(unittest.TestCase):
+    def test_agent2_regenerates_only_missing_sections(self):
+        cut = json.dumps({"medication_review": {"alignment_score": 80, "rationale": "fits"},
+                          "test_validation": [], "lifestyle_recommendations": {"food": "bland"}})[:-20]
+        pipe = FakePipe([cut, SECTION_REPLIES[2], SECTION_REPLIES[3]])
+        analysis = PlanAnalyzer(pipe).analyze(NOTE, PLAN)
+
+        self.assertEqual(len(pipe.calls), 2)
+        # lifestyle_recommendations was cut off; the notes section was never reached
+        self.assertEqual(len(pipe.calls[1]["text"]), 2)
+        self.assertEqual(analysis["medication_review"]["alignment_score"], 80)
+        self.assertEqual(analysis["test_validation"], [])
+        self.assertEqual(analysis["lifestyle_recommendations"], {"food": "bland"})
+        self.assertEqual(analysis["safety_notice"], "see a doctor")
+        self.assertEqual(analysis["soap_note"], dict(NOTE, plan=PLAN))
+
+    def test_agent1_regenerates_only_missing_keys(self):
+        cut = '{"S": {"chief_complaint": "Cough"}, "O": {"vital_signs": {}}, "A": "Cold", "missing_infor'
+        pipe = FakePipe([cut, '{"missing_information": ["Temperature"], "safety_notice": "Rest"}'])
+        notes, stats = SoapNoteGenerator(pipe).generate_batch([INTAKE])
+
+        prompt = pipe.calls[1]["text"][0][1]["content"][0]["text"]
+        self.assertIn("only these keys: missing_information, safety_notice", prompt)
+        self.assertEqual(notes[0]["subjective"], {"chief_complaint": "Cough"})
+        self.assertEqual(notes[0]["missing_information"], ["Temperature"])
+        self.assertTrue(stats["items"][0]["parsed"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+import sys
+import os
+import json
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.batch import BatchRunner
+
+AGENT1_REPLY = json.dumps({"subjective": {"chief_complaint": "Fatigue"}, "objective": {}, "assessment": "Stable"})
+AGENT2_REPLY = json.dumps({"soap_note": {"subjective": {}, "objective": {}, "assessment": "Stable", "plan": "Rest"},
+                           "medication_review": {"alignment_score": 90, "rationale": "ok"}})
+
+
+class AgentAwarePipe:
+    """Answers Agent 1 and Agent 2 prompts with fixed replies, in any batch shape."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _reply(self, messages):
+        system = messages[0]["content"][0]["text"]
+        text = AGENT2_REPLY if "Agent 2" in system else AGENT1_REPLY
+        return [{"generated_text": messages + [{"role": "assistant", "content": text}]}]
+
+    def __call__(self, text, max_new_tokens, **kwargs):
+        self.calls += 1
+        return [self._reply(m) for m in text] if isinstance(text[0], list) else self._reply(text)
+
+
+def write_cases(path, ids):
+    with open(path, "w") as f:
+        for case_id in ids:
+            f.write(json.dumps({
+                "id": case_id,
+                "patient_info": {"patient_name": f"Patient {case_id}", "age": 40},
+                "doctor_plan": {"medications": ["Rest"]},
+            }) + "\n")
+
+
+class TestBatchRunner(unittest.TestCase):
+    def test_runs_all_stages_and_resumes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cases = os.path.join(tmp, "cases.jsonl")
+            output = os.path.join(tmp, "out.jsonl")
+            pdf_dir = os.path.join(tmp, "pdfs")
+            write_cases(cases, [f"c{i}" for i in range(5)])
+
+            runner = BatchRunner(AgentAwarePipe(), pdf_dir=pdf_dir, batch_size=2, queue_size=2, pdf_workers=0)
+            summary = runner.run(cases, output)
+            self.assertEqual(summary["written"], 5)
+
+            with open(output) as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual(sorted(r["id"] for r in rows), [f"c{i}" for i in range(5)])
+            self.assertTrue(all(r["error"] is None and os.path.exists(r["pdf"]) for r in rows))
+            self.assertEqual(rows[0]["final_output"]["medication_review"]["alignment_score"], 90)
+
+            # A rerun with two new cases only processes those
+            write_cases(cases, [f"c{i}" for i in range(7)])
+            pipe = AgentAwarePipe()
+            summary = BatchRunner(pipe, batch_size=8, pdf_workers=0).run(cases, output)
+            self.assertEqual(summary["written"], 2)
+            self.assertEqual(pipe.calls, 2)
+
+    def test_malformed_input_line_is_an_error_result(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cases = os.path.join(tmp, "cases.jsonl")
+            output = os.path.join(tmp, "out.jsonl")
+            write_cases(cases, ["a"])
+            with open(cases, "a") as f:
+                f.write('{"id": "b", "patient_info": \n[1, 2]\n')
+            write_cases(os.path.join(tmp, "more.jsonl"), ["c"])
+            with open(cases, "a") as f, open(os.path.join(tmp, "more.jsonl")) as more:
+                f.write(more.read())
+
+            summary = BatchRunner(AgentAwarePipe(), pdf_workers=0).run(cases, output)
+            self.assertEqual((summary["written"], summary["failed"]), (4, 2))
+            with open(output) as f:
+                rows = {row["id"]: row for row in map(json.loads, f)}
+            self.assertIsNone(rows["a"]["error"])
+            self.assertIsNone(rows["c"]["error"])
+            self.assertIn("line 2", rows["line-2"]["error"])
+            self.assertIn("expected an object", rows["line-3"]["error"])
+
+    def test_bad_record_does_not_fail_its_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cases = os.path.join(tmp, "cases.jsonl")
+            output = os.path.join(tmp, "out.jsonl")
+            write_cases(cases, ["a"])
+            with open(cases, "a") as f:
+                f.write(json.dumps({"id": "no-info", "doctor_plan": {}}) + "\n")
+                f.write(json.dumps({"id": "no-image", "patient_info": {}, "images": [os.path.join(tmp, "missing.png")]}) + "\n")
+                f.write(json.dumps({"id": "b", "patient_info": {"age": 50}}) + "\n")
+
+            summary = BatchRunner(AgentAwarePipe(), batch_size=8, pdf_workers=0).run(cases, output)
+            self.assertEqual((summary["written"], summary["failed"]), (4, 2))
+            with open(output) as f:
+                rows = {row["id"]: row for row in map(json.loads, f)}
+            self.assertIsNone(rows["a"]["error"])
+            self.assertIsNone(rows["b"]["error"])
+            self.assertIn("patient_info", rows["no-info"]["error"])
+            self.assertIn("missing.png", rows["no-image"]["error"])
+
+    def test_non_object_analysis_fails_only_its_case(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cases = os.path.join(tmp, "cases.jsonl")
+            output = os.path.join(tmp, "out.jsonl")
+            write_cases(cases, ["a", "b", "c"])
+
+            runner = BatchRunner(AgentAwarePipe(), pdf_dir=os.path.join(tmp, "pdfs"), batch_size=8, pdf_workers=0)
+            real = runner.agent2.analyze_batch
+
+            def analyze_batch(*args, **kwargs):
+                analyses, stats = real(*args, **kwargs)
+                analyses[1] = ["cannot comply"]
+                return analyses, stats
+
+            with mock.patch.object(runner.agent2, "analyze_batch", analyze_batch):
+                summary = runner.run(cases, output)
+            self.assertEqual((summary["written"], summary["failed"]), (3, 1))
+            with open(output) as f:
+                rows = {row["id"]: row for row in map(json.loads, f)}
+            self.assertTrue(os.path.exists(rows["a"]["pdf"]))
+            self.assertTrue(os.path.exists(rows["c"]["pdf"]))
+            self.assertIn("expected an object", rows["b"]["error"])
+
+    def test_resume_after_a_torn_output_line(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cases = os.path.join(tmp, "cases.jsonl")
+            output = os.path.join(tmp, "out.jsonl")
+            write_cases(cases, ["a", "b"])
+            BatchRunner(AgentAwarePipe(), pdf_workers=0).run(cases, output)
+            # Killed while writing the next result
+            with open(output, "a") as f:
+                f.write('{"id": "c", "soap_no')
+
+            write_cases(cases, ["a", "b", "c"])
+            BatchRunner(AgentAwarePipe(), pdf_workers=0).run(cases, output)
+            with open(output) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[2], '{"id": "c", "soap_no')
+            self.assertEqual(json.loads(lines[3])["id"], "c")
+
+    def test_pdf_process_pool(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cases = os.path.join(tmp, "cases.jsonl")
+            output = os.path.join(tmp, "out.jsonl")
+            write_cases(cases, ["a", "b", "c"])
+
+            runner = BatchRunner(AgentAwarePipe(), pdf_dir=os.path.join(tmp, "pdfs"), queue_size=2, pdf_workers=1)
+            self.assertEqual(runner.run(cases, output)["written"], 3)
+            with open(output) as f:
+                self.assertTrue(all(os.path.exists(json.loads(line)["pdf"]) for line in f))
+
+    def test_pdf_archive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cases = os.path.join(tmp, "cases.jsonl")
+            output = os.path.join(tmp, "out.jsonl")
+            archive = os.path.join(tmp, "pdfs.tar")
+            write_cases(cases, ["a", "b"])
+            BatchRunner(AgentAwarePipe(), pdf_archive=archive, pdf_workers=1).run(cases, output)
+
+            # A resumed run appends to the same archive
+            write_cases(cases, ["a", "b", "c"])
+            BatchRunner(AgentAwarePipe(), pdf_archive=archive, pdf_workers=0).run(cases, output)
+
+            with open(output) as f:
+                self.assertEqual([json.loads(line)["pdf"] for line in f][-1], f"{archive}:soap_note_c.pdf")
+            with tarfile.open(archive) as tar:
+                self.assertEqual(sorted(tar.getnames()), ["soap_note_a.pdf", "soap_note_b.pdf", "soap_note_c.pdf"])
+                self.assertTrue(tar.extractfile("soap_note_c.pdf").read().startswith(b"%PDF"))
+
+    def test_pdf_archive_resumes_after_a_crash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cases = os.path.join(tmp, "cases.jsonl")
+            output = os.path.join(tmp, "out.jsonl")
+            archive = os.path.join(tmp, "pdfs.tar")
+            write_cases(cases, ["a", "b"])
+            # Killed before the archive was closed: no end-of-archive blocks
+            with mock.patch.object(tarfile.TarFile, "close", lambda tar: None):
+                BatchRunner(AgentAwarePipe(), pdf_archive=archive, pdf_workers=0).run(cases, output)
+            # ... and a PDF whose member was only partly written
+            torn = tarfile.TarInfo("soap_note_x.pdf")
+            torn.size = 5000
+            with open(archive, "ab") as f:
+                f.write(torn.tobuf() + b"%PDF" * 100)
+
+            write_cases(cases, ["a", "b", "c"])
+            summary = BatchRunner(AgentAwarePipe(), pdf_archive=archive, pdf_workers=0).run(cases, output)
+            self.assertEqual(summary["written"], 1)
+            with tarfile.open(archive) as tar:
+                self.assertEqual(tar.getnames(), ["soap_note_a.pdf", "soap_note_b.pdf", "soap_note_c.pdf"])
+                for name in tar.getnames():
+                    self.assertTrue(tar.extractfile(name).read().startswith(b"%PDF"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import sys
+import os
+import json
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+
+# Add src and benchmarks to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../benchmarks'))
+
+import bench_suite
+
+
+def result(seconds):
+    return {"median_s": seconds, "min_s": seconds, "rounds": 5, "number": 1}
+
+
+class TestRegressionCheck(unittest.TestCase):
+    BASELINE = {"cases": {name: result(1.0) for name in ("normalize_soap", "pdf_large", "agent1_prompt")}}
+
+    def test_slower_cases_are_flagged_against_their_threshold(self):
+        results = {
+            "normalize_soap": result(1.2),
+            # Over the default 25%, within this case's own 30%
+            "pdf_large": result(1.28),
+            "agent1_prompt": result(1.3),
+            "agent2_prompt": result(9.0),
+        }
+        rows = {row[0]: row[1:] for row in bench_suite.compare(results, self.BASELINE)}
+        self.assertFalse(rows["normalize_soap"][3])
+        self.assertEqual(rows["pdf_large"][2:], (30, False))
+        base, change, limit, regressed = rows["agent1_prompt"]
+        self.assertEqual((base, limit, regressed), (1.0, bench_suite.DEFAULT_THRESHOLD, True))
+        self.assertAlmostEqual(change, 30.0)
+        # Not in the baseline yet
+        self.assertEqual(rows["agent2_prompt"], (None, None, 25, False))
+
+    def test_threshold_overrides_every_case(self):
+        rows = bench_suite.compare({"normalize_soap": result(1.2), "pdf_large": result(0.5)}, self.BASELINE, 10)
+        self.assertEqual([row[4] for row in rows], [True, False])
+
+    def test_run_fails_on_a_regression(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "baseline.json")
+            with open(path, "w") as f:
+                json.dump({"machine": bench_suite.machine(), "cases": {"normalize_soap": result(1e-9)}}, f)
+            argv = ["bench_suite.py", "--baseline", path, "--cases", "^normalize_soap$", "--rounds", "1"]
+            with mock.patch.object(sys, "argv", argv), contextlib.redirect_stdout(io.StringIO()) as out, \
+                    self.assertRaises(SystemExit) as exit:
+                bench_suite.main()
+        self.assertEqual(exit.exception.code, 1)
+        self.assertIn("normalize_soap", out.getvalue().splitlines()[-1])
+
+    def test_slow_run_is_measured_again(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "baseline.json")
+            with open(path, "w") as f:
+                json.dump({"machine": bench_suite.machine(), "cases": {"normalize_soap": result(1.0)}}, f)
+            argv = ["bench_suite.py", "--baseline", path, "--cases", "^normalize_soap$"]
+            # One disturbed attempt, then a normal one
+            attempts = [dict(result(2.0), timings=[2.0]), dict(result(1.1), timings=[2.0, 1.1])]
+            with mock.patch.object(sys, "argv", argv), contextlib.redirect_stdout(io.StringIO()) as out, \
+                    mock.patch.object(bench_suite, "measure", side_effect=attempts) as measure:
+                bench_suite.main()
+        self.assertEqual(measure.call_count, 2)
+        self.assertEqual(measure.call_args.args[3], [2.0])
+        self.assertNotIn("REGRESSED", out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import sys
+import os
+import json
+import tempfile
+import subprocess
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.cli import main
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+
+
+class TestCli(unittest.TestCase):
+    def test_pdf_and_graph_commands(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            final_output = os.path.join(tmp, "agent2.json")
+            with open(final_output, "w") as f:
+                json.dump({"soap_note": {"assessment": "Stable", "plan": "Rest"}, "safety_notice": "None"}, f)
+
+            pdf = os.path.join(tmp, "note.pdf")
+            main(["pdf", final_output, "--output", pdf, "--patient-id", "P-1"])
+            with open(pdf, "rb") as f:
+                self.assertTrue(f.read().startswith(b"%PDF"))
+
+            graph = os.path.join(tmp, "graph.html")
+            main(["graph", "--input", final_output, "--soap-only", "--output", graph])
+            with open(graph) as f:
+                self.assertIn('"assessment": "Stable"', f.read())
+
+    def test_startup_does_not_import_model_or_ui_stack(self):
+        probe = (
+            "import sys; from medflow.cli import build_parser; build_parser(); "
+            "import medflow.main, medflow.batch, medflow.app_pro, medflow.app_simulation; "
+            "print([m for m in ('torch', 'transformers', 'gradio') if m in sys.modules])"
+        )
+        out = subprocess.run([sys.executable, "-c", probe], env=dict(os.environ, PYTHONPATH=SRC),
+                             capture_output=True, text=True, check=True, cwd=tempfile.gettempdir())
+        self.assertEqual(out.stdout.strip().splitlines()[-1], "[]")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import sys
+import os
+import json
+import importlib.util
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.agents.agent2 import PlanAnalyzer
+from medflow.utils.generation import extract_generated_text
+from medflow.utils.schemas import SOAP_PARTIAL_SCHEMA, PLAN_ANALYSIS_SCHEMA
+
+HAS_STACK = all(importlib.util.find_spec(m) for m in ("torch", "transformers", "lmformatenforcer"))
+
+
+def schema_keys(schema):
+    return set(schema["properties"])
+
+
+@unittest.skipUnless(HAS_STACK, "requires torch, transformers and lm-format-enforcer")
+class TestConstrainedDecoding(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from tiny_model import TinyChatPipe
+        cls.pipe = TinyChatPipe()
+
+    def test_unconstrained_tiny_model_output_does_not_parse(self):
+        agent = SoapNoteGenerator(self.pipe)
+        messages = agent._build_messages({"age": 45})
+        text = extract_generated_text(self.pipe(text=messages, max_new_tokens=40))
+        _, parsed = agent._parse(text)
+        self.assertFalse(parsed)
+
+    def test_agent1_output_matches_schema(self):
+        agent = SoapNoteGenerator(self.pipe, constrained=True)
+        notes, stats = agent.generate_batch([{"age": 45}, {"age": 30, "symptoms": ["Fever"]}])
+
+        self.assertTrue(all(item["parsed"] for item in stats["items"]))
+        for note in notes:
+            self.assertEqual(set(note["subjective"]), schema_keys(SOAP_PARTIAL_SCHEMA["properties"]["subjective"]))
+            self.assertIn("vital_signs", note["objective"])
+
+    def test_prestructured_agent1_narrative_parses(self):
+        agent = SoapNoteGenerator(self.pipe, constrained=True, prestructured=True)
+        notes, stats = agent.generate_batch([{"age": 45, "vitals": {"heart_rate": "92 bpm"}}])
+        self.assertTrue(stats["items"][0]["parsed"])
+        self.assertEqual(notes[0]["objective"]["vital_signs"]["heart_rate"], "92 bpm")
+
+    def test_agent2_output_matches_schema(self):
+        agent = PlanAnalyzer(self.pipe, constrained=True)
+        messages = agent._build_messages({"assessment": "a"}, {"medications": []})
+        text = extract_generated_text(self.pipe(text=messages, max_new_tokens=2000, **agent._generation_kwargs()))
+        self.assertEqual(set(json.loads(text)), schema_keys(PLAN_ANALYSIS_SCHEMA))
+
+    def test_decomposed_agent2_output_matches_schema(self):
+        agent = PlanAnalyzer(self.pipe, constrained=True, decomposed=True)
+        analyses, stats = agent.analyze_batch([{"assessment": "a"}], [{"medications": []}])
+        self.assertTrue(stats["items"][0]["parsed"])
+        self.assertEqual(set(analyses[0]), schema_keys(PLAN_ANALYSIS_SCHEMA))
+
+
+if __name__ == '__main__':
+    unittest.main()
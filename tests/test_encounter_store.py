@@ -0,0 +1,87 @@
+import sys
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.utils.encounter_store import EncounterStore
+
+NOTE = {"subjective": {"chief_complaint": "Cough " * 200}, "assessment": "Cold"}
+
+
+class TestEncounterStore(unittest.TestCase):
+    def test_put_and_get(self):
+        store = EncounterStore()
+        first, second = store.put({"soap_note": NOTE}), store.put({"soap_note": NOTE})
+        self.assertNotEqual(first, second)
+        self.assertEqual(store.get(first)["soap_note"], NOTE)
+        self.assertIsNone(store.get("unknown"))
+        self.assertIsNone(store.get(""))
+        store.delete(first)
+        self.assertIsNone(store.get(first))
+        self.assertEqual(len(store), 1)
+
+    def test_entries_expire_after_last_access(self):
+        store = EncounterStore(ttl=10)
+        with mock.patch("time.time", return_value=1000.0):
+            kept, dropped = store.put("kept"), store.put("dropped")
+        with mock.patch("time.time", return_value=1008.0):
+            self.assertEqual(store.get(kept), "kept")
+        with mock.patch("time.time", return_value=1012.0):
+            self.assertEqual(store.get(kept), "kept")
+            self.assertIsNone(store.get(dropped))
+        self.assertEqual(store.stats()["expired"], 1)
+
+    def test_memory_cap_without_spill_drops_oldest(self):
+        store = EncounterStore(max_bytes=3000)
+        ids = [store.put({"soap_note": NOTE}) for _ in range(4)]
+        self.assertIsNone(store.get(ids[0]))
+        self.assertIsNotNone(store.get(ids[-1]))
+        self.assertLessEqual(store.stats()["memory_bytes"], 3000)
+
+    def test_spill_to_disk_and_reload_after_restart(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            store = EncounterStore(max_bytes=3000, spill_dir=spill_dir)
+            ids = [store.put({"soap_note": NOTE, "n": n}) for n in range(4)]
+            self.assertGreater(store.stats()["spilled_entries"], 0)
+            self.assertEqual([store.get(i)["n"] for i in ids], [0, 1, 2, 3])
+
+            restarted = EncounterStore(max_bytes=3000, spill_dir=spill_dir)
+            spilled = [i for i in ids if i in restarted._spilled]
+            self.assertTrue(spilled)
+            self.assertEqual(restarted.get(spilled[0])["soap_note"], NOTE)
+            # Loading an entry back removes its file
+            self.assertNotIn(f"{spilled[0]}.pkl", os.listdir(spill_dir))
+
+    def test_spilled_entries_expire(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            store = EncounterStore(ttl=10, max_bytes=3000, spill_dir=spill_dir)
+            with mock.patch("time.time", return_value=time.time()):
+                ids = [store.put({"soap_note": NOTE}) for _ in range(4)]
+            with mock.patch("time.time", return_value=time.time() + 20):
+                self.assertIsNone(store.get(ids[0]))
+            self.assertEqual(os.listdir(spill_dir), [])
+
+
+class TestSimulationHandoff(unittest.TestCase):
+    def test_step2_receives_only_the_encounter_id(self):
+        from medflow import app_simulation
+
+        with tempfile.TemporaryDirectory() as pdf_dir, mock.patch.object(app_simulation, "PDF_DIR", pdf_dir):
+            note, encounter_id = app_simulation.simulate_agent1(
+                "Jane Smith", "P-1", 30, "Female", "Sore throat", "3 days", "Mild", "None", "", "120/80", "72", None)
+            self.assertIsInstance(encounter_id, str)
+            self.assertLess(len(encounter_id), 32)
+            output, pdf = app_simulation.simulate_agent2(encounter_id, "Honey", "CBC", "1 week", "South Asian")
+            self.assertEqual(output["soap_note"]["assessment"], note["assessment"])
+            self.assertTrue(os.path.exists(pdf))
+            output, pdf = app_simulation.simulate_agent2("expired", "Honey", "CBC", "1 week", "South Asian")
+            self.assertIn("error", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import sys
+import os
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.utils.intake import prestructure, parse_vital, format_vital
+
+PATIENT = {
+    "age": 45,
+    "gender": "Male",
+    "symptoms": ["Chest discomfort", "Fatigue"],
+    "duration": "2 weeks",
+    "severity": "Moderate",
+    "medical_history": ["Hypertension"],
+    "medications": [],
+    "vitals": {"blood_pressure": "145/90", "heart_rate": "92 bpm", "temp": "37.2"},
+}
+
+
+class TestParseVital(unittest.TestCase):
+    def test_typed_values(self):
+        self.assertEqual(parse_vital("blood_pressure", "145 / 90 mmHg"),
+                         {"systolic": 145, "diastolic": 90, "unit": "mmHg"})
+        self.assertEqual(parse_vital("heart_rate", "92 bpm"), {"value": 92, "unit": "bpm"})
+        self.assertEqual(parse_vital("heart_rate", 88), {"value": 88, "unit": "bpm"})
+        self.assertEqual(parse_vital("temperature", "98.6 F"), {"value": 98.6, "unit": "F"})
+        self.assertEqual(parse_vital("temperature", "37.2"), {"value": 37.2, "unit": "C"})
+        self.assertEqual(format_vital("oxygen_saturation", parse_vital("oxygen_saturation", "97 %")), "97%")
+
+    def test_unreadable_values(self):
+        self.assertIsNone(parse_vital("blood_pressure", "high"))
+        self.assertIsNone(parse_vital("heart_rate", "fast"))
+
+
+class TestPrestructure(unittest.TestCase):
+    def test_fills_mechanical_fields(self):
+        intake = prestructure(PATIENT)
+        self.assertEqual(intake["subjective"]["chief_complaint"], "Chest discomfort")
+        self.assertEqual(intake["subjective"]["past_medical_history"], "Hypertension")
+        self.assertEqual(intake["objective"]["vital_signs"]["blood_pressure"], "145/90 mmHg")
+        self.assertEqual(intake["objective"]["vital_signs"]["temperature"], "37.2 C")
+        self.assertEqual(intake["objective"]["vital_signs"]["respiratory_rate"], "Missing")
+        self.assertEqual(intake["vitals"]["heart_rate"], {"value": 92, "unit": "bpm"})
+        # Not asked is not the same as none taken
+        self.assertEqual(intake["facts"]["medications"], "Missing")
+        self.assertIn("Medications", intake["missing_information"])
+        self.assertNotIn("Past medical history", intake["missing_information"])
+
+    def test_missing_information(self):
+        intake = prestructure(dict(PATIENT, severity="", vitals={"heart_rate": "fast"}))
+        missing = intake["missing_information"]
+        for label in ("Symptom severity", "Allergies", "Blood pressure", "Respiratory rate", "Oxygen saturation"):
+            self.assertIn(label, missing)
+        self.assertIn("Heart rate (could not read 'fast')", missing)
+        self.assertNotIn("Age", missing)
+
+    def test_comma_separated_text(self):
+        intake = prestructure({"symptoms": "Cough, Fever ", "medications": "Aspirin"})
+        self.assertEqual(intake["subjective"]["chief_complaint"], "Cough")
+        self.assertEqual(intake["subjective"]["medications"], ["Aspirin"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import sys
+import os
+import json
+import random
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.utils.json_repair import salvage_object
+
+REPLY = {
+    "medication_review": {"alignment_score": 80, "rationale": "Omeprazole fits \"epigastric\" pain"},
+    "test_validation": [{"test": "CBC", "relevance_score": 70, "rationale": "Anemia screen"}],
+    "lifestyle_recommendations": {"food": "Small meals", "exercise": "Walking"},
+    "additional_notes": None,
+    "safety_notice": "Seek care if symptoms worsen.",
+}
+
+
+class TestSalvageObject(unittest.TestCase):
+    def test_valid_reply_is_untouched(self):
+        salvaged = salvage_object("```json\n" + json.dumps(REPLY) + "\n```\nHope this helps!", expected=list(REPLY))
+        self.assertEqual(salvaged.data, REPLY)
+        self.assertEqual(salvaged.missing, [])
+        self.assertFalse(salvaged.repaired)
+
+    def test_syntax_slips(self):
+        text = """{'a': 'it\\'s', "b": [1, 2,], c: True "d": None, "e": "two
+lines",}"""
+        salvaged = salvage_object(text)
+        self.assertEqual(salvaged.data, {"a": "it's", "b": [1, 2], "c": True, "d": None, "e": "two\nlines"})
+        self.assertTrue(salvaged.repaired)
+
+    def test_truncated_member_is_reported_missing(self):
+        text = '{"a": {"x": 1}, "b": [1, 2], "c": {"y": "unfini'
+        salvaged = salvage_object(text, expected=["a", "b", "c", "d"])
+        self.assertEqual(salvaged.data, {"a": {"x": 1}, "b": [1, 2]})
+        self.assertEqual(salvaged.missing, ["c", "d"])
+
+    def test_trailing_number_may_be_cut_short(self):
+        self.assertEqual(salvage_object('{"a": "x", "b": 12').data, {"a": "x"})
+        self.assertEqual(salvage_object('{"a": "x", "b": true').data, {"a": "x", "b": True})
+
+    def test_broken_member_is_dropped_alone(self):
+        salvaged = salvage_object('{"a": 1, "b": {"x": @@ unknown}, "c": 3}')
+        self.assertEqual(salvaged.data, {"a": 1, "c": 3})
+        self.assertEqual(salvaged.missing, ["b"])
+
+    def test_no_object(self):
+        salvaged = salvage_object("I cannot help with that.", expected=["a"])
+        self.assertEqual(salvaged.data, {})
+        self.assertEqual(salvaged.missing, ["a"])
+
+    def test_fuzzed_truncations(self):
+        # Whatever the cut, kept keys hold their true value and every other key is missing
+        text = json.dumps(REPLY, indent=2)
+        rng = random.Random(0)
+        for cut in rng.sample(range(1, len(text)), 200):
+            salvaged = salvage_object(text[:cut], expected=list(REPLY))
+            for key, value in salvaged.data.items():
+                self.assertEqual(value, REPLY[key], text[:cut])
+            self.assertEqual(set(salvaged.data) | set(salvaged.missing), set(REPLY))
+
+    def test_fuzzed_edits_never_raise(self):
+        text = json.dumps(REPLY)
+        rng = random.Random(1)
+        for _ in range(300):
+            chars = list(text)
+            for _ in range(4):
+                chars.insert(rng.randrange(len(chars)), rng.choice('{}[],:"\'\\ x\n'))
+            salvage_object("".join(chars), expected=list(REPLY))
+
+    def test_large_reply(self):
+        members = ",".join(f'"k{i}": {{"v": [{i}, "s"], "f": False}}' for i in range(20000))
+        salvaged = salvage_object("{" + members + ', "cut": {"v": [1')
+        self.assertEqual(len(salvaged.data), 20000)
+        self.assertEqual(salvaged.missing, ["cut"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import sys
+import os
+import json
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.utils.json_stream import IncrementalJSONParser, extract_json_object
+from test_agents import FakePipe, NARRATIVE_REPLY, INTAKE
+
+
+class StreamingFakePipe(FakePipe):
+    """Streams each canned reply a few characters at a time."""
+
+    def stream(self, text, max_new_tokens, **kwargs):
+        self.calls.append({"text": text, "max_new_tokens": max_new_tokens, **kwargs})
+        reply = self.replies.pop(0)
+        for i in range(0, len(reply), 3):
+            yield reply[i:i + 3]
+
+
+class TestIncrementalJSONParser(unittest.TestCase):
+    def test_fields_complete_in_order(self):
+        text = '```json\n{"subjective": {"cc": "pain, \\"sharp\\" {x}"}, "objective": [1, 2], "assessment": "ok"}\n```'
+        parser = IncrementalJSONParser()
+        seen = []
+        for ch in text:
+            seen.extend(parser.feed(ch).keys())
+        self.assertEqual(seen, ["subjective", "objective", "assessment"])
+        self.assertTrue(parser.done)
+        self.assertEqual(json.loads(text[parser.text.index("{"):parser.end]), parser.fields)
+
+
+class TestExtractJSONObject(unittest.TestCase):
+    def test_drops_fences_and_trailing_chatter(self):
+        text = 'Sure!\n```json\n{"a": "}", "b": [1, {"c": 2}]}\n```\n**Explanation:** {not json}'
+        self.assertEqual(json.loads(extract_json_object(text)), {"a": "}", "b": [1, {"c": 2}]})
+
+    def test_unterminated_and_missing_object(self):
+        self.assertEqual(extract_json_object('```json\n{"a": 1,'), '{"a": 1,')
+        self.assertEqual(extract_json_object("  no json here "), "no json here")
+
+
+class TestAgentStreaming(unittest.TestCase):
+    def test_generate_stream_yields_partials_then_final(self):
+        reply = json.dumps({"S": "s", "O": "o", "A": "a", "safety_notice": "n"}) + "\nHope this helps!"
+        agent = SoapNoteGenerator(StreamingFakePipe([reply]))
+        updates = list(agent.generate_stream({"age": 45}))
+
+        self.assertEqual(updates[0], {"subjective": "s"})
+        self.assertEqual(updates[-1]["assessment"], "a")
+        self.assertEqual(updates[-1]["safety_notice"], "n")
+
+    def test_prestructured_stream_yields_structured_fields_first(self):
+        agent = SoapNoteGenerator(StreamingFakePipe([NARRATIVE_REPLY]), prestructured=True)
+        first, *_, note = agent.generate_stream(INTAKE)
+        self.assertEqual(set(first), {"subjective", "objective", "missing_information", "vitals"})
+        self.assertEqual(note, SoapNoteGenerator(FakePipe([NARRATIVE_REPLY]), prestructured=True).generate(INTAKE))
+
+
+if __name__ == '__main__':
+    unittest.main()
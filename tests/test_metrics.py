@@ -0,0 +1,130 @@
+import sys
+import os
+import re
+import unittest
+import urllib.request
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.utils.metrics import DESCRIPTIONS, Metrics, METRICS, serve_metrics, timed_generate_kwargs, record_agent_call
+from medflow.agents.agent1 import SoapNoteGenerator
+from test_agents import ChunkedFakePipe, FakePipe, SOA_REPLY
+
+
+class TestMetrics(unittest.TestCase):
+    def test_disabled_records_nothing(self):
+        metrics = Metrics()
+        metrics.inc("medflow_agent_calls_total", agent="agent1")
+        with metrics.stage("pdf_build"):
+            pass
+        self.assertEqual(metrics.render(), "\n")
+        self.assertIsNone(timed_generate_kwargs(metrics, None))
+
+    def test_render_format(self):
+        metrics = Metrics(enabled=True)
+        metrics.inc("medflow_agent_calls_total", agent="agent1", mode="full")
+        metrics.inc("medflow_agent_calls_total", agent="agent1", mode="full")
+        metrics.set("medflow_queue_depth", 3, queue="scheduler")
+        metrics.observe("medflow_stage_seconds", 0.02, stage="pdf_build")
+        metrics.observe("medflow_stage_seconds", 7, stage="pdf_build")
+        text = metrics.render()
+
+        self.assertIn("# TYPE medflow_agent_calls_total counter", text)
+        self.assertIn('medflow_agent_calls_total{agent="agent1",mode="full"} 2', text)
+        self.assertIn('medflow_queue_depth{queue="scheduler"} 3', text)
+        self.assertIn('medflow_stage_seconds_bucket{stage="pdf_build",le="0.01"} 0', text)
+        self.assertIn('medflow_stage_seconds_bucket{stage="pdf_build",le="0.025"} 1', text)
+        self.assertIn('medflow_stage_seconds_bucket{stage="pdf_build",le="+Inf"} 2', text)
+        self.assertIn('medflow_stage_seconds_count{stage="pdf_build"} 2', text)
+        self.assertIn('medflow_stage_seconds_sum{stage="pdf_build"} 7.02', text)
+
+    def test_agent_calls(self):
+        metrics = Metrics(enabled=True)
+        record_agent_call(metrics, "agent2", "full",
+                          {"prompt_tokens": 100, "output_tokens": 50, "wall_time": 2.0, "parsed": False})
+        record_agent_call(metrics, "agent2", "full",
+                          {"prompt_tokens": None, "output_tokens": None, "wall_time": 1.0, "parsed": True})
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["medflow_agent_calls_total"][(("agent", "agent2"), ("mode", "full"))], 2)
+        self.assertEqual(counters["medflow_parse_failures_total"][(("agent", "agent2"), ("mode", "full"))], 1)
+        self.assertEqual(counters["medflow_output_tokens_total"][(("agent", "agent2"),)], 50)
+        rate = metrics.snapshot()["histograms"]["medflow_tokens_per_second"][(("agent", "agent2"),)]
+        self.assertEqual(rate, {"count": 1, "sum": 25.0})
+
+    def test_agents_report_to_shared_metrics(self):
+        METRICS.reset()
+        METRICS.enable()
+        try:
+            SoapNoteGenerator(FakePipe([SOA_REPLY, SOA_REPLY])).generate_batch([{"age": 1}, {"age": 2}])
+            snapshot = METRICS.snapshot()
+        finally:
+            METRICS.disable()
+            METRICS.reset()
+        calls = snapshot["counters"]["medflow_agent_calls_total"]
+        self.assertEqual(calls[(("agent", "agent1"), ("mode", "full"))], 2)
+        histograms = snapshot["histograms"]["medflow_stage_seconds"]
+        stages = {dict(key)["stage"] for key in histograms}
+        self.assertTrue({"prompt_build", "generate", "json_parse"} <= stages)
+
+    def test_app_times_the_first_streamed_field(self):
+        from unittest import mock
+        from medflow import app_pro
+
+        form = ("Jane", "P-1", 30, "Female", "Cough", "3 days", "Mild", "", "", "120/80", "70 bpm", None)
+        METRICS.reset()
+        METRICS.enable()
+        try:
+            generator = SoapNoteGenerator(ChunkedFakePipe([SOA_REPLY]))
+            with mock.patch.multiple(app_pro, generator=generator, prefetcher=None, _agents_loaded=True):
+                list(app_pro.run_step1(*form))
+            snapshot = METRICS.snapshot()
+        finally:
+            METRICS.disable()
+            METRICS.reset()
+        first_field = snapshot["histograms"]["medflow_stage_seconds"][(("stage", "first_field"), ("step", "step1"))]
+        self.assertEqual(first_field["count"], 1)
+
+    def test_prefill_and_decode_from_generate(self):
+        from tiny_model import TinyChatPipe
+
+        metrics = Metrics(enabled=True)
+        pipe = TinyChatPipe()
+        messages = [{"role": "user", "content": "hello"}]
+        # A batched call streams all of its rows together
+        pipe([messages, messages], max_new_tokens=8, generate_kwargs=timed_generate_kwargs(metrics, {}))
+        pipe(messages, max_new_tokens=8, generate_kwargs=timed_generate_kwargs(metrics, {}))
+        histograms = metrics.snapshot()["histograms"]
+        self.assertEqual(histograms["medflow_stage_seconds"][(("stage", "prefill"),)]["count"], 2)
+        self.assertEqual(histograms["medflow_stage_seconds"][(("stage", "decode"),)]["count"], 2)
+        self.assertEqual(histograms["medflow_decode_tokens_per_second"][()]["count"], 2)
+
+    def test_every_metric_is_described(self):
+        src = os.path.join(os.path.dirname(__file__), '../src')
+        names = set()
+        for root, _, files in os.walk(src):
+            for name in files:
+                if name.endswith(".py"):
+                    with open(os.path.join(root, name)) as f:
+                        names.update(re.findall(r'\.(?:inc|observe|set|stage)\(\s*"(medflow_\w+)"', f.read()))
+        self.assertIn("medflow_preempted_total", names)
+        self.assertEqual(sorted(names - set(DESCRIPTIONS)), [])
+
+    def test_metrics_endpoint(self):
+        metrics = Metrics()
+        server = serve_metrics(0, host="127.0.0.1", metrics=metrics)
+        try:
+            metrics.inc("medflow_parse_failures_total", agent="agent1")
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            with urllib.request.urlopen(url + "/metrics") as response:
+                body = response.read().decode()
+            self.assertIn('medflow_parse_failures_total{agent="agent1"} 1', body)
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + "/other")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import sys
+import os
+import json
+import time
+import threading
+import importlib.util
+import unittest
+from unittest import mock
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.serving import model_host
+from medflow.serving.model_host import ModelHost, memory_usage, core_sets
+from medflow.utils.generation import extract_generated_text
+from test_json_stream import StreamingFakePipe
+
+HAS_STACK = all(importlib.util.find_spec(m) for m in ("torch", "transformers", "lmformatenforcer"))
+class SlowPipe(StreamingFakePipe):
+    def __call__(self, text, max_new_tokens, **kwargs):
+        time.sleep(0.5)
+        return super().__call__(text, max_new_tokens, **kwargs)
+
+
+REPLY = json.dumps({"subjective": {"chief_complaint": "Cough"}, "objective": {}, "assessment": "Cold"})
+
+
+class TestModelHost(unittest.TestCase):
+    def test_forked_workers_serve_calls_and_streams(self):
+        host = ModelHost(lambda: StreamingFakePipe([REPLY] * 4), workers=2).start()
+        try:
+            agent = SoapNoteGenerator(host)
+            self.assertEqual(agent.generate({"age": 40})["assessment"], "Cold")
+            *_, note = agent.generate_stream({"age": 41})
+            self.assertEqual(note["subjective"]["chief_complaint"], "Cough")
+
+            report = host.memory_report()
+            self.assertEqual(len(report["workers"]), 2)
+            if os.path.exists("/proc/self/smaps_rollup"):
+                self.assertTrue(all(w["pss"] > 0 for w in report["workers"]))
+            self.assertIsNotNone(host.stats()["ready_seconds"])
+        finally:
+            host.shutdown()
+
+    def test_worker_errors_reach_the_caller(self):
+        host = ModelHost(lambda: StreamingFakePipe([]), workers=1).start()
+        try:
+            with self.assertRaises(IndexError):
+                host(text=[{"role": "user", "content": "hi"}], max_new_tokens=5)
+            # The worker keeps serving after an error
+            with self.assertRaises(IndexError):
+                host(text=[{"role": "user", "content": "hi"}], max_new_tokens=5)
+        finally:
+            host.shutdown()
+
+    def test_routes_to_least_loaded_worker(self):
+        host = ModelHost(lambda: SlowPipe([REPLY] * 4), workers=2, pin_cores=True).start()
+        try:
+            messages = [{"role": "user", "content": "hi"}]
+            threads = [threading.Thread(target=host, kwargs={"text": messages, "max_new_tokens": 5}) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # The second call goes to the idle worker rather than queueing behind the first
+            per_worker = host.stats()["per_worker"]
+            self.assertEqual([w["served"] for w in per_worker], [1, 1])
+            self.assertTrue(all(w["cores"] and w["in_flight"] == 0 for w in per_worker))
+        finally:
+            host.shutdown()
+
+    def test_core_sets_are_disjoint(self):
+        sets = core_sets(2)
+        self.assertEqual(len(sets), 2)
+        if len(os.sched_getaffinity(0)) >= 2:
+            self.assertFalse(sets[0] & sets[1])
+
+    def test_single_worker_is_pinned_in_process(self):
+        with mock.patch.object(model_host, "load_pipeline", return_value="pipe"), \
+                mock.patch.object(model_host, "_pin") as pin:
+            self.assertEqual(model_host.load_model_pipe("model", workers=1, pin_cores=True), "pipe")
+            pin.assert_called_once_with(core_sets(1)[0], None)
+            model_host.load_model_pipe("model", workers=1)
+            pin.assert_called_once()
+
+    def test_memory_usage_of_missing_process(self):
+        self.assertEqual(memory_usage(-1), {"rss": None, "pss": None})
+
+
+@unittest.skipUnless(HAS_STACK, "requires torch, transformers and lm-format-enforcer")
+class TestModelHostTinyModel(unittest.TestCase):
+    def test_constrained_json_crosses_the_process_boundary(self):
+        from tiny_model import TinyChatPipe
+        host = ModelHost(TinyChatPipe, workers=1).start()
+        try:
+            agent = SoapNoteGenerator(host, constrained=True)
+            messages = agent._build_messages({"age": 45})
+            text = extract_generated_text(host(text=messages, max_new_tokens=800, **agent._generation_kwargs()))
+            self.assertIn("vital_signs", json.loads(text)["objective"])
+        finally:
+            host.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import io
+import sys
+import os
+import contextlib
+import tempfile
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.utils.pdf_generator import generate_soap_pdf, render_many, _styles
+
+SOAP = {
+    "subjective": {"chief_complaint": "Headache"},
+    "objective": {"vital_signs": {"blood_pressure": "120/80"}},
+    "assessment": "Tension headache",
+    "plan": {"medications": ["Paracetamol 500mg"]},
+}
+ANALYSIS = {"medicine_alignment": "Aligned", "safety_notice": "None"}
+
+
+class TestPdfGenerator(unittest.TestCase):
+    def test_styles_are_built_once(self):
+        self.assertIs(_styles(), _styles())
+
+    def test_generate_returns_filename(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "note.pdf")
+            self.assertEqual(generate_soap_pdf(SOAP, ANALYSIS, filename=path), path)
+            with open(path, "rb") as f:
+                self.assertTrue(f.read().startswith(b"%PDF"))
+
+    def test_renders_to_bytes_and_streams(self):
+        data = generate_soap_pdf(SOAP, ANALYSIS, filename=None)
+        self.assertTrue(data.startswith(b"%PDF"))
+
+        stream = io.BytesIO()
+        self.assertIs(generate_soap_pdf(SOAP, ANALYSIS, filename=stream), stream)
+        self.assertTrue(stream.getvalue().startswith(b"%PDF"))
+
+    def test_path_write_leaves_no_temporary_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            generate_soap_pdf(SOAP, ANALYSIS, filename=os.path.join(tmp, "note.pdf"))
+            self.assertEqual(os.listdir(tmp), ["note.pdf"])
+
+    def test_quiet_rendering_prints_nothing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "note.pdf")
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                generate_soap_pdf(SOAP, ANALYSIS, filename=path)
+            self.assertEqual(out.getvalue(), f"PDF generated: {path}\n")
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                generate_soap_pdf(SOAP, ANALYSIS, filename=path, verbose=False)
+                render_many([{"soap_data": SOAP, "agent2_output": ANALYSIS, "filename": path}] * 2)
+            self.assertEqual(out.getvalue(), "2 PDFs generated\n")
+
+    def test_render_many_keeps_order(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            notes = [
+                {"soap_data": SOAP, "agent2_output": ANALYSIS, "filename": os.path.join(tmp, f"{i}.pdf")}
+                for i in range(4)
+            ]
+            for workers in (1, 2):
+                filenames = render_many(notes, workers=workers, chunksize=1)
+                self.assertEqual(filenames, [note["filename"] for note in notes])
+                self.assertTrue(all(os.path.getsize(name) > 0 for name in filenames))
+
+        in_memory = render_many([{"soap_data": SOAP, "agent2_output": ANALYSIS, "filename": None}] * 2)
+        self.assertTrue(all(data.startswith(b"%PDF") for data in in_memory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import sys
+import os
+import time
+import threading
+import unittest
+from unittest import mock
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.serving.prefetch import Cancelled, Prefetcher, SpeculativePipe
+from medflow.serving.scheduler import MicroBatchScheduler
+from test_agents import FakePipe, SOA_REPLY
+
+
+class SlowPipe(FakePipe):
+    def __init__(self, replies, delay):
+        super().__init__(replies)
+        self.delay = delay
+
+    def __call__(self, text, max_new_tokens, **kwargs):
+        time.sleep(self.delay)
+        return super().__call__(text, max_new_tokens, **kwargs)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+class TestPrefetcher(unittest.TestCase):
+    def prefetcher(self, pipe, debounce_s=0.05):
+        prefetcher = Prefetcher(SoapNoteGenerator(SpeculativePipe(pipe)), debounce_s=debounce_s)
+        self.addCleanup(prefetcher.shutdown)
+        return prefetcher
+
+    def test_debounced_generation_is_served_on_click(self):
+        pipe = FakePipe([SOA_REPLY])
+        prefetcher = self.prefetcher(pipe)
+        for age in (4, 45, 45):
+            prefetcher.update("session", {"age": age})
+        wait_for(lambda: prefetcher.launched)
+
+        note = prefetcher.take("session", {"age": 45})
+        self.assertEqual(note["assessment"], "assess")
+        self.assertEqual(len(pipe.calls), 1)
+        stats = prefetcher.stats()
+        self.assertEqual((stats["launched"], stats["hits"], stats["misses"]), (1, 1, 0))
+        # Used up by the click
+        self.assertIsNone(prefetcher.take("session", {"age": 45}))
+
+    def test_edit_cancels_the_running_generation(self):
+        pipe = SlowPipe([SOA_REPLY, SOA_REPLY], delay=0.2)
+        prefetcher = self.prefetcher(pipe)
+        prefetcher.update("session", {"age": 4})
+        wait_for(lambda: prefetcher.launched)
+        time.sleep(0.05)
+        prefetcher.update("session", {"age": 45})
+        wait_for(lambda: prefetcher.launched == 2)
+        # The cancelled call still has to return before the new one can start
+        time.sleep(0.3)
+
+        self.assertIsNotNone(prefetcher.take("session", {"age": 45}))
+        stats = prefetcher.stats()
+        self.assertEqual(stats["cancelled"], 1)
+        self.assertGreater(stats["wasted_seconds"], 0.1)
+        self.assertGreater(stats["wasted_tokens"], 0)
+
+    def test_other_inputs_on_click_are_a_miss(self):
+        prefetcher = self.prefetcher(FakePipe([SOA_REPLY]))
+        prefetcher.update("session", {"age": 4})
+        wait_for(lambda: prefetcher.launched)
+        time.sleep(0.05)
+
+        self.assertIsNone(prefetcher.take("session", {"age": 45}))
+        self.assertIsNone(prefetcher.take("other session", {"age": 4}))
+        stats = prefetcher.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (0, 2, 0.0))
+        self.assertGreater(stats["wasted_tokens"], 0)
+
+    def test_click_before_the_debounce_runs_normally(self):
+        pipe = FakePipe([SOA_REPLY])
+        prefetcher = self.prefetcher(pipe, debounce_s=10)
+        prefetcher.update("session", {"age": 45})
+        self.assertIsNone(prefetcher.take("session", {"age": 45}))
+        self.assertEqual((prefetcher.launched, len(pipe.calls)), (0, 0))
+
+    def test_click_is_not_starved_by_other_sessions(self):
+        from test_scheduler import InterruptiblePipe, wait_until_taken
+
+        class Tokenizer:
+            # Agent 1's JSON stopping criterion sees no tokens from the fake model
+            def decode(self, tokens, skip_special_tokens=False):
+                return ""
+
+        pipe = InterruptiblePipe([SOA_REPLY] * 1000, seconds=0.3)
+        pipe.tokenizer = Tokenizer()
+        scheduler = MicroBatchScheduler(pipe, max_wait_ms=0)
+        self.addCleanup(scheduler.shutdown)
+        prefetcher = self.prefetcher(scheduler)
+        prefetcher.update("session", {"age": 45})
+        wait_for(lambda: scheduler.stats()["submitted"])
+        wait_until_taken(scheduler, queue="background_depth")
+
+        stop = threading.Event()
+        self.addCleanup(stop.set)
+
+        def other_sessions():
+            while not stop.is_set():
+                scheduler.submit([{"role": "user", "content": "other"}], max_new_tokens=10).result()
+                time.sleep(0.02)
+
+        load = threading.Thread(target=other_sessions, daemon=True)
+        load.start()
+        started = time.monotonic()
+        # Each of those clicks would otherwise preempt the speculation and start it over
+        note = prefetcher.take("session", {"age": 45}, timeout=5)
+        stop.set()
+        load.join()
+        self.assertEqual(note["assessment"], "assess")
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_cancelled_local_generation_stops_early(self):
+        from tiny_model import TinyChatPipe
+
+        pipe = SpeculativePipe(TinyChatPipe())
+        event = threading.Event()
+        threading.Timer(0.2, event.set).start()
+        with pipe.running(event) as usage, self.assertRaises(Cancelled):
+            pipe(text=[{"role": "user", "content": "hello"}], max_new_tokens=4000,
+                 generate_kwargs={"min_new_tokens": 4000})
+        # 4000 tokens take far longer than this on the tiny model
+        self.assertLess(usage["seconds"], 2)
+
+
+class TestAppPrefetch(unittest.TestCase):
+    def test_click_after_the_form_settles_skips_generation(self):
+        from medflow import app_pro
+
+        pipe = FakePipe([SOA_REPLY])
+        prefetcher = Prefetcher(SoapNoteGenerator(SpeculativePipe(pipe)), debounce_s=0.01)
+        self.addCleanup(prefetcher.shutdown)
+        form = ("Jane", "P-1", 30, "Female", "Cough", "3 days", "Mild", "", "", "120/80", "70 bpm", None)
+        with mock.patch.multiple(app_pro, generator=SoapNoteGenerator(pipe), prefetcher=prefetcher,
+                                 _agents_loaded=True):
+            app_pro.prefetch_step1(*form, session="browser")
+            wait_for(lambda: prefetcher.launched)
+            outputs = list(app_pro.run_step1(*form, session="browser"))
+
+        # The pipe held one reply, used by the speculative generation
+        self.assertEqual(len(pipe.calls), 1)
+        note, encounter_id = outputs[-1]
+        self.assertEqual(note["assessment"], "assess")
+        self.assertEqual(app_pro.encounters.get(encounter_id)["soap_note"]["patient_name"], "Jane")
+        self.assertEqual(prefetcher.stats()["hits"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import sys
+import os
+import unittest
+from types import SimpleNamespace
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.utils.prefix_cache import PrefixCache
+
+
+def fake_model(name):
+    return SimpleNamespace(config=SimpleNamespace(_name_or_path=name, _commit_hash="abc"), dtype="bf16")
+
+
+class TestPrefixCacheKey(unittest.TestCase):
+    def test_key_changes_with_prompt_and_model(self):
+        model = fake_model("google/medgemma-4b-it")
+        cache = PrefixCache(model, processor=None)
+        other = PrefixCache(fake_model("google/medgemma-4b-it"), processor=None)
+
+        self.assertEqual(cache.key("prompt"), cache.key("prompt"))
+        self.assertNotEqual(cache.key("prompt"), cache.key("prompt v2"))
+        self.assertNotEqual(cache.key("prompt"), other.key("prompt"))
+
+
+SYSTEM = "You are Agent 1. Reply with a JSON object."
+
+
+def conversation(user, system=SYSTEM):
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+
+class TestPrefixCachedPipeline(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from tiny_model import TinyChatPipe
+
+        cls.plain = TinyChatPipe(random_head=True)
+
+    def setUp(self):
+        from medflow.utils.prefix_cache import PrefixCachedPipeline
+
+        self.pipe = PrefixCachedPipeline(self.plain)
+
+    def reply(self, pipe, text):
+        from medflow.utils.generation import extract_generated_text
+
+        return extract_generated_text(pipe(text=text, max_new_tokens=16))
+
+    def test_cached_output_matches_uncached_greedy_output(self):
+        for user in ("Cough for two weeks", "Fever and headache since Monday"):
+            expected = self.reply(self.plain, conversation(user))
+            self.assertTrue(expected)
+            self.assertEqual(self.reply(self.pipe, conversation(user)), expected)
+        self.assertEqual((self.pipe.cache.misses, self.pipe.cache.hits), (1, 1))
+
+    def test_new_system_prompt_is_a_new_entry(self):
+        self.reply(self.pipe, conversation("Cough"))
+        self.reply(self.pipe, conversation("Cough", system="You are Agent 2."))
+        self.reply(self.pipe, conversation("Fever"))
+        self.assertEqual((self.pipe.cache.misses, self.pipe.cache.hits), (2, 1))
+
+    def test_passthrough_paths(self):
+        # No system prompt
+        no_system = [{"role": "user", "content": "Cough"}]
+        self.assertEqual(self.reply(self.pipe, no_system), self.reply(self.plain, no_system))
+        # Images go to the wrapped pipeline; the tiny template drops them
+        with_image = [{"role": "system", "content": SYSTEM},
+                      {"role": "user", "content": [{"type": "text", "text": "Cough"},
+                                                   {"type": "image", "image": b"png"}]}]
+        self.assertEqual(self.reply(self.pipe, with_image), self.reply(self.plain, with_image))
+        self.assertEqual(self.pipe.cache.misses + self.pipe.cache.hits, 0)
+
+        # Several conversations are one padded forward pass of the wrapped pipeline
+        batch = [conversation("Cough"), conversation("Fever and headache")]
+        outputs = self.pipe(text=batch, max_new_tokens=16)
+        self.assertEqual(outputs, self.plain(text=batch, max_new_tokens=16))
+        self.assertEqual(self.pipe.cache.misses + self.pipe.cache.hits, 0)
+
+    def test_prompt_not_starting_with_the_prefix_is_passed_through(self):
+        from unittest import mock
+
+        self.reply(self.pipe, conversation("Cough"))
+        entry = self.pipe.cache.get(SYSTEM)
+        # A stale entry whose tokens no longer match the rendered prompt
+        with mock.patch.dict(entry, input_ids=entry["input_ids"] + 1):
+            self.assertEqual(self.reply(self.pipe, conversation("Fever")), self.reply(self.plain, conversation("Fever")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import sys
+import os
+import json
+import tempfile
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.utils.prompt_builder import PromptBuilder, compact, dumps, TRUNCATION_MARKER
+from medflow.utils.token_log import TokenLog
+
+
+class FakePipe:
+    """No tokenizer: tokens are estimated from characters."""
+
+
+class TestCompactSerialization(unittest.TestCase):
+    def test_drops_placeholders(self):
+        value = {
+            "chief_complaint": "Cough",
+            "allergies": "Missing",
+            "vital_signs": {"blood_pressure": "120/80 mmHg", "temperature": "N/A", "heart_rate": ""},
+            "medications": [],
+            "notes": [" Not provided ", "Smoker"],
+        }
+        self.assertEqual(compact(value), {
+            "chief_complaint": "Cough",
+            "vital_signs": {"blood_pressure": "120/80 mmHg"},
+            "notes": ["Smoker"],
+        })
+        self.assertEqual(dumps(value), '{"chief_complaint":"Cough","vital_signs":{"blood_pressure":"120/80 mmHg"},"notes":["Smoker"]}')
+
+    def test_smaller_than_indented_json(self):
+        value = {"subjective": {"chief_complaint": "Cough", "history": "Missing"}, "objective": {"vital_signs": "Missing"}}
+        self.assertLess(len(dumps(value)), len(json.dumps(value, indent=2)) / 2)
+
+
+class TestPromptBuilder(unittest.TestCase):
+    def test_skips_placeholder_sections(self):
+        builder = PromptBuilder(FakePipe())
+        builder.add(None, "Analyze the case.", priority=None)
+        builder.add("Patient Ethnicity", "Not provided")
+        builder.add("Doctor Plan", {"medicines": ["Aspirin"]})
+        self.assertEqual(builder.build(), 'Analyze the case.\n\nDoctor Plan:\n{"medicines":["Aspirin"]}')
+        self.assertEqual(builder.report["truncated"], [])
+
+    def test_truncates_lowest_priority_first(self):
+        builder = PromptBuilder(FakePipe(), budget=40, agent="test")
+        builder.add(None, "Instruction that is never truncated.", priority=None)
+        builder.add("Plan", "p" * 80, priority=3)
+        builder.add("History", "h" * 80, priority=1)
+        builder.add("Other", "o" * 80, priority=1)
+        text = builder.build()
+
+        self.assertLessEqual(builder.report["tokens"], 40)
+        # Equal priorities are truncated from the end of the prompt
+        self.assertEqual(builder.report["truncated"], ["Other", "History"])
+        self.assertIn("Instruction that is never truncated.", text)
+        self.assertIn("p" * 80, text)
+        self.assertNotIn("Other:", text)
+        self.assertTrue(TRUNCATION_MARKER in text)
+
+    def test_counts_with_tokenizer(self):
+        from tiny_model import TinyChatPipe
+        pipe = TinyChatPipe()
+        builder = PromptBuilder(pipe, budget=20)
+        builder.add("Notes", "chest pain " * 50)
+        builder.build()
+        self.assertLessEqual(builder.report["tokens"], 20)
+        self.assertEqual(builder.report["truncated"], ["Notes"])
+
+
+class TestTokenLog(unittest.TestCase):
+    def test_summary_and_jsonl(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tokens.jsonl")
+            log = TokenLog(path, window=3)
+            for prompt in (100, 200, 300, 400):
+                log.record("agent1", prompt, prompt // 10, 0.5, mode="full")
+            log.record("agent2", 50, None)
+
+            summary = log.summary()
+            self.assertEqual(summary["agent1"]["calls"], 4)
+            # Only the last `window` calls are kept in memory
+            self.assertEqual(summary["agent1"]["prompt_tokens"]["mean"], 300)
+            self.assertEqual(summary["agent1"]["prompt_tokens"]["max"], 400)
+            self.assertIsNone(summary["agent2"]["output_tokens"])
+
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(len(records), 5)
+            self.assertEqual(records[0]["mode"], "full")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import sys
+import os
+import json
+import time
+import socket
+import importlib.util
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.serving.model_server import ModelServer
+from medflow.serving.remote import RemotePipe, RemoteError
+from medflow.serving.scheduler import QueueFullError
+from medflow.utils.generation import extract_generated_text
+from test_json_stream import StreamingFakePipe
+
+REPLY = json.dumps({"subjective": {"chief_complaint": "Cough"}, "objective": {}, "assessment": "Cold"})
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+HAS_STACK = all(importlib.util.find_spec(m) for m in ("torch", "transformers", "lmformatenforcer"))
+
+
+class TestRemotePipe(unittest.TestCase):
+    def setUp(self):
+        self.fake = StreamingFakePipe([REPLY] * 8)
+        self.server = ModelServer(self.fake, port=0, max_wait_ms=5).start()
+        self.pipe = RemotePipe(self.server.url, retries=1, backoff=0.01)
+
+    def tearDown(self):
+        self.pipe.close()
+        self.server.shutdown()
+
+    def test_agent_generates_through_the_server(self):
+        agent = SoapNoteGenerator(self.pipe)
+        self.assertEqual(agent.generate({"age": 40})["assessment"], "Cold")
+        *_, note = agent.generate_stream({"age": 41})
+        self.assertEqual(note["subjective"]["chief_complaint"], "Cough")
+        # JSON settings travel by value and are dropped by the tokenizer-less fake
+        self.assertNotIn("json_stop", self.fake.calls[0])
+
+    def test_batch_is_one_request(self):
+        outputs = self.pipe(text=[MESSAGES, MESSAGES + [{"role": "user", "content": "again"}]], max_new_tokens=5)
+        self.assertEqual([extract_generated_text(o) for o in outputs], [REPLY, REPLY])
+        self.assertEqual(outputs[1][0]["generated_text"][1]["content"], "again")
+        self.assertEqual(self.pipe.connections_opened, 1)
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.pipe(text=MESSAGES, max_new_tokens=5)
+        self.assertEqual("".join(self.pipe.stream(text=MESSAGES, max_new_tokens=5)), REPLY)
+        self.assertEqual(self.pipe.connections_opened, 1)
+        self.assertEqual(self.pipe.model_id, "StreamingFakePipe")
+
+    def test_images_round_trip(self):
+        from PIL import Image
+
+        messages = [{"role": "user", "content": [
+            {"type": "image", "image": Image.new("RGB", (4, 4), "red")},
+            {"type": "text", "text": "describe"},
+        ]}]
+        self.pipe(text=messages, max_new_tokens=5)
+        # The server scheduler hands the fake a one-conversation batch
+        image = self.fake.calls[0]["text"][0][0]["content"][0]["image"]
+        self.assertEqual(image.size, (4, 4))
+        self.assertEqual(image.getpixel((0, 0)), (255, 0, 0))
+
+    def test_image_bytes_round_trip(self):
+        import io
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), "blue").save(buffer, format="JPEG")
+        messages = [{"role": "user", "content": [{"type": "image", "image": buffer.getvalue()}]}]
+        self.pipe(text=messages, max_new_tokens=5)
+        image = self.fake.calls[0]["text"][0][0]["content"][0]["image"]
+        self.assertEqual((image.format, image.size), ("JPEG", (4, 4)))
+
+    def test_undecodable_image_is_a_bad_request(self):
+        import base64
+        import urllib.error
+        import urllib.request
+
+        messages = [{"role": "user", "content": [
+            {"type": "image", "image_base64": base64.b64encode(b"not an image").decode("ascii")},
+        ]}]
+        body = json.dumps({"text": messages, "max_new_tokens": 5}).encode("utf-8")
+        request = urllib.request.Request(self.server.url + "/generate", data=body,
+                                         headers={"Content-Type": "application/json"})
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request, timeout=5)
+        self.assertEqual(error.exception.code, 400)
+        self.assertIn("Bad request", json.loads(error.exception.read())["error"])
+        self.assertEqual(self.fake.calls, [])
+
+    def test_server_errors_raise(self):
+        self.fake.replies.clear()
+        with self.assertRaises(RemoteError):
+            self.pipe(text=MESSAGES, max_new_tokens=5)
+        with self.assertRaises(RemoteError):
+            list(self.pipe.stream(text=MESSAGES, max_new_tokens=5))
+        # The server keeps serving afterwards
+        self.fake.replies.append(REPLY)
+        self.assertEqual(extract_generated_text(self.pipe(text=MESSAGES, max_new_tokens=5)), REPLY)
+
+    def test_stale_pooled_connection_is_retried(self):
+        self.pipe(text=MESSAGES, max_new_tokens=5)
+        # The server drops the idle keep-alive connection
+        self.pipe._pool.queue[0].sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(extract_generated_text(self.pipe(text=MESSAGES, max_new_tokens=5)), REPLY)
+
+    def test_read_timeout_is_not_retried(self):
+        def slow(text, max_new_tokens, **kwargs):
+            time.sleep(0.5)
+            return self.fake(text, max_new_tokens, **kwargs)
+
+        server = ModelServer(slow, port=0, max_batch_size=1).start()
+        pipe = RemotePipe(server.url, timeout=0.1, retries=2, backoff=0.01)
+        try:
+            with self.assertRaises(RemoteError):
+                pipe(text=MESSAGES, max_new_tokens=5)
+            time.sleep(0.6)
+        finally:
+            pipe.close()
+            server.shutdown()
+        # The request reached the model once; a retry would have generated it again
+        self.assertEqual(len(self.fake.calls), 1)
+
+    def test_full_queue_is_an_overload_response(self):
+        calls = []
+
+        def overloaded(text, max_new_tokens, **kwargs):
+            calls.append(text)
+            if len(calls) == 1:
+                raise QueueFullError("Scheduler queue is full (64 pending requests)")
+            return self.fake(text, max_new_tokens, **kwargs)
+
+        server = ModelServer(overloaded, port=0, max_batch_size=1).start()
+        pipe = RemotePipe(server.url, retries=0)
+        retrying = RemotePipe(server.url, retries=1, backoff=0.01)
+        try:
+            with self.assertRaisesRegex(RemoteError, "returned 503"):
+                pipe(text=MESSAGES, max_new_tokens=5)
+            self.assertEqual(extract_generated_text(retrying(text=MESSAGES, max_new_tokens=5)), REPLY)
+        finally:
+            pipe.close()
+            retrying.close()
+            server.shutdown()
+
+    def test_unreachable_server(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        pipe = RemotePipe(f"http://127.0.0.1:{port}", retries=1, backoff=0.01)
+        with self.assertRaises(RemoteError):
+            pipe(text=MESSAGES, max_new_tokens=5)
+        self.assertEqual(pipe.model_id, f"remote:http://127.0.0.1:{port}")
+
+
+@unittest.skipUnless(HAS_STACK, "requires torch, transformers and lm-format-enforcer")
+class TestRemotePipeTinyModel(unittest.TestCase):
+    def test_constrained_json_crosses_http(self):
+        from tiny_model import TinyChatPipe
+        server = ModelServer(TinyChatPipe(), port=0, max_batch_size=1).start()
+        pipe = RemotePipe(server.url)
+        try:
+            agent = SoapNoteGenerator(pipe, constrained=True)
+            messages = agent._build_messages({"age": 45})
+            text = extract_generated_text(pipe(text=messages, max_new_tokens=800, **agent._generation_kwargs()))
+            self.assertIn("vital_signs", json.loads(text)["objective"])
+        finally:
+            pipe.close()
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
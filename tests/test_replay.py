@@ -0,0 +1,119 @@
+import sys
+import os
+import json
+import time
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.serving.replay import RecordingPipe, ReplayPipe, load_corpus
+from medflow.utils.generation import extract_generated_text
+from medflow.agents.agent1 import SoapNoteGenerator
+from test_agents import FakePipe, SOA_REPLY
+from test_json_stream import StreamingFakePipe
+
+
+def conversation(system, user):
+    return [{"role": "system", "content": system}, {"role": "user", "content": [{"type": "text", "text": user}]}]
+
+
+class TestRecordAndReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "calls.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_corpus(self, text, tokens, prefill_s, token_s):
+        """A corpus of one recorded call with the given timings."""
+        RecordingPipe(FakePipe([text]), self.path)(text=conversation("You are Agent 1.", "x"), max_new_tokens=800)
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        lines[-1].update(output_tokens=tokens, prefill_s=prefill_s, token_s=token_s)
+        with open(self.path, "w") as f:
+            f.writelines(json.dumps(line) + "\n" for line in lines)
+
+    def test_record_then_replay(self):
+        recorder = RecordingPipe(FakePipe(["reply a", "reply b", "reply c"]), self.path)
+        a, b = conversation("You are Agent 1.", "patient a"), conversation("You are Agent 1.", "patient b")
+        c = conversation("You are Agent 1.", "patient c")
+        recorder(text=a, max_new_tokens=100)
+        recorder(text=[b, c], max_new_tokens=100, batch_size=2)
+
+        prompts, calls = load_corpus(self.path)
+        # The shared system prompt is stored once
+        self.assertEqual(list(prompts.values()), ["You are Agent 1."])
+        self.assertEqual([call["text"] for call in calls], ["reply a", "reply b", "reply c"])
+        self.assertEqual([call["batch_size"] for call in calls], [1, 2, 2])
+
+        replay = ReplayPipe(self.path, time_scale=0)
+        self.assertEqual(extract_generated_text(replay(text=b, max_new_tokens=100)), "reply b")
+        outputs = replay(text=[c, a], max_new_tokens=100)
+        self.assertEqual([extract_generated_text(o) for o in outputs], ["reply c", "reply a"])
+        # Unseen inputs get a reply recorded under the same system prompt
+        self.assertIn(extract_generated_text(replay(text=conversation("You are Agent 1.", "new"), max_new_tokens=100)),
+                      {"reply a", "reply b", "reply c"})
+        self.assertEqual((replay.exact, replay.fallbacks), (3, 1))
+        with self.assertRaises(LookupError):
+            replay(text=conversation("You are Agent 2.", "new"), max_new_tokens=100)
+        with self.assertRaises(LookupError):
+            ReplayPipe(self.path, strict=True)(text=conversation("You are Agent 1.", "new"), max_new_tokens=100)
+
+    def test_records_streams_and_images(self):
+        recorder = RecordingPipe(StreamingFakePipe(["streamed reply"]), self.path)
+        messages = conversation("You are Agent 1.", "patient")
+        messages[1]["content"].append({"type": "image", "image": b"\x89PNG fake"})
+        self.assertEqual("".join(recorder.stream(text=messages, max_new_tokens=50)), "streamed reply")
+
+        _, calls = load_corpus(self.path)
+        self.assertIsNotNone(calls[0]["prefill_s"])
+        self.assertEqual(calls[0]["messages"][1]["content"][1]["type"], "image")
+        self.assertIn("hash", calls[0]["messages"][1]["content"][1])
+        replay = ReplayPipe(self.path, time_scale=0)
+        self.assertEqual("".join(replay.stream(text=messages, max_new_tokens=50)), "streamed reply")
+        self.assertEqual(replay.exact, 1)
+
+    def test_latency_and_capacity(self):
+        self.write_corpus("0123456789", 10, 0.05, 0.01)
+        replay = ReplayPipe(self.path, capacity=1)
+        messages = conversation("You are Agent 1.", "x")
+
+        t0 = time.perf_counter()
+        replay(text=messages, max_new_tokens=100)
+        self.assertGreaterEqual(time.perf_counter() - t0, 0.15)
+
+        # One call at a time, like a single model worker
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(2) as pool:
+            list(pool.map(lambda _: replay(text=messages, max_new_tokens=100), range(2)))
+        self.assertGreaterEqual(time.perf_counter() - t0, 0.3)
+
+    def test_reply_cut_at_max_new_tokens(self):
+        self.write_corpus("0123456789", 10, 0.0, 0.0)
+        replay = ReplayPipe(self.path, time_scale=0)
+        output = replay(text=conversation("You are Agent 1.", "x"), max_new_tokens=4)
+        self.assertEqual(extract_generated_text(output), "0123")
+
+    def test_agent_over_replay(self):
+        recorder = RecordingPipe(FakePipe([SOA_REPLY]), self.path)
+        note, _ = SoapNoteGenerator(recorder).generate_batch([{"age": 45}])
+        replayed, stats = SoapNoteGenerator(ReplayPipe(self.path, time_scale=0)).generate_batch([{"age": 45}])
+        self.assertEqual(replayed, note)
+        self.assertTrue(stats["items"][0]["parsed"])
+
+    def test_recording_the_tiny_model_times_prefill(self):
+        from tiny_model import TinyChatPipe
+
+        recorder = RecordingPipe(TinyChatPipe(), self.path)
+        recorder(text=[{"role": "user", "content": "hello"}], max_new_tokens=8, generate_kwargs={"min_new_tokens": 8})
+        _, calls = load_corpus(self.path)
+        self.assertGreater(calls[0]["prefill_s"], 0)
+        self.assertGreater(calls[0]["token_s"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import sys
+import os
+import json
+import tempfile
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.utils.response_cache import ResponseCache, make_cache_key
+from test_agents import FakePipe
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_key_is_canonical(self):
+        a = make_cache_key(inputs={"age": 45, "symptoms": ["Fatigue "]}, model="m")
+        b = make_cache_key(model="m", inputs={"symptoms": ["Fatigue"], "age": 45})
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, make_cache_key(inputs={"age": 46, "symptoms": ["Fatigue"]}, model="m"))
+
+    def test_memory_lru_and_disk_tier(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(max_entries=1, cache_dir=tmp)
+            cache.put("a" * 64, {"v": 1})
+            cache.put("b" * 64, {"v": 2})
+
+            # "a" was pushed out of memory but is still on disk
+            self.assertEqual(cache.get("a" * 64), {"v": 1})
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            self.assertIsNone(cache.get("c" * 64))
+            self.assertEqual(cache.stats()["misses"], 1)
+
+            reopened = ResponseCache(cache_dir=tmp)
+            self.assertEqual(reopened.get("b" * 64), {"v": 2})
+
+    def test_disk_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(cache_dir=tmp, max_disk_bytes=200)
+            for i in range(10):
+                cache.put(f"{i:064d}", {"payload": "x" * 50})
+            self.assertLessEqual(cache.stats()["disk_bytes"], 200)
+
+    def test_agent_uses_cache_and_bypass(self):
+        reply = json.dumps({"S": "s", "O": "o", "A": "a"})
+        pipe = FakePipe([reply, reply])
+        agent = SoapNoteGenerator(pipe, cache=ResponseCache())
+
+        first = agent.generate({"age": 45})
+        first["patient_name"] = "mutated"
+        self.assertEqual(agent.generate({"age": 45}), {k: v for k, v in first.items() if k != "patient_name"})
+        self.assertEqual(len(pipe.calls), 1)
+
+        agent.generate({"age": 45}, use_cache=False)
+        self.assertEqual(len(pipe.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
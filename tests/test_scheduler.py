@@ -0,0 +1,211 @@
+import sys
+import os
+import json
+import time
+import threading
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.agents.agent1 import SoapNoteGenerator
+from medflow.serving.scheduler import MicroBatchScheduler, QueueFullError
+from test_agents import FakePipe
+
+
+class BlockingPipe(FakePipe):
+    """FakePipe whose calls wait until `release` is set."""
+
+    def __init__(self, replies):
+        super().__init__(replies)
+        self.release = threading.Event()
+
+    def __call__(self, text, max_new_tokens, **kwargs):
+        self.release.wait(5)
+        return super().__call__(text, max_new_tokens, **kwargs)
+
+
+REPLY = json.dumps({"S": "s", "O": "o", "A": "a"})
+
+
+class InterruptiblePipe(FakePipe):
+    """
+    Stands in for a local model: calls with stopping criteria generate for `seconds`
+    unless the criteria fire first. Replies are taken when a call returns.
+    """
+
+    tokenizer = object()
+
+    def __init__(self, replies, seconds=1.0):
+        super().__init__(replies)
+        self.seconds = seconds
+        # Import transformers here rather than in the dispatchers, outside the timed part
+        from transformers import StoppingCriteriaList  # noqa: F401
+
+    def __call__(self, text, max_new_tokens, **kwargs):
+        import torch
+
+        criteria = (kwargs.get("generate_kwargs") or {}).get("stopping_criteria") or []
+        deadline = time.monotonic() + self.seconds
+        while criteria and time.monotonic() < deadline:
+            if any(criterion(torch.zeros((1, 1)), None).all() for criterion in criteria):
+                break
+            time.sleep(0.005)
+        return super().__call__(text, max_new_tokens, **kwargs)
+
+
+def wait_until_taken(scheduler, timeout=5, queue="queue_depth"):
+    """Waits until the dispatchers have taken every queued request; fails after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while scheduler.stats()[queue]:
+        if time.monotonic() > deadline:
+            raise AssertionError("Queued requests were not dispatched")
+        time.sleep(0.005)
+
+
+class TestMicroBatchScheduler(unittest.TestCase):
+    def test_concurrent_requests_share_a_batch(self):
+        pipe = FakePipe([REPLY] * 4)
+        scheduler = MicroBatchScheduler(pipe, max_batch_size=4, max_wait_ms=2000)
+        agent = SoapNoteGenerator(scheduler)
+
+        results = []
+        threads = [threading.Thread(target=lambda i=i: results.append(agent.generate({"age": i}))) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        scheduler.shutdown()
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(pipe.calls), 1)
+        self.assertEqual(pipe.calls[0]["batch_size"], 4)
+        self.assertEqual(scheduler.stats()["mean_batch_size"], 4)
+
+    def test_different_settings_are_not_mixed(self):
+        pipe = FakePipe([REPLY] * 2)
+        scheduler = MicroBatchScheduler(pipe, max_batch_size=4, max_wait_ms=10)
+        a = scheduler.submit([{"role": "user", "content": "a"}], max_new_tokens=10)
+        b = scheduler.submit([{"role": "user", "content": "b"}], max_new_tokens=20)
+        a.result(5)
+        b.result(5)
+        scheduler.shutdown()
+        self.assertEqual(sorted(call["max_new_tokens"] for call in pipe.calls), [10, 20])
+
+    def test_backpressure_rejects_when_queue_is_full(self):
+        pipe = BlockingPipe([REPLY] * 3)
+        scheduler = MicroBatchScheduler(pipe, max_batch_size=1, max_wait_ms=0, max_queue_depth=1)
+        messages = [{"role": "user", "content": "x"}]
+
+        first = scheduler.submit(messages, max_new_tokens=10)
+        # Wait until the worker has taken the first request and is blocked in the pipe
+        wait_until_taken(scheduler)
+        second = scheduler.submit(messages, max_new_tokens=10)
+        with self.assertRaises(QueueFullError):
+            scheduler.submit(messages, max_new_tokens=10)
+
+        pipe.release.set()
+        first.result(5)
+        second.result(5)
+        scheduler.shutdown()
+        self.assertEqual(scheduler.stats()["rejected"], 1)
+
+    def test_dispatchers_run_batches_in_parallel(self):
+        pipe = BlockingPipe([REPLY] * 2)
+        scheduler = MicroBatchScheduler(pipe, max_batch_size=1, max_wait_ms=0, dispatchers=2)
+        messages = [{"role": "user", "content": "x"}]
+        futures = [scheduler.submit(messages, max_new_tokens=10) for _ in range(2)]
+        # Both batches reach the pipe before either is released
+        wait_until_taken(scheduler)
+        pipe.release.set()
+        for future in futures:
+            future.result(5)
+        scheduler.shutdown()
+        self.assertEqual(scheduler.stats()["batches"], 2)
+
+    def test_background_requests_wait_for_foreground(self):
+        pipe = BlockingPipe([REPLY] * 4)
+        scheduler = MicroBatchScheduler(pipe, max_batch_size=4, max_wait_ms=0)
+        first = scheduler.submit([{"role": "user", "content": "first"}], max_new_tokens=10)
+        wait_until_taken(scheduler)
+        background = [scheduler.submit([{"role": "user", "content": f"background {i}"}], max_new_tokens=10,
+                                       background=True) for i in range(2)]
+        foreground = scheduler.submit([{"role": "user", "content": "foreground"}], max_new_tokens=10)
+        pipe.release.set()
+        for future in [first, foreground] + background:
+            future.result(5)
+        scheduler.shutdown()
+
+        order = [call["text"][0][0]["content"] for call in pipe.calls]
+        self.assertEqual(order, ["first", "foreground", "background 0", "background 1"])
+
+    def test_foreground_preempts_running_background_generation(self):
+        pipe = InterruptiblePipe(["foreground reply", "cut", "full"])
+        scheduler = MicroBatchScheduler(pipe, max_batch_size=4, max_wait_ms=0)
+        background = scheduler.submit([{"role": "user", "content": "background"}], max_new_tokens=10,
+                                      background=True)
+        wait_until_taken(scheduler, queue="background_depth")
+
+        started = time.monotonic()
+        foreground = scheduler.submit([{"role": "user", "content": "foreground"}], max_new_tokens=10)
+        self.assertEqual(foreground.result(5)[0]["generated_text"][-1]["content"], "foreground reply")
+        # The background call would otherwise hold the model for a second
+        self.assertLess(time.monotonic() - started, 0.5)
+
+        # Started over once the scheduler was idle; the cut-off reply is discarded
+        self.assertEqual(background.result(5)[0]["generated_text"][-1]["content"], "full")
+        scheduler.shutdown()
+        # In the order the calls returned
+        order = [call["text"][0][0]["content"] for call in pipe.calls]
+        self.assertEqual(order, ["foreground", "background", "background"])
+        self.assertEqual(scheduler.stats()["preempted"], 1)
+
+    def test_promoted_background_request_is_not_preempted(self):
+        pipe = InterruptiblePipe(["foreground reply", "full"], seconds=0.3)
+        scheduler = MicroBatchScheduler(pipe, max_batch_size=4, max_wait_ms=0)
+        background = scheduler.submit([{"role": "user", "content": "background"}], max_new_tokens=10,
+                                      background=True)
+        wait_until_taken(scheduler, queue="background_depth")
+        self.assertTrue(scheduler.promote(background))
+
+        scheduler.submit([{"role": "user", "content": "foreground"}], max_new_tokens=10).result(5)
+        self.assertEqual(background.result(5)[0]["generated_text"][-1]["content"], "full")
+        scheduler.shutdown()
+        self.assertEqual(scheduler.stats()["preempted"], 0)
+        self.assertFalse(scheduler.promote(background))
+
+    def test_foreground_does_not_wait_for_remote_background_call(self):
+        pipe = BlockingPipe([REPLY] * 2)
+        pipe.portable_generation = True
+        scheduler = MicroBatchScheduler(pipe, max_batch_size=4, max_wait_ms=0)
+        background = scheduler.submit([{"role": "user", "content": "background"}], max_new_tokens=10,
+                                      background=True)
+        wait_until_taken(scheduler, queue="background_depth")
+
+        # Runs alongside the background call, which cannot be stopped mid-generation
+        foreground = scheduler.submit([{"role": "user", "content": "foreground"}], max_new_tokens=10)
+        wait_until_taken(scheduler)
+        self.assertEqual(len(pipe.calls), 0)
+        pipe.release.set()
+        foreground.result(5)
+        background.result(5)
+        scheduler.shutdown()
+        self.assertEqual(scheduler.stats()["preempted"], 0)
+
+
+class TestSchedulerOverPrefixCache(unittest.TestCase):
+    def test_scheduled_calls_reuse_the_system_prefix(self):
+        from tiny_model import TinyChatPipe
+        from medflow.utils.prefix_cache import PrefixCachedPipeline
+
+        pipe = PrefixCachedPipeline(TinyChatPipe(random_head=True))
+        scheduler = MicroBatchScheduler(pipe, max_batch_size=4, max_wait_ms=0)
+        for symptom in ("cough", "fever"):
+            messages = [{"role": "system", "content": "You are Agent 1."}, {"role": "user", "content": symptom}]
+            scheduler(text=messages, max_new_tokens=4)
+        scheduler.shutdown()
+        self.assertEqual((pipe.cache.misses, pipe.cache.hits), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import sys
+import os
+import json
+import tempfile
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.agents.agent1 import SoapNoteGenerator, PROMPT_VERSION, MAX_NEW_TOKENS
+from medflow.agents.agent2 import PlanAnalyzer, PROMPT_VERSION as AGENT2_PROMPT_VERSION
+from medflow.utils.token_budget import TokenBudget, count_items
+from medflow.utils.token_log import TokenLog
+from test_agents import FakePipe, SOA_REPLY
+
+
+class TestTokenBudget(unittest.TestCase):
+    def test_ceiling_until_warmed_up(self):
+        budget = TokenBudget(min_samples=3, margin=1.0, extra=0, floor=1)
+        for tokens in (100, 120):
+            budget.observe("v1", 1, tokens)
+        self.assertEqual(budget.budget("v1", 1, ceiling=800), 800)
+        budget.observe("v1", 1, 110)
+        self.assertEqual(budget.budget("v1", 1, ceiling=800), 120)
+        self.assertEqual(budget.budget("v1", 1, ceiling=100), 100)
+
+    def test_size_buckets_are_separate(self):
+        budget = TokenBudget(min_samples=1, margin=1.5, extra=10, floor=1)
+        budget.observe("v1", 1, 100)
+        budget.observe("v1", 12, 400)
+        self.assertEqual(budget.budget("v1", 2, ceiling=2000), 160)
+        self.assertEqual(budget.budget("v1", 20, ceiling=2000), 610)
+        # Sizes without observations and other variants keep the ceiling
+        self.assertEqual(budget.budget("v1", 4, ceiling=2000), 2000)
+        self.assertEqual(budget.budget("v2", 1, ceiling=2000), 2000)
+
+    def test_retry_only_below_ceiling(self):
+        budget = TokenBudget()
+        self.assertEqual(budget.retry_budget(200, 200, False, ceiling=800), 800)
+        self.assertIsNone(budget.retry_budget(200, 200, True, ceiling=800))
+        self.assertIsNone(budget.retry_budget(50, 200, False, ceiling=800))
+        self.assertIsNone(budget.retry_budget(800, 800, False, ceiling=800))
+
+    def test_from_log(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log = TokenLog(os.path.join(tmp, "tokens.jsonl"))
+            log.record("agent1", 50, 100, variant="v1", size=1, parsed=True, truncated=False)
+            log.record("agent1", 50, 900, variant="v1", size=1, parsed=False, truncated=True)
+            log.record("agent2", 50, 700, variant="v1", size=1, parsed=True, truncated=False)
+            budget = TokenBudget.from_log(log.path, "agent1", min_samples=1, margin=1.0, extra=0, floor=1)
+        self.assertEqual(budget.budget("v1", 1, ceiling=800), 100)
+
+    def test_count_items(self):
+        self.assertEqual(count_items(["a", "b"], "c, d,", None, []), 4)
+
+
+class TestAdaptiveAgents(unittest.TestCase):
+    def warm_budget(self, variant, tokens=20):
+        budget = TokenBudget(min_samples=1, margin=1.0, extra=0, floor=1)
+        budget.observe(variant, 1, tokens)
+        return budget
+
+    def test_learned_budget_is_used(self):
+        pipe = FakePipe([SOA_REPLY])
+        agent = SoapNoteGenerator(pipe, token_budget=self.warm_budget(PROMPT_VERSION), token_log=TokenLog())
+        agent.generate({"symptoms": ["Cough"]})
+        self.assertEqual(pipe.calls[0]["max_new_tokens"], 20)
+
+    def test_truncated_reply_is_retried_at_the_ceiling(self):
+        # Pipes without a tokenizer are measured at about 4 characters per token
+        pipe = FakePipe(['{"S": "' + "x" * 100, SOA_REPLY])
+        log = TokenLog()
+        agent = SoapNoteGenerator(pipe, token_budget=self.warm_budget(PROMPT_VERSION), token_log=log)
+        note = agent.generate({"symptoms": ["Cough"]})
+
+        self.assertEqual([call["max_new_tokens"] for call in pipe.calls], [20, MAX_NEW_TOKENS])
+        self.assertEqual(note["subjective"], "subj")
+        self.assertEqual(log.summary()["agent1"]["truncated_calls"], 1)
+
+    def test_batch_retries_only_truncated_rows(self):
+        pipe = FakePipe([SOA_REPLY, '{"S": "' + "x" * 100, SOA_REPLY])
+        agent = SoapNoteGenerator(pipe, token_budget=self.warm_budget(PROMPT_VERSION), token_log=TokenLog())
+        notes, stats = agent.generate_batch([{"symptoms": ["Cough"]}, {"symptoms": ["Fever"]}])
+
+        self.assertEqual(len(pipe.calls), 2)
+        self.assertEqual(len(pipe.calls[1]["text"]), 1)
+        self.assertEqual(pipe.calls[1]["text"][0], pipe.calls[0]["text"][1])
+        self.assertEqual([n["subjective"] for n in notes], ["subj", "subj"])
+        self.assertTrue(all(item["parsed"] for item in stats["items"]))
+
+    def test_short_unparsed_reply_is_not_retried(self):
+        pipe = FakePipe(["not json"])
+        agent = PlanAnalyzer(pipe, token_budget=self.warm_budget(AGENT2_PROMPT_VERSION, tokens=200), token_log=TokenLog())
+        agent.analyze({}, {"medications": ["Aspirin"]})
+        self.assertEqual(len(pipe.calls), 1)
+
+    def test_outputs_are_logged_with_variant_and_size(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log = TokenLog(os.path.join(tmp, "tokens.jsonl"))
+            agent = PlanAnalyzer(FakePipe(['{"medication_review": {}}']), token_log=log)
+            agent.analyze({}, {"medications": ["Aspirin"], "lab_tests": ["CBC", "TSH"]})
+            with open(log.path) as f:
+                record = json.loads(f.readline())
+        self.assertEqual(record["variant"], AGENT2_PROMPT_VERSION)
+        self.assertEqual(record["size"], 3)
+        self.assertEqual(record["max_new_tokens"], 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import sys
+import os
+import asyncio
+import tempfile
+import unittest
+import importlib.util
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from medflow.workflow import MedFlowWorkflow, _portable_image, _model_image
+from test_agents import FakePipe, SOA_REPLY
+
+HAS_LANGGRAPH = all(importlib.util.find_spec(m) for m in ("langgraph", "aiosqlite"))
+PLAN = {"medications": ["Omeprazole 20mg once daily"], "lab_tests": ["CBC"], "follow_up": "2 weeks"}
+ANALYSIS_REPLY = '{"medication_review": {"alignment_score": 80}}'
+
+
+class TestImages(unittest.TestCase):
+    def test_pil_images_round_trip_as_png_bytes(self):
+        from PIL import Image
+
+        image = Image.new("RGB", (4, 3), (200, 10, 10))
+        stored = _portable_image(image)
+        self.assertIsInstance(stored, bytes)
+        self.assertEqual(_model_image(stored).convert("RGB").tobytes(), image.tobytes())
+        self.assertEqual(_portable_image("scan.png"), "scan.png")
+
+
+@unittest.skipUnless(HAS_LANGGRAPH, "requires langgraph and langgraph-checkpoint-sqlite")
+class TestDurableWorkflow(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp.name, "workflow.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_pause_and_resume_in_another_workflow(self):
+        async def start():
+            async with MedFlowWorkflow(FakePipe([SOA_REPLY]), self.db) as workflow:
+                note = await workflow.start("enc-1", {"age": 45}, ethnicity="South Asian")
+                return note, await workflow.state("enc-1")
+
+        note, state = asyncio.run(start())
+        self.assertEqual(note["assessment"], "assess")
+        self.assertEqual(state["status"], "paused")
+
+        # A fresh process: only Agent 2's reply is available, so Agent 1 must not run again
+        pipe = FakePipe([ANALYSIS_REPLY])
+
+        async def resume():
+            async with MedFlowWorkflow(pipe, self.db) as workflow:
+                output = await workflow.resume("enc-1", PLAN)
+                return output, await workflow.state("enc-1")
+
+        output, state = asyncio.run(resume())
+        self.assertEqual(len(pipe.calls), 1)
+        self.assertEqual(output["medication_review"]["alignment_score"], 80)
+        self.assertEqual(state["status"], "done")
+        self.assertEqual(state["doctor_plan"], PLAN)
+
+    def test_many_paused_encounters_and_errors(self):
+        async def run():
+            async with MedFlowWorkflow(FakePipe([SOA_REPLY] * 20), self.db) as workflow:
+                await asyncio.gather(*(workflow.start(f"enc-{i}", {"age": i}) for i in range(20)))
+                paused = [await workflow.is_paused(f"enc-{i}") for i in range(20)]
+                with self.assertRaises(ValueError):
+                    await workflow.start("enc-0", {"age": 1})
+                with self.assertRaises(ValueError):
+                    await workflow.resume("unknown", PLAN)
+                return paused, await workflow.state("unknown")
+
+        paused, unknown = asyncio.run(run())
+        self.assertTrue(all(paused))
+        self.assertEqual(unknown, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
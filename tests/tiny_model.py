@@ -0,0 +1,74 @@
+"""
+A tiny, offline, character-level causal LM wrapped in the chat-pipeline interface
+the agents use. Weights are random; the lm_head is zeroed so greedy decoding picks
+the lowest allowed token id, which keeps constrained outputs short and deterministic.
+With `random_head=True` it is random too, so greedy replies are varied text.
+"""
+import string
+
+PUNCTUATION_FIRST = ['"', "]", "}", ",", ":", "{", "["]
+
+CHAT_TEMPLATE = (
+    "{% for m in messages %}{{ m['role'] }}: "
+    "{% if m['content'] is string %}{{ m['content'] }}"
+    "{% else %}{% for c in m['content'] %}{% if c['type'] == 'text' %}{{ c['text'] }}{% endif %}{% endfor %}"
+    "{% endif %}\n{% endfor %}{% if add_generation_prompt %}assistant: {% endif %}"
+)
+
+
+def build_tiny_model(random_head: bool = False):
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers, decoders
+    from transformers import PreTrainedTokenizerFast, LlamaConfig, LlamaForCausalLM
+
+    vocab = {"<pad>": 0, "<s>": 1, "</s>": 2, "<unk>": 3}
+    for ch in PUNCTUATION_FIRST + list(string.printable):
+        vocab.setdefault(ch, len(vocab))
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    backend.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, bos_token="<s>", eos_token="</s>", pad_token="<pad>", unk_token="<unk>",
+        model_input_names=["input_ids", "attention_mask"],
+    )
+    tokenizer.chat_template = CHAT_TEMPLATE
+    tokenizer.padding_side = "left"
+
+    torch.manual_seed(0)
+    model = LlamaForCausalLM(LlamaConfig(
+        vocab_size=len(vocab), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=2, num_key_value_heads=2, max_position_embeddings=8192,
+        pad_token_id=0, bos_token_id=1, eos_token_id=2,
+    ))
+    with torch.no_grad():
+        if random_head:
+            model.lm_head.weight.normal_(0, 1.0)
+        else:
+            model.lm_head.weight.zero_()
+    model.eval()
+    return model, tokenizer
+
+
+class TinyChatPipe:
+    """Chat pipeline over the tiny model: pipe(text=messages or [messages, ...], max_new_tokens=...)."""
+
+    def __init__(self, random_head: bool = False):
+        self.model, self.tokenizer = build_tiny_model(random_head)
+
+    def __call__(self, text, max_new_tokens: int = 64, generate_kwargs: dict = None, batch_size: int = None, **kwargs):
+        batched = bool(text) and isinstance(text[0], list)
+        conversations = text if batched else [text]
+        prompts = [
+            self.tokenizer.apply_chat_template(c, add_generation_prompt=True, tokenize=False)
+            for c in conversations
+        ]
+        encoded = self.tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=False)
+        generated = self.model.generate(
+            **encoded, max_new_tokens=max_new_tokens, do_sample=False, **(generate_kwargs or {})
+        )
+        replies = self.tokenizer.batch_decode(generated[:, encoded["input_ids"].shape[1]:], skip_special_tokens=True)
+        outputs = [
+            [{"generated_text": c + [{"role": "assistant", "content": reply}]}]
+            for c, reply in zip(conversations, replies)
+        ]
+        return outputs if batched else outputs[0]